@@ -0,0 +1,301 @@
+"""
+Measures wall time, throughput and peak memory of the four lambda_handlers on
+generated snapshots, with S3 in moto and each wrangler invoking its method in
+process.
+
+    python benchmarks/benchmark_handlers.py --output results.json
+    python benchmarks/benchmark_handlers.py --contributors 1000 10000 \\
+        --handlers takeon_method --baseline results.json
+
+Each handler and size runs in a fresh process, so peak memory is its own. A
+wrangler's peak includes its method's. The takeon wrangler runs one shard unless
+--max-shards is given, as shards here share one process rather than running in
+parallel. --parallel-workers has the takeon method transform the snapshot in that
+many processes. The results are saved as JSON, and
+--baseline prints each time against an earlier results file.
+"""
+import argparse
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snapshot_generator  # noqa: E402
+
+HANDLERS = ["takeon_wrangler", "takeon_method", "bricks_wrangler", "bricks_method"]
+SIZES = [1000, 10000, 100000, 1000000]
+
+_BUCKET = "benchmark"
+_PERIOD = "201809"
+_SNAPSHOT = "snapshot.json"
+_BRICK_ROWS = "takeon-output"
+
+
+def reset_peak_memory():
+    """
+    Resets the process's peak resident memory where Linux allows it.
+    :return: Boolean - Whether it was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory():
+    """
+    :return: Int - Peak resident memory of the process in bytes, since
+        reset_peak_memory where it could be reset.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def invoke_in_process(handler):
+    """
+    :param handler: Function - Method lambda_handler.
+    :return: Function - Replacement for the Lambda client's invoke running it.
+    """
+    def invoke(FunctionName, Payload):  # noqa: N803
+        output = handler(json.loads(Payload), None)
+        return {"Payload": io.BytesIO(json.dumps(output).encode("utf-8"))}
+    return invoke
+
+
+def build_event(handler_name, path, surveys, responses):
+    """
+    :param handler_name: String - One of HANDLERS.
+    :param path: String - Generated snapshot, or takeon output for the bricks.
+    :param surveys: Int - Number of surveys in the snapshot.
+    :param responses: Int - Number of responses per contributor.
+    :return: Dict - Event to run the handler with.
+    """
+    common = {"bpm_queue_url": "benchmark", "environment": "benchmark",
+              "run_id": "benchmark", "survey": "BMI_SG"}
+    wrangler = {"out_file_name": "output.json", "sns_topic_arn": "benchmark",
+                "total_steps": 6}
+    if handler_name == "takeon_wrangler":
+        return {"RuntimeVariables": dict(
+            common, **wrangler, period=_PERIOD, periodicity="03",
+            ingestion_parameters=snapshot_generator.ingestion_parameters(
+                surveys, responses),
+            snapshot_s3_uri=f"s3://{_BUCKET}/{_SNAPSHOT}")}
+    if handler_name == "takeon_method":
+        return {"RuntimeVariables": dict(
+            common, **snapshot_generator.ingestion_parameters(surveys, responses),
+            period=_PERIOD, periodicity="03",
+            snapshot_s3_uri=f"s3://{_BUCKET}/{_SNAPSHOT}",
+            snapshot_size=os.path.getsize(path))}
+    if handler_name == "bricks_wrangler":
+        return {"RuntimeVariables": dict(
+            common, **wrangler, in_file_name=_BRICK_ROWS,
+            ingestion_parameters=snapshot_generator.brick_ingestion_parameters())}
+    with open(path, "rb") as file:
+        data = json.loads(file.read())
+    return {"RuntimeVariables": dict(
+        common, **snapshot_generator.brick_ingestion_parameters(), data=data)}
+
+
+def run_case(handler_name, path, surveys, responses, max_shards, parallel_workers,
+             queue):
+    """
+    Runs one handler on one generated file, in its own process.
+    :param handler_name: String - One of HANDLERS.
+    :param path: String - Generated snapshot, or takeon output for the bricks.
+    :param surveys: Int - Number of surveys in the snapshot.
+    :param responses: Int - Number of responses per contributor.
+    :param max_shards: Int - Most shards the takeon wrangler splits the method into.
+    :param parallel_workers: Int - Most processes the takeon method transforms in,
+        None for one.
+    :param queue: Queue - The case's result is put on this.
+    """
+    os.environ.update({"AWS_ACCESS_KEY_ID": "benchmark",
+                       "AWS_SECRET_ACCESS_KEY": "benchmark",
+                       "AWS_DEFAULT_REGION": "eu-west-2",
+                       "max_shards": str(max_shards),
+                       "method_name": "benchmark-method",
+                       "results_bucket_name": _BUCKET})
+    if parallel_workers is not None:
+        os.environ["parallel_workers"] = str(parallel_workers)
+    import boto3
+    from es_aws_functions import aws_functions
+    from moto import mock_s3
+
+    import ingest_brick_type_method
+    import ingest_brick_type_wrangler
+    import ingest_takeon_data_method
+    import ingest_takeon_data_wrangler
+
+    modules = {
+        "takeon": (ingest_takeon_data_wrangler, ingest_takeon_data_method),
+        "bricks": (ingest_brick_type_wrangler, ingest_brick_type_method)
+    }
+    pipeline, kind = handler_name.split("_")
+    wrangler, method = modules[pipeline]
+
+    with mock_s3(), mock.patch.object(aws_functions, "send_bpm_status"), \
+            mock.patch.object(aws_functions, "send_sns_message"):
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket=_BUCKET, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        if pipeline == "takeon":
+            s3_client.upload_file(path, _BUCKET, _SNAPSHOT)
+        elif kind == "wrangler":
+            s3_client.upload_file(path, _BUCKET, _BRICK_ROWS + ".json")
+        event = build_event(handler_name, path, surveys, responses)
+        if handler_name == "takeon_method" and parallel_workers is not None:
+            event["RuntimeVariables"]["parallel_workers"] = parallel_workers
+        handler = wrangler.lambda_handler if kind == "wrangler" else \
+            method.lambda_handler
+
+        # The wranglers' Lambda clients invoke the method in this process.
+        lambda_client = mock.Mock()
+        lambda_client.invoke.side_effect = invoke_in_process(method.lambda_handler)
+        real_client = boto3.client
+
+        def client(service_name, *args, **kwargs):
+            if service_name == "lambda":
+                return lambda_client
+            return real_client(service_name, *args, **kwargs)
+
+        with mock.patch.object(boto3, "client", client):
+            memory_reset = reset_peak_memory()
+            start = time.perf_counter()
+            try:
+                output = handler(event, None)
+            except Exception as e:
+                output = {"success": False, "error": repr(e)}
+            seconds = time.perf_counter() - start
+
+    queue.put({"seconds": seconds, "peak_memory": peak_memory(),
+               "memory_reset": memory_reset, "success": output["success"],
+               "error": output.get("error")})
+
+
+def run(handlers, sizes, surveys, periods, responses, form_bloat, max_shards,
+        parallel_workers=None):
+    """
+    :return: List - A result dict per handler and size.
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        for contributors in sizes:
+            files = {}
+            snapshot_path = os.path.join(directory, f"snapshot-{contributors}.json")
+            with open(snapshot_path, "wb") as file:
+                snapshot_generator.write_snapshot(file, contributors, surveys, periods,
+                                                  responses, form_bloat, _PERIOD)
+            files["takeon"] = snapshot_path
+            brick_rows_path = os.path.join(directory, f"bricks-{contributors}.json")
+            with open(brick_rows_path, "wb") as file:
+                snapshot_generator.write_brick_rows(file, contributors, _PERIOD)
+            files["bricks"] = brick_rows_path
+
+            for handler_name in handlers:
+                path = files[handler_name.split("_")[0]]
+                queue = context.Queue()
+                process = context.Process(target=run_case, args=(
+                    handler_name, path, surveys, responses, max_shards,
+                    parallel_workers, queue))
+                process.start()
+                case = queue.get()
+                process.join()
+                result = {
+                    "handler": handler_name,
+                    "contributors": contributors,
+                    "input_bytes": os.path.getsize(path),
+                    "seconds": round(case["seconds"], 4),
+                    "contributors_per_second": round(contributors / case["seconds"], 1),
+                    "megabytes_per_second": round(
+                        os.path.getsize(path) / 1e6 / case["seconds"], 2),
+                    "peak_memory_mb": round(case["peak_memory"] / 1e6, 1),
+                    "success": case["success"]
+                }
+                if not case["memory_reset"]:
+                    # Includes generating the case's input in moto.
+                    result["peak_memory_includes_setup"] = True
+                if case["error"]:
+                    result["error"] = case["error"]
+                results.append(result)
+                print(f"{handler_name:16} {contributors:>8} contributors "
+                      f"{result['seconds']:9.3f}s "
+                      f"{result['contributors_per_second']:>10}/s "
+                      f"{result['peak_memory_mb']:8.1f} MB"
+                      f"{'' if result['success'] else '  FAILED'}")
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {(result["handler"], result["contributors"]): result
+                    for result in json.load(file)["results"]}
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        previous = baseline.get((result["handler"], result["contributors"]))
+        if previous is None:
+            continue
+        print(f"{result['handler']:16} {result['contributors']:>8} contributors "
+              f"time x{result['seconds'] / previous['seconds']:.2f} "
+              f"memory x{result['peak_memory_mb'] / previous['peak_memory_mb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--handlers", nargs="+", choices=HANDLERS, default=HANDLERS)
+    parser.add_argument("--contributors", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--surveys", type=int, default=2)
+    parser.add_argument("--periods", type=int, default=4,
+                        help="Periods in the snapshot, the ingest keeps two.")
+    parser.add_argument("--responses", type=int, default=8,
+                        help="Responses per contributor.")
+    parser.add_argument("--form-bloat", type=int, default=1,
+                        help="Forms per survey the ingest doesn't use.")
+    parser.add_argument("--max-shards", type=int, default=1,
+                        help="Most shards the takeon wrangler splits the method into.")
+    parser.add_argument("--parallel-workers", type=int,
+                        help="Most processes the takeon method transforms in.")
+    parser.add_argument("--output", help="File to save the results to, as JSON.")
+    parser.add_argument("--baseline", help="Earlier results file to compare with.")
+    args = parser.parse_args()
+
+    results = run(args.handlers, args.contributors, args.surveys, args.periods,
+                  args.responses, args.form_bloat, args.max_shards,
+                  args.parallel_workers)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "parameters": {"surveys": args.surveys,
+                                      "periods": args.periods,
+                                      "responses": args.responses,
+                                      "form_bloat": args.form_bloat,
+                                      "max_shards": args.max_shards,
+                                      "parallel_workers": args.parallel_workers},
+                       "results": results}, file, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
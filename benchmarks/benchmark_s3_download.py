@@ -0,0 +1,81 @@
+"""
+Compares reading a snapshot with a single GET against ingest_s3_download.
+
+Against a real bucket:
+    python benchmarks/benchmark_s3_download.py --bucket <bucket> --key <key>
+Without a bucket a moto one is made holding --size bytes, which checks the code
+path rather than network throughput.
+"""
+import argparse
+import os
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ingest_s3_download  # noqa: E402
+
+
+def time_call(function, repeats):
+    """
+    :param function: Function to time, taking no arguments.
+    :param repeats: Int - Number of times to call it.
+    :return: Float - Fastest call in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(s3_client, bucket_name, file_name, part_sizes, repeats):
+    size = s3_client.head_object(Bucket=bucket_name, Key=file_name)["ContentLength"]
+    print(f"{file_name}: {size / 1e6:.1f} MB, best of {repeats}")
+
+    def single_get():
+        s3_client.get_object(Bucket=bucket_name, Key=file_name)["Body"].read()
+
+    seconds = time_call(single_get, repeats)
+    print(f"  single GET        {seconds:8.3f}s {size / 1e6 / seconds:8.1f} MB/s")
+    for part_size in part_sizes:
+        seconds = time_call(
+            lambda: ingest_s3_download.download(s3_client, bucket_name, file_name,
+                                                size, part_size), repeats)
+        print(f"  {part_size / 2 ** 20:5.0f} MiB parts    {seconds:8.3f}s "
+              f"{size / 1e6 / seconds:8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--bucket", help="Bucket holding the snapshot.")
+    parser.add_argument("--key", help="Key of the snapshot.")
+    parser.add_argument("--size", type=int, default=200,
+                        help="MB of data to put in the moto bucket.")
+    parser.add_argument("--part-size", type=int, nargs="+", default=[8, 16, 32],
+                        help="Part sizes to try, in MiB.")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    part_sizes = [part_size * 2 ** 20 for part_size in args.part_size]
+
+    if args.bucket:
+        run(boto3.client("s3"), args.bucket, args.key, part_sizes, args.repeats)
+        return
+
+    from moto import mock_s3
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket="benchmark",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        s3_client.put_object(Bucket="benchmark", Key="snapshot.json",
+                             Body=os.urandom(args.size * 10 ** 6))
+        run(s3_client, "benchmark", "snapshot.json", part_sizes, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
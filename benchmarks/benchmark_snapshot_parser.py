@@ -0,0 +1,94 @@
+"""
+Checks streaming the contributors out of a generated snapshot with
+ingest_snapshot_parser is no slower than decoding the whole document with
+json.loads, which it replaces for snapshots passed by reference.
+
+    python benchmarks/benchmark_snapshot_parser.py --contributors 100000
+
+Exits with status 1 if the streamed parse is the slower of the two.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snapshot_generator  # noqa: E402
+
+import ingest_snapshot_parser  # noqa: E402
+
+
+def time_call(function, repeats):
+    """
+    :param function: Function to time, taking no arguments.
+    :param repeats: Int - Number of times to call it.
+    :return: Float - Fastest call in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(raw_snapshot, survey_codes, periods, repeats):
+    """
+    :return: Dict - Fastest time in seconds of each way of reading the snapshot.
+    """
+    def whole_document():
+        snapshot = json.loads(raw_snapshot)
+        return [contributor for survey in snapshot["data"]["allSurveys"]["nodes"]
+                if survey["survey"] in survey_codes
+                for contributor in survey["contributorsBySurvey"]["nodes"]
+                if contributor["period"] in periods]
+
+    def streamed(source):
+        return lambda: sum(1 for _ in ingest_snapshot_parser.iter_contributors(
+            source(), survey_codes, periods))
+
+    buffer = bytearray(raw_snapshot)
+    timings = {
+        "json.loads": time_call(whole_document, repeats),
+        "streamed": time_call(streamed(lambda: io.BytesIO(raw_snapshot)), repeats),
+        "buffer": time_call(streamed(lambda: buffer), repeats),
+        "index": time_call(lambda: ingest_snapshot_parser.index_contributors(
+            io.BytesIO(raw_snapshot)), repeats)
+    }
+    print(f"{len(raw_snapshot) / 1e6:.1f} MB, best of {repeats}")
+    for name, seconds in timings.items():
+        print(f"  {name:12} {seconds:8.3f}s "
+              f"{len(raw_snapshot) / 1e6 / seconds:8.1f} MB/s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--contributors", type=int, default=20000)
+    parser.add_argument("--periods", type=int, default=2,
+                        help="Periods in the snapshot, the latest two are read.")
+    parser.add_argument("--form-bloat", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryFile() as file:
+        snapshot_generator.write_snapshot(file, args.contributors,
+                                          periods=args.periods,
+                                          form_bloat=args.form_bloat)
+        file.seek(0)
+        raw_snapshot = file.read()
+    survey_codes = snapshot_generator.ingestion_parameters()["survey_codes"]
+    periods = snapshot_generator.period_list("201809", 2)
+
+    timings = run(raw_snapshot, survey_codes, periods, args.repeats)
+    if timings["streamed"] > timings["json.loads"]:
+        sys.exit("The streamed parse is slower than json.loads.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Writes synthetic Take On snapshots with the same structure as a real one, and
+takeon outputs for the brick type handlers, at any size.
+
+    python benchmarks/snapshot_generator.py snapshot.json --contributors 100000
+
+Contributors are spread over the surveys and periods in turn, the latest period
+first, so each survey holds contributors // surveys of them. Every survey also
+carries its forms, questions and validation outputs, which the ingest steps over;
+--form-bloat sets how many of each there are.
+"""
+import argparse
+import json
+import random
+
+STATUSES = ["Form Sent Out", "Clear", "Overridden", "Form Saved"]
+# Results pipeline codes of the brick type questions, see brick_ingestion_parameters.
+BRICK_QUESTIONS = ["opening_stock", "produced", "deliveries", "closing_stock"]
+BRICK_KINDS = ["commons", "facings", "engineering"]
+BRICK_TYPES = {2: "clay", 3: "concrete", 4: "sandlime"}
+
+_CREATED = {"createdby": "takeonadmin",
+            "createddate": "2019-07-09T09:37:32.935503+00:00",
+            "lastupdatedby": None, "lastupdateddate": None}
+
+
+def survey_code(index):
+    """
+    :param index: Int - Index of the survey.
+    :return: String - Take On survey code, 0066, 0076 and so on.
+    """
+    return f"{66 + 10 * index:04d}"
+
+
+def question_code(index):
+    """
+    :param index: Int - Index of the question.
+    :return: String - Take On question code, 0601, 0602 and so on.
+    """
+    return f"{601 + index:04d}"
+
+
+def period_list(period, count, periodicity=3):
+    """
+    :param period: String - Latest period, YYYYMM.
+    :param count: Int - Number of periods.
+    :param periodicity: Int - Months between periods.
+    :return: List - The periods, latest first.
+    """
+    months = int(period[:4]) * 12 + int(period[4:]) - 1
+    return [f"{(months - step) // 12}{(months - step) % 12 + 1:02d}"
+            for step in range(0, count * periodicity, periodicity)]
+
+
+def ingestion_parameters(surveys=2, responses=8):
+    """
+    :param surveys: Int - Number of surveys in the snapshot.
+    :param responses: Int - Number of responses per contributor.
+    :return: Dict - question_labels, survey_codes and statuses to ingest a
+        generated snapshot with.
+    """
+    return {
+        "question_labels": {question_code(index): f"Q{question_code(index)[1:]}"
+                            for index in range(responses)},
+        "survey_codes": {survey_code(index): survey_code(index)[1:]
+                         for index in range(surveys)},
+        "statuses": {"Form Sent Out": 1, "Clear": 2, "Overridden": 2}
+    }
+
+
+def _write_nodes(file, nodes):
+    file.write(b'{"nodes":[')
+    for index, node in enumerate(nodes):
+        if index:
+            file.write(b",")
+        file.write(node)
+    file.write(b"]}")
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _survey_nodes(survey, responses, form_bloat):
+    # Forms each define every question, as the real ones do.
+    forms = (_dumps(dict({
+        "formid": form, "survey": survey, "description": "Synthetic form",
+        "periodstart": "200903", "periodend": "999912",
+        "formdefinitionsByFormid": {"nodes": [dict({
+            "formid": form, "questioncode": question_code(index),
+            "displayquestionnumber": str(index + 1),
+            "displaytext": f"Question {index + 1} of the synthetic form",
+            "displayorder": index, "type": "NUMERIC", "derivedformula": ""},
+            **_CREATED) for index in range(responses)]}}, **_CREATED))
+        for form in range(1, form_bloat + 1))
+    questions = (_dumps(dict({"survey": survey, "questioncode": question_code(index)},
+                             **_CREATED)) for index in range(responses))
+    validation_outputs = (_dumps(dict({
+        "validationoutputid": index + 1, "reference": f"{77700000000 + index}",
+        "period": "201512", "survey": survey[1:], "validationid": "10",
+        "instance": "0", "primaryvalue": "338585122",
+        "formula": '338585122 != " "'}, **_CREATED))
+        for index in range(form_bloat * responses))
+    return forms, questions, validation_outputs
+
+
+def _contributor(rng, survey, period, reference, responses):
+    return dict({
+        "reference": reference, "period": period, "survey": survey, "formid": 1,
+        "status": rng.choice(STATUSES),
+        "receiptdate": "2019-07-09T09:37:32.935503+00:00",
+        "lockedby": None, "lockeddate": None, "formtype": "0001",
+        "checkletter": "X", "frozensic": "69091", "rusic": "69091",
+        "frozenemployees": "0", "employees": "0", "employment": "0",
+        "fteemployment": "0.000", "turnover": "0",
+        "enterprisereference": f"{9900000000 + int(reference) % 10 ** 9}",
+        "cellnumber": "0", "currency": "S", "legalstatus": " ",
+        "region": rng.choice(["AA", "BA", "CA", "DC", "EB", "FE", "GD", "NP"]),
+        "enterprisename": "Synthetic enterprise", "referencename": "",
+        "referenceaddress": "", "referencepostcode": "", "tradingstyle": "",
+        "selectiontype": " ", "inclusionexclusion": " ",
+        "responsesByReferenceAndPeriodAndSurvey": {"nodes": [dict({
+            "reference": reference.ljust(11), "period": period, "survey": survey,
+            "questioncode": question_code(index), "instance": 0,
+            "response": str(rng.randrange(10 ** 9))}, **_CREATED)
+            for index in range(responses)]}}, **_CREATED)
+
+
+def write_snapshot(file, contributors, surveys=2, periods=2, responses=8,
+                   form_bloat=1, period="201809", periodicity=3, seed=0):
+    """
+    Writes a snapshot a contributor at a time, so any size can be made in little
+    memory.
+    :param file: Binary file-like object to write to.
+    :param contributors: Int - Number of contributors, over all surveys and periods.
+    :param surveys: Int - Number of surveys.
+    :param periods: Int - Number of periods, counting back from period.
+    :param responses: Int - Number of responses per contributor.
+    :param form_bloat: Int - Number of forms per survey, and validation outputs per
+        question, that the ingest doesn't use.
+    :param period: String - Latest period, YYYYMM.
+    :param periodicity: Int - Months between periods.
+    :param seed: Int - Seed for the responses and statuses, so runs are repeatable.
+    """
+    rng = random.Random(seed)
+    snapshot_periods = period_list(period, periods, periodicity)
+    file.write(b'{"data":{"allSurveys":{"nodes":[')
+    for survey_index in range(surveys):
+        survey = survey_code(survey_index)
+        if survey_index:
+            file.write(b",")
+        file.write(_dumps(dict({"survey": survey,
+                                "description": f"Synthetic survey {survey}",
+                                "periodicity": "quarterly"}, **_CREATED))[:-1])
+        forms, questions, validation_outputs = _survey_nodes(survey, responses,
+                                                             form_bloat)
+        file.write(b',"formsBySurvey":')
+        _write_nodes(file, forms)
+        file.write(b',"questionsBySurvey":')
+        _write_nodes(file, questions)
+        file.write(b',"contributorsBySurvey":')
+        _write_nodes(file, (
+            _dumps(_contributor(rng, survey,
+                                snapshot_periods[index % periods],
+                                str(77700000000 + index), responses))
+            for index in range(survey_index, contributors, surveys)))
+        file.write(b',"validationoutputsBySurvey":')
+        _write_nodes(file, validation_outputs)
+        file.write(b"}")
+    file.write(b"]}}}")
+
+
+def brick_ingestion_parameters():
+    """
+    :return: Dict - brick_questions, brick_types and brick_type_column to expand
+        generated brick rows with.
+    """
+    return {
+        "brick_questions": {
+            brick_type: {f"{question}_{kind}": f"{name}_{question}_{kind}"
+                         for question in BRICK_QUESTIONS for kind in BRICK_KINDS}
+            for brick_type, name in BRICK_TYPES.items()},
+        "brick_types": list(BRICK_TYPES),
+        "brick_type_column": "brick_type"
+    }
+
+
+def write_brick_rows(file, contributors, period="201809", seed=0):
+    """
+    Writes a takeon output, as the brick type handlers read, a row at a time.
+    :param file: Binary file-like object to write to.
+    :param contributors: Int - Number of rows.
+    :param period: String - Period of the rows.
+    :param seed: Int - Seed for the responses, so runs are repeatable.
+    """
+    rng = random.Random(seed)
+    file.write(b"[")
+    for index in range(contributors):
+        if index:
+            file.write(b",")
+        row = {"survey": "047", "period": period,
+               "responder_id": str(49900000000 + index),
+               "gor_code": rng.choice(["NP", "AA", "BA"]),
+               "enterprise_reference": str(9900000000 + index),
+               "enterprise_name": "Synthetic enterprise"}
+        for question in BRICK_QUESTIONS:
+            for kind in BRICK_KINDS:
+                row[f"{question}_{kind}"] = rng.randrange(1000)
+        for question in BRICK_QUESTIONS:
+            row[f"total_{question}"] = sum(row[f"{question}_{kind}"]
+                                           for kind in BRICK_KINDS)
+        row["brick_type"] = rng.choice(list(BRICK_TYPES))
+        row["response_type"] = rng.choice([1, 2])
+        file.write(_dumps(row))
+    file.write(b"]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("path", help="File to write.")
+    parser.add_argument("--contributors", type=int, default=1000)
+    parser.add_argument("--surveys", type=int, default=2)
+    parser.add_argument("--periods", type=int, default=2)
+    parser.add_argument("--responses", type=int, default=8,
+                        help="Responses per contributor.")
+    parser.add_argument("--form-bloat", type=int, default=1,
+                        help="Forms per survey the ingest doesn't use.")
+    parser.add_argument("--bricks", action="store_true",
+                        help="Write a takeon output for the brick type handlers.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.path, "wb") as file:
+        if args.bricks:
+            write_brick_rows(file, args.contributors, seed=args.seed)
+        else:
+            write_snapshot(file, args.contributors, args.surveys, args.periods,
+                           args.responses, args.form_bloat, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
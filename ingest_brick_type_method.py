@@ -1,8 +1,33 @@
-import json
 import logging
 
+import boto3
+import pandas as pd
 from es_aws_functions import general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, ValidationError, fields, validates_schema
+from marshmallow.validate import OneOf, Range
+
+import ingest_codec
+import ingest_json
+import ingest_metrics
+import ingest_output_format
+import ingest_plan
+import ingest_s3_upload
+import ingest_warm_state
+
+
+def validate_respondents(data):
+    """
+    Cheap structural check of the respondents, only the first one is looked at.
+    The rest are checked by the transform as it goes.
+    :param data: Respondents, as passed in the runtime variables.
+    """
+    if isinstance(data, str):
+        # Compressed, it is checked once decompressed.
+        return
+    if not isinstance(data, list):
+        raise ValidationError("Not a valid list.")
+    if data and not isinstance(data[0], dict):
+        raise ValidationError("Respondent 0 is not a valid mapping type.")
 
 
 class RuntimeSchema(Schema):
@@ -18,9 +43,33 @@ class RuntimeSchema(Schema):
     brick_questions = fields.Dict(required=True)
     brick_type_column = fields.Str(required=True)
     brick_types = fields.List(fields.Int(required=True))
-    data = fields.List(fields.Dict(required=True))
+    # Passed through as is rather than walked and copied by fields.List.
+    data = fields.Raw(validate=validate_respondents)
     environment = fields.Str(required=True)
+    metrics = fields.Bool(missing=False)
+    out_file_name = fields.Str()
+    output_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    output_format = fields.Str(missing=ingest_output_format.JSON,
+                               validate=OneOf(ingest_output_format.FORMATS))
+    payload_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    results_bucket_name = fields.Str()
     survey = fields.Str(required=True)
+    upload_part_size = fields.Int(validate=Range(min=ingest_s3_upload.MIN_PART_SIZE))
+
+    @validates_schema
+    def validate_output(self, data, **kwargs):
+        # When given an output file the method streams its output to the results
+        # bucket itself.
+        if "out_file_name" in data:
+            for field in ["results_bucket_name", "upload_part_size"]:
+                if field not in data:
+                    raise ValidationError("Missing data for required field.", field)
+
+    @validates_schema
+    def validate_payload_compression(self, data, **kwargs):
+        # Compressed data is passed as a base64 string.
+        if isinstance(data.get("data"), str) and "payload_compression" not in data:
+            raise ValidationError("Not a valid list.", "data")
 
 
 def lambda_handler(event, context):
@@ -42,7 +91,8 @@ def lambda_handler(event, context):
         # Because it is used in exception handling
         run_id = event['RuntimeVariables']['run_id']
         # Extract runtime variables.
-        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        runtime_variables = ingest_warm_state.get_schema(
+            RuntimeSchema).load(event["RuntimeVariables"])
 
         bpm_queue_url = runtime_variables["bpm_queue_url"]
         brick_questions = runtime_variables['brick_questions']
@@ -50,7 +100,14 @@ def lambda_handler(event, context):
         brick_types = runtime_variables['brick_types']
         data = runtime_variables['data']
         environment = runtime_variables["environment"]
+        metrics_enabled = runtime_variables["metrics"]
+        out_file_name = runtime_variables.get("out_file_name")
+        output_compression = runtime_variables.get("output_compression")
+        output_format = runtime_variables["output_format"]
+        payload_compression = runtime_variables.get("payload_compression")
+        results_bucket_name = runtime_variables.get("results_bucket_name")
         survey = runtime_variables["survey"]
+        upload_part_size = runtime_variables.get("upload_part_size")
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -58,7 +115,7 @@ def lambda_handler(event, context):
         return {"success": False, "error": error_message}
 
     try:
-        logger = general_functions.get_logger(survey, current_module, environment,
+        logger = ingest_warm_state.get_logger(survey, current_module, environment,
                                               run_id)
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
@@ -67,38 +124,55 @@ def lambda_handler(event, context):
         return {"success": False, "error": error_message}
 
     try:
+        ingest_metrics.start(metrics_enabled, current_module, run_id, survey=survey)
         logger.info("Started - retrieved wrangler configuration variables.")
-        # Apply changes to every responder and every brick type
-        for respondent in data:
-            for this_type in brick_types:
-
-                # When it's not the brick type this responder supplied, fill with 0s.
-                if respondent[brick_type_column] != this_type:
-                    for this_question in brick_questions[str(this_type)]:
-                        respondent[brick_questions[str(this_type)][this_question]] = 0
-
-                # When it's the same as responder supplied, use their data.
-                else:
-                    for this_question in brick_questions[str(this_type)]:
-                        respondent[brick_questions[str(this_type)][this_question]] = \
-                            respondent[this_question]
-
-            # Remove the 'shared' questions for respondents
-            if str(respondent[brick_type_column]) in str(brick_types):
-                for this_question in brick_questions[str(respondent[brick_type_column])]:
-                    respondent.pop(this_question, None)
-            # Remove the 'shared' question for non-respondents
-            else:
-                for this_question in next(iter(brick_questions)):
-                    respondent.pop(this_question, None)
+        if payload_compression is not None:
+            with ingest_metrics.stage("decode"):
+                data = ingest_json.loads(ingest_codec.decode_payload_data(
+                    data, payload_compression))
+            validate_respondents(data)
+        # Apply changes to every responder and every brick type at once.
+        if data:
+            if not all(isinstance(respondent, dict) for respondent in data):
+                raise ValueError("Invalid data: every respondent must be an object.")
+            ingest_metrics.add("respondents", len(data))
+            with ingest_metrics.stage("expand"):
+                data_df = ingest_plan.expand_brick_types(
+                    pd.DataFrame(data), brick_questions, brick_types,
+                    brick_type_column)
+        else:
+            data_df = pd.DataFrame()
 
         logger.info("Successfully expanded brick data.")
-        final_output = {"data": json.dumps(data)}
+        if out_file_name is not None:
+            # Upload the output as it is encoded, rather than encoding all of it
+            # first. A failed upload is aborted before the error is handled below.
+            upload = ingest_s3_upload.MultipartUpload(
+                ingest_warm_state.get_resource(boto3.resource, "s3").meta.client,
+                results_bucket_name, out_file_name, upload_part_size,
+                output_compression, ingest_output_format.content_type(output_format))
+            # Encoded as it is uploaded, so this includes encoding it.
+            with ingest_metrics.stage("write_output"):
+                ingest_s3_upload.upload_chunks(
+                    ingest_output_format.iter_chunks(data_df, output_format), [upload])
+            ingest_metrics.add("output_bytes", upload.size, ingest_metrics.BYTES)
+            logger.info("Data ready for Results pipeline. Streamed to S3.")
+            final_output = {}
+        else:
+            with ingest_metrics.stage("encode"):
+                output = ingest_output_format.encode(data_df, output_format)
+            ingest_metrics.add("output_bytes", len(output), ingest_metrics.BYTES)
+            if payload_compression is not None:
+                output = ingest_codec.encode_payload_data(output, payload_compression)
+            else:
+                output = ingest_output_format.encode_payload_data(output)
+            final_output = {"data": output}
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
                                                            bpm_queue_url=bpm_queue_url)
     finally:
+        ingest_metrics.emit()
         if (len(error_message)) > 0:
             logger.error(error_message)
             return {"success": False, "error": error_message}
@@ -1,10 +1,17 @@
-import json
 import logging
 import os
 
 import boto3
 from es_aws_functions import aws_functions, exception_classes, general_functions
 from marshmallow import EXCLUDE, Schema, fields
+from marshmallow.validate import OneOf, Range
+
+import ingest_codec
+import ingest_json
+import ingest_metrics
+import ingest_output_format
+import ingest_s3_upload
+import ingest_warm_state
 
 
 class EnvironmentSchema(Schema):
@@ -16,8 +23,21 @@ class EnvironmentSchema(Schema):
         logging.error(f"Error validating environment params: {e}")
         raise ValueError(f"Error validating environment params: {e}")
 
+    # Log one record of per stage timings and sizes for each run, in CloudWatch
+    # embedded metric format. Also turns them on in the method.
+    metrics_enabled = fields.Bool(missing=False)
     method_name = fields.Str(required=True)
+    # Compression of the output written to the results bucket, none by default.
+    output_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    # Format of the output written to the results bucket, a JSON array by default.
+    output_format = fields.Str(missing=ingest_output_format.JSON,
+                               validate=OneOf(ingest_output_format.FORMATS))
+    # Compression of the data in the method's invoke payload and response.
+    payload_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
     results_bucket_name = fields.Str(required=True)
+    # Have the method stream its output to the results bucket in parts of this many
+    # bytes, rather than returning it.
+    upload_part_size = fields.Int(validate=Range(min=ingest_s3_upload.MIN_PART_SIZE))
 
 
 class IngestionParamsSchema(Schema):
@@ -49,6 +69,40 @@ class RuntimeSchema(Schema):
     total_steps = fields.Int(required=True)
 
 
+def build_payload(runtime_variables, raw_data):
+    """
+    Builds the method invoke payload around data that is already JSON encoded, so it
+    is forwarded as is rather than being decoded and encoded again.
+    :param runtime_variables: Dict - Method runtime variables, without the data.
+    :param raw_data: Bytes or String - JSON encoded data.
+    :return: Bytes - JSON encoded payload.
+    """
+    if isinstance(raw_data, str):
+        raw_data = raw_data.encode("utf-8")
+    # Everything after the opening brace of the runtime variables object.
+    runtime_json = ingest_json.dumps(runtime_variables)[1:]
+    return b'{"RuntimeVariables": {"data": ' + raw_data + b", " + runtime_json + b"}"
+
+
+def input_file_name(s3_resource, bucket_name, in_file_name):
+    """
+    Finds the takeon output to read, which is named with the extension of the format
+    and compression it was written in.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the takeon output is in.
+    :param in_file_name: String - Name of the takeon output, without an extension.
+    :return: String - Key of the latest output named in_file_name with one of
+        the extensions the takeon ingest gives, in_file_name.json if there isn't one.
+    """
+    extensions = ingest_output_format.file_extensions()
+    outputs = [output for output in s3_resource.Bucket(bucket_name).objects.filter(
+               Prefix=in_file_name + ".")
+               if output.key[len(in_file_name):] in extensions]
+    if not outputs:
+        return in_file_name + ingest_output_format.EXTENSIONS[ingest_output_format.JSON]
+    return max(outputs, key=lambda output: output.last_modified).key
+
+
 def lambda_handler(event, context):
     """
     This method will take the simple bricks survey data and expand it to have seperate
@@ -69,19 +123,28 @@ def lambda_handler(event, context):
         run_id = event["RuntimeVariables"]["run_id"]
 
         # Load variables.
-        environment_variables = EnvironmentSchema().load(os.environ)
-        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        environment_variables = ingest_warm_state.get_schema(
+            EnvironmentSchema).load(os.environ)
+        runtime_variables = ingest_warm_state.get_schema(
+            RuntimeSchema).load(event["RuntimeVariables"])
 
         # Environment Variables.
+        metrics_enabled = environment_variables["metrics_enabled"]
         method_name = environment_variables["method_name"]
+        output_compression = environment_variables.get("output_compression")
+        output_format = environment_variables["output_format"]
+        payload_compression = environment_variables.get("payload_compression")
         results_bucket_name = environment_variables["results_bucket_name"]
+        upload_part_size = environment_variables.get("upload_part_size")
 
         # Runtime Variables.
         bpm_queue_url = runtime_variables["bpm_queue_url"]
         environment = runtime_variables["environment"]
         in_file_name = runtime_variables["in_file_name"]
         ingestion_parameters = runtime_variables["ingestion_parameters"]
-        out_file_name = runtime_variables["out_file_name"]
+        # Outputs other than uncompressed JSON get the extension to match.
+        out_file_name = ingest_output_format.file_name(
+            runtime_variables["out_file_name"], output_format, output_compression)
         sns_topic_arn = runtime_variables["sns_topic_arn"]
         survey = runtime_variables["survey"]
         total_steps = runtime_variables["total_steps"]
@@ -92,7 +155,7 @@ def lambda_handler(event, context):
         raise exception_classes.LambdaFailure(error_message)
 
     try:
-        logger = general_functions.get_logger(survey, current_module, environment,
+        logger = ingest_warm_state.get_logger(survey, current_module, environment,
                                               run_id)
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module, run_id,
@@ -101,46 +164,90 @@ def lambda_handler(event, context):
         raise exception_classes.LambdaFailure(error_message)
 
     try:
+        ingest_metrics.start(metrics_enabled, current_module, run_id, survey=survey)
         logger.info("Started - retrieved configuration variables.")
         # Send in progress status to BPM.
         status = "IN PROGRESS"
         current_step_num = 1
         aws_functions.send_bpm_status(bpm_queue_url, current_module, status, run_id,
                                       current_step_num, total_steps)
-        # Set up client.
-        lambda_client = boto3.client("lambda", region_name="eu-west-2")
-        data_df = aws_functions.read_dataframe_from_s3(results_bucket_name, in_file_name)
+        # Set up client, reused by later invocations of a warm container.
+        lambda_client = ingest_warm_state.get_client(boto3.client, "lambda")
+        s3_resource = ingest_warm_state.get_resource(boto3.resource, "s3")
+        with ingest_metrics.stage("read_input"):
+            in_key = input_file_name(s3_resource, results_bucket_name, in_file_name)
+            in_object = s3_resource.Object(results_bucket_name, in_key)
+            # Read the takeon output as raw bytes, it is forwarded to the method
+            # as is.
+            if in_object.content_encoding in ingest_codec.ENCODINGS or \
+                    in_object.content_type == \
+                    ingest_output_format.PARQUET_CONTENT_TYPE:
+                # Written compressed or as Parquet by the takeon wrangler or method.
+                raw_data = ingest_codec.read_from_s3(s3_resource, results_bucket_name,
+                                                     in_key)
+            else:
+                raw_data = aws_functions.read_from_s3(results_bucket_name, in_key,
+                                                      file_extension="")
+            ingest_metrics.add("input_bytes", len(raw_data), ingest_metrics.BYTES)
+            # Raises for anything that isn't one of the takeon output formats.
+            if ingest_output_format.detect(raw_data) != ingest_output_format.JSON:
+                # Written newline delimited or as Parquet by the takeon ingest, the
+                # method takes an array.
+                raw_data = ingest_output_format.to_json(raw_data)
 
         logger.info("Retrieved data from S3.")
-        data_json = data_df.to_json(orient="records")
-
-        payload = {
-
-            "RuntimeVariables": {
-                "bpm_queue_url": bpm_queue_url,
-                "brick_questions": ingestion_parameters["brick_questions"],
-                "brick_types": ingestion_parameters["brick_types"],
-                "brick_type_column": ingestion_parameters["brick_type_column"],
-                "data": json.loads(data_json),
-                "environment": environment,
-                "run_id": run_id,
-                "survey": survey
-            },
-        }
 
-        method_return = lambda_client.invoke(
-            FunctionName=method_name, Payload=json.dumps(payload)
-        )
+        runtime_variables = {
+            "bpm_queue_url": bpm_queue_url,
+            "brick_questions": ingestion_parameters["brick_questions"],
+            "brick_types": ingestion_parameters["brick_types"],
+            "brick_type_column": ingestion_parameters["brick_type_column"],
+            "environment": environment,
+            "run_id": run_id,
+            "survey": survey
+        }
+        if output_format != ingest_output_format.JSON:
+            runtime_variables["output_format"] = output_format
+        if upload_part_size is not None:
+            # The method writes the output itself, so it never travels back
+            # through the invoke response.
+            runtime_variables.update({
+                "out_file_name": out_file_name,
+                "results_bucket_name": results_bucket_name,
+                "upload_part_size": upload_part_size
+            })
+            if output_compression is not None:
+                runtime_variables["output_compression"] = output_compression
+        if metrics_enabled:
+            runtime_variables["metrics"] = True
+        with ingest_metrics.stage("prepare_payload"):
+            if payload_compression is not None:
+                runtime_variables["payload_compression"] = payload_compression
+                raw_data = ingest_json.dumps(ingest_codec.encode_payload_data(
+                    raw_data, payload_compression))
+            payload = build_payload(runtime_variables, raw_data)
+
+        with ingest_metrics.stage("invoke"):
+            json_response = ingest_warm_state.invoke(lambda_client, method_name,
+                                                     payload)
         logger.info("Successfully invoked method.")
-
-        json_response = json.loads(method_return.get("Payload").read().decode("utf-8"))
         logger.info("JSON extracted from method response.")
 
         if not json_response["success"]:
             raise exception_classes.MethodFailure(json_response["error"])
 
-        aws_functions.save_to_s3(results_bucket_name, out_file_name,
-                                 json_response["data"])
+        if upload_part_size is None:
+            output = json_response["data"]
+            if payload_compression is not None:
+                output = ingest_codec.decode_payload_data(output, payload_compression)
+            else:
+                output = ingest_output_format.decode_payload_data(output,
+                                                                  output_format)
+            ingest_metrics.add("output_bytes", len(output), ingest_metrics.BYTES)
+            with ingest_metrics.stage("write_output"):
+                ingest_codec.save_to_s3(
+                    s3_resource, results_bucket_name, out_file_name, output,
+                    output_compression, ingest_output_format.content_type(output_format))
 
         logger.info("Data ready for Results pipeline. Written to S3.")
 
@@ -150,6 +257,7 @@ def lambda_handler(event, context):
                                                            context=context,
                                                            bpm_queue_url=bpm_queue_url)
     finally:
+        ingest_metrics.emit()
         if (len(error_message)) > 0:
             logger.error(error_message)
             raise exception_classes.LambdaFailure(error_message)
@@ -0,0 +1,191 @@
+import base64
+import gzip
+import io
+import zlib
+
+from es_aws_functions import aws_functions
+
+GZIP = "gzip"
+ZSTD = "zstd"
+ENCODINGS = [GZIP, ZSTD]
+# Added to the names of objects compressed with each encoding.
+EXTENSIONS = {GZIP: ".gz", ZSTD: ".zst"}
+
+_MAGIC = {
+    b"\x1f\x8b": GZIP,
+    b"\x28\xb5\x2f\xfd": ZSTD
+}
+_MAGIC_LENGTH = max(len(magic) for magic in _MAGIC)
+
+
+def _zstandard():
+    # zstd is optional, gzip is always available.
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package installed.")
+    return zstandard
+
+
+def detect(data, content_encoding=None):
+    """
+    Works out how data is compressed, from its Content-Encoding where it has one
+    or otherwise from its first bytes.
+    :param data: Bytes - Start of the data, or all of it.
+    :param content_encoding: String - S3 object's Content-Encoding, if any.
+    :return: String - gzip or zstd, or None if the data isn't compressed.
+    """
+    if content_encoding in ENCODINGS:
+        return content_encoding
+    for magic, encoding in _MAGIC.items():
+        if data[:len(magic)] == magic:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """
+    :param data: String or Bytes - Data to compress, strings are UTF-8 encoded.
+    :param encoding: String - gzip or zstd.
+    :return: Bytes - Compressed data.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if encoding == GZIP:
+        # Fixed mtime so the same data always compresses to the same bytes.
+        output = io.BytesIO()
+        with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6,
+                           mtime=0) as gzip_file:
+            gzip_file.write(data)
+        return output.getvalue()
+    if encoding == ZSTD:
+        return _zstandard().ZstdCompressor().compress(data)
+    raise ValueError(f"Unknown compression {encoding!r}.")
+
+
+def compressobj(encoding):
+    """
+    For compressing data a chunk at a time, e.g. as it is uploaded.
+    :param encoding: String - gzip or zstd.
+    :return: Object with compress(data) and flush() methods, each returning the
+        compressed bytes ready so far.
+    """
+    if encoding == GZIP:
+        # wbits 31 writes a gzip header, with an mtime of 0.
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if encoding == ZSTD:
+        return _zstandard().ZstdCompressor().compressobj()
+    raise ValueError(f"Unknown compression {encoding!r}.")
+
+
+def decompress(data, content_encoding=None):
+    """
+    :param data: Bytes - Data that may be compressed.
+    :param content_encoding: String - S3 object's Content-Encoding, if any.
+    :return: Bytes - Decompressed data, or data itself if it wasn't compressed.
+    """
+    encoding = detect(data, content_encoding)
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    if encoding == ZSTD:
+        # Frames written by a streaming compressor don't record their size.
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+class _PrefixedStream:
+    """
+    File-like object that gives back bytes already read from a stream before
+    reading any more of it.
+    """
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data = self._prefix + self._stream.read()
+        else:
+            data = self._prefix[:size]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+        self._prefix = self._prefix[len(data):]
+        return data
+
+
+def open_stream(stream, content_encoding=None):
+    """
+    Wraps a stream of bytes that may be compressed so reads from it are always
+    decompressed, without reading all of it first.
+    :param stream: File-like object, e.g. an S3 StreamingBody.
+    :param content_encoding: String - S3 object's Content-Encoding, if any.
+    :return: File-like object of decompressed bytes.
+    """
+    prefix = stream.read(_MAGIC_LENGTH)
+    encoding = detect(prefix, content_encoding)
+    stream = _PrefixedStream(prefix, stream)
+    if encoding == GZIP:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if encoding == ZSTD:
+        return _zstandard().ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+def encode_payload_data(data, encoding):
+    """
+    Compresses data for an invoke payload, which has to be JSON, so the compressed
+    bytes are base64 encoded.
+    :param data: String or Bytes - JSON encoded data.
+    :param encoding: String - gzip or zstd.
+    :return: String - Base64 of the compressed data.
+    """
+    return base64.b64encode(compress(data, encoding)).decode("ascii")
+
+
+def decode_payload_data(data, encoding):
+    """
+    :param data: String - Base64 of the compressed data, from encode_payload_data.
+    :param encoding: String - gzip or zstd.
+    :return: Bytes - JSON encoded data.
+    """
+    return decompress(base64.b64decode(data), encoding)
+
+
+def read_from_s3(s3_resource, bucket_name, file_name):
+    """
+    Reads an S3 object, decompressing it if needed.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket to read from.
+    :param file_name: String - Full key of the object.
+    :return: Bytes - Decompressed object.
+    """
+    response = s3_resource.Object(bucket_name, file_name).get()
+    return decompress(response["Body"].read(), response.get("ContentEncoding"))
+
+
+def save_to_s3(s3_resource, bucket_name, file_name, data, encoding=None,
+               content_type=None):
+    """
+    Writes to S3, compressed if asked to be. Compressed objects get a Content-Encoding
+    so readers can tell how to decompress them.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket to write to.
+    :param file_name: String - Name of the object.
+    :param data: String or Bytes - Data to write.
+    :param encoding: String - gzip or zstd, None writes it uncompressed.
+    :param content_type: String - Content-Type of the object, None for the default.
+    """
+    if encoding is None and content_type is None:
+        aws_functions.save_to_s3(bucket_name, file_name, data)
+        return
+
+    extra_args = {}
+    if encoding is not None:
+        data = compress(data, encoding)
+        extra_args["ContentEncoding"] = encoding
+    if content_type is not None:
+        extra_args["ContentType"] = content_type
+    s3_resource.Object(bucket_name, file_name).put(Body=data, **extra_args)
@@ -0,0 +1,134 @@
+import hashlib
+
+from botocore.exceptions import ClientError
+
+import ingest_json
+from ingest_snapshot_parser import RESPONSES_KEY
+
+
+def contributor_key(contributor):
+    """
+    :param contributor: Dict - Take On contributor node.
+    :return: String - Identifies the contributor between snapshots.
+    """
+    return f"{contributor['survey']}|{contributor['period']}|{contributor['reference']}"
+
+
+def fingerprint(contributor):
+    """
+    Hash of everything in a contributor that reaches the output, so a contributor
+    whose fingerprint is unchanged flattens to the same row.
+    :param contributor: Dict - Take On contributor node, with its responses.
+    :return: String - Fingerprint.
+    """
+    responses = [[question["questioncode"], question["response"]]
+                 for question in contributor[RESPONSES_KEY]["nodes"]]
+    parts = ingest_json.dumps([contributor["reference"], contributor["period"],
+                               contributor["status"], contributor["region"],
+                               contributor["enterprisereference"],
+                               contributor["enterprisename"], responses])
+    return hashlib.blake2b(parts, digest_size=16).hexdigest()
+
+
+class DeltaIngest:
+    """
+    Flattens only the contributors that are new or have changed since the previous
+    run, reusing the previous run's rows for the rest.
+    """
+
+    def __init__(self, plan, plan_key, previous_state=None, periods=None):
+        """
+        :param plan: IngestPlan - Plan to flatten contributors with.
+        :param plan_key: String - Key of the plan, from ingest_plan.plan_key.
+        :param previous_state: Dict - State saved by the previous run, None if there
+            wasn't one. Ignored if it was made with different ingestion parameters.
+        :param periods: Iterable - Periods read from the snapshot this run, all of
+            them by default. The previous run's contributors in other periods, such
+            as a previous period whose rows are reused, aren't counted as removed
+            and are kept in the state.
+        """
+        self.plan = plan
+        self.plan_key = plan_key
+        self.periods = None if periods is None else frozenset(periods)
+        if previous_state is not None and previous_state["plan_key"] == plan_key:
+            self._previous = previous_state["contributors"]
+        else:
+            self._previous = {}
+        self.contributors = {}
+        self.added = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def _read(self, key):
+        """
+        :param key: String - Contributor key, from contributor_key.
+        :return: Boolean - Whether the contributor's period was read this run.
+        """
+        return self.periods is None or key.split("|")[1] in self.periods
+
+    def values(self, contributors):
+        """
+        :param contributors: Iterable of Take On contributor nodes.
+        :return: Generator of results row values, one per contributor.
+        """
+        previous = self._previous
+        for contributor in contributors:
+            key = contributor_key(contributor)
+            contributor_fingerprint = fingerprint(contributor)
+            previous_entry = previous.get(key)
+            if previous_entry is None:
+                self.added += 1
+                row = self.plan.values(contributor)
+            elif previous_entry[0] != contributor_fingerprint:
+                self.changed += 1
+                row = self.plan.values(contributor)
+            else:
+                self.unchanged += 1
+                row = previous_entry[1]
+            self.contributors[key] = [contributor_fingerprint, row]
+            yield row
+
+    def counts(self):
+        """
+        :return: Dict - Number of contributors added, changed, removed and unchanged
+            since the previous run.
+        """
+        removed = sum(1 for key in self._previous
+                      if key not in self.contributors and self._read(key))
+        return {"added": self.added, "changed": self.changed, "removed": removed,
+                "unchanged": self.unchanged}
+
+    def state(self):
+        """
+        :return: Dict - State for the next run to compare against.
+        """
+        contributors = {key: entry for key, entry in self._previous.items()
+                        if not self._read(key)}
+        contributors.update(self.contributors)
+        return {"plan_key": self.plan_key, "contributors": contributors}
+
+
+def load_state(s3_resource, bucket_name, file_name):
+    """
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the state is kept in.
+    :param file_name: String - Name of the state file.
+    :return: Dict - State saved by the previous run, or None if there isn't one.
+    """
+    try:
+        response = s3_resource.Object(bucket_name, file_name).get()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return ingest_json.loads(response["Body"].read())
+
+
+def save_state(s3_resource, bucket_name, file_name, state):
+    """
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the state is kept in.
+    :param file_name: String - Name of the state file.
+    :param state: Dict - State, from DeltaIngest.state.
+    """
+    s3_resource.Object(bucket_name, file_name).put(Body=ingest_json.dumps(state))
@@ -0,0 +1,40 @@
+import json
+
+# orjson is optional, it is much faster on large documents but the standard library
+# gives the same results.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """
+    :param data: Bytes or String - JSON document.
+    :return: The decoded document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter about some valid documents, such as integers over
+            # 64 bits, so leave the final say to the standard library.
+            pass
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    Encodes compactly (no whitespace) and without escaping non-ASCII characters, so
+    the strings, integers, lists and dicts the handlers write come out as the same
+    bytes whichever library made them.
+    :param obj: Object to encode.
+    :return: Bytes - UTF-8 JSON document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # E.g. integers over 64 bits.
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,235 @@
+"""
+Runs the takeon ingest, and optionally the brick type ingest after it, for many
+(survey, period) jobs on one machine, e.g. for backfills and profiling.
+
+    python -m ingest_local config.json BMI_SG:201809 BMI_SG:201812 --output-dir out
+
+Each wrangler runs its method in process, passed the same JSON payload it would
+be invoked with through Lambda. S3 is a moto stand-in holding the snapshot, read from a
+local file, and the outputs are copied to --output-dir. BPM and SNS messages are
+logged. Jobs run in a pool of --workers processes, each keeping its own stand-in.
+--workers 1 runs them in this process, e.g. under cProfile.
+
+The config is a JSON object holding the snapshot's path and, by survey, the
+wranglers' runtime variables:
+
+    {"snapshot": "snapshot.json",
+     "environment": {"output_format": "ndjson"},
+     "surveys": {"BMI_SG": {"periodicity": "03",
+                            "ingestion_parameters": {...},
+                            "bricks": {"ingestion_parameters": {...}}}}}
+
+"environment" sets extra wrangler environment variables. Surveys with "bricks"
+also run the brick type ingest on each takeon output.
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import ingest_json
+import ingest_warm_state
+
+BUCKET_NAME = "local-results"
+TAKEON_METHOD = "local-takeon-method"
+BRICKS_METHOD = "local-bricks-method"
+
+_SNAPSHOT_FILE = "snapshot.json"
+# The stand-in kept open by each pool worker, see _start_worker.
+_worker_aws = None
+
+
+def _log_bpm_status(queue_url, module_name, status, run_id, *args, **kwargs):
+    logging.info(f"BPM status {status} from {module_name} for run {run_id}.")
+
+
+def _log_sns_message(topic_arn, message, *args, **kwargs):
+    logging.info(f"SNS message: {message}")
+
+
+@contextmanager
+def local_aws(snapshot_path, environment=None):
+    """
+    Sets up the stand-ins the handlers run against while open, putting the
+    environment back as it was once closed.
+    :param snapshot_path: String - Local file holding the Take On snapshot.
+    :param environment: Dict - Extra wrangler environment variables.
+    """
+    import boto3
+    from es_aws_functions import aws_functions
+    from moto import mock_s3
+
+    import ingest_brick_type_method
+    import ingest_takeon_data_method
+
+    saved_environment = dict(os.environ)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+    os.environ["results_bucket_name"] = BUCKET_NAME
+    # Shards would share this process rather than running in parallel.
+    os.environ["max_shards"] = "1"
+    os.environ.update(environment or {})
+
+    send_bpm_status = aws_functions.send_bpm_status
+    send_sns_message = aws_functions.send_sns_message
+    aws_functions.send_bpm_status = _log_bpm_status
+    aws_functions.send_sns_message = _log_sns_message
+    ingest_warm_state.reset()
+    try:
+        with mock_s3():
+            s3_client = boto3.client("s3", region_name="eu-west-2")
+            s3_client.create_bucket(
+                Bucket=BUCKET_NAME,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+            s3_client.upload_file(snapshot_path, BUCKET_NAME, _SNAPSHOT_FILE)
+            ingest_warm_state.set_client(
+                "lambda", ingest_warm_state.InProcessLambdaClient({
+                    TAKEON_METHOD: ingest_takeon_data_method.lambda_handler,
+                    BRICKS_METHOD: ingest_brick_type_method.lambda_handler
+                }))
+            yield s3_client
+    finally:
+        ingest_warm_state.reset()
+        aws_functions.send_bpm_status = send_bpm_status
+        aws_functions.send_sns_message = send_sns_message
+        os.environ.clear()
+        os.environ.update(saved_environment)
+
+
+def job_events(survey_config, survey, period):
+    """
+    :param survey_config: Dict - The survey's entry in the config.
+    :param survey: String - Survey to ingest.
+    :param period: String - Period to ingest.
+    :return: List - (wrangler module name, method name, event, out_file_name) for
+        each wrangler to run, in order.
+    """
+    name = f"{survey}-{period}"
+    common = {"bpm_queue_url": "local", "environment": "local",
+              "run_id": f"local-{name}", "sns_topic_arn": "local",
+              "survey": survey, "total_steps": 6}
+    takeon = dict(common, ingestion_parameters=survey_config["ingestion_parameters"],
+                  out_file_name=f"{name}.json", period=period,
+                  periodicity=survey_config["periodicity"],
+                  snapshot_s3_uri=f"s3://{BUCKET_NAME}/{_SNAPSHOT_FILE}")
+    events = [("ingest_takeon_data_wrangler", TAKEON_METHOD,
+               {"RuntimeVariables": takeon}, takeon["out_file_name"])]
+    if "bricks" in survey_config:
+        # The brick type wrangler reads the takeon output.
+        bricks = dict(common,
+                      ingestion_parameters=survey_config["bricks"][
+                          "ingestion_parameters"],
+                      in_file_name=name, out_file_name=f"{name}-bricks.json")
+        events.append(("ingest_brick_type_wrangler", BRICKS_METHOD,
+                       {"RuntimeVariables": bricks}, bricks["out_file_name"]))
+    return events
+
+
+def run_job(config, survey, period, output_dir, s3_client=None):
+    """
+    Runs a job's wranglers, through the same lambda_handlers as in Lambda, and
+    copies their outputs to the output directory.
+    :param config: Dict - The runner config.
+    :param survey: String - Survey to ingest.
+    :param period: String - Period to ingest.
+    :param output_dir: String - Directory to copy the outputs to.
+    :param s3_client: Boto3 S3 client on the stand-in, the worker's if not given.
+    :return: Dict - The job's survey, period, success and outputs or error.
+    """
+    s3_client = s3_client or _worker_aws[1]
+    result = {"survey": survey, "period": period}
+    try:
+        outputs = []
+        for module_name, method_name, event, out_file_name in job_events(
+                config["surveys"][survey], survey, period):
+            os.environ["method_name"] = method_name
+            importlib.import_module(module_name).lambda_handler(event, None)
+            # Listed by prefix, as the extension is changed to match the output
+            # format and compression when it is saved.
+            prefix = out_file_name[:-len(".json")] + "."
+            for item in s3_client.list_objects_v2(
+                    Bucket=BUCKET_NAME, Prefix=prefix).get("Contents", []):
+                path = os.path.join(output_dir, item["Key"])
+                s3_client.download_file(BUCKET_NAME, item["Key"], path)
+                outputs.append(path)
+        result.update({"success": True, "outputs": outputs})
+    except Exception as e:
+        logging.exception(f"Job {survey} {period} failed.")
+        result.update({"success": False, "error": str(e)})
+    return result
+
+
+def _start_worker(snapshot_path, environment):
+    # Keeps the stand-in open for the worker's life, so the snapshot is only
+    # uploaded once per worker.
+    global _worker_aws
+    context = local_aws(snapshot_path, environment)
+    _worker_aws = (context, context.__enter__())
+
+
+def run(config, jobs, output_dir, workers=None):
+    """
+    :param config: Dict - The runner config.
+    :param jobs: List - (survey, period) tuples.
+    :param output_dir: String - Directory to copy the outputs to.
+    :param workers: Int - Processes to run jobs in, 1 runs them in this process and
+        None one per CPU.
+    :return: List - A result dict per job, in the order given.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if workers == 1:
+        with local_aws(config["snapshot"], config.get("environment")) as s3_client:
+            return [run_job(config, survey, period, output_dir, s3_client)
+                    for survey, period in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker,
+                             initargs=(config["snapshot"],
+                                       config.get("environment"))) as executor:
+        futures = [executor.submit(run_job, config, survey, period, output_dir)
+                   for survey, period in jobs]
+        return [future.result() for future in futures]
+
+
+def parse_job(job):
+    """
+    :param job: String - survey:period.
+    :return: Tuple - (survey, period).
+    """
+    survey, separator, period = job.rpartition(":")
+    if not separator or not survey or not period:
+        raise argparse.ArgumentTypeError(f"Expected survey:period, got {job}.")
+    return survey, period
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m ingest_local", description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("config", help="JSON file configuring the runs.")
+    parser.add_argument("jobs", nargs="+", type=parse_job, metavar="survey:period")
+    parser.add_argument("--output-dir", default="ingest-output",
+                        help="Directory to write the outputs to.")
+    parser.add_argument("--workers", type=int,
+                        help="Processes to run jobs in, one per CPU by default.")
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, "rb") as file:
+        config = ingest_json.loads(file.read())
+    # The snapshot's path is relative to the config.
+    config["snapshot"] = os.path.join(os.path.dirname(args.config), config["snapshot"])
+    results = run(config, args.jobs, args.output_dir, args.workers)
+    for result in results:
+        if result["success"]:
+            print(f"{result['survey']} {result['period']}: "
+                  f"{', '.join(result['outputs'])}")
+        else:
+            print(f"{result['survey']} {result['period']}: FAILED {result['error']}")
+    return 0 if all(result["success"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import ingest_json
+
+NAMESPACE = "ResultsIngest"
+
+BYTES = "Bytes"
+COUNT = "Count"
+MILLISECONDS = "Milliseconds"
+
+# Metrics of the invocations in progress, the innermost last, None where they are
+# turned off. A wrangler and its method can run in one process, e.g. in the tests.
+_stack = []
+_null_stage = contextmanager(lambda: (yield))
+
+
+class Metrics:
+    """
+    Wall time per stage and byte and record counts for one invocation, emitted
+    together as a single CloudWatch embedded metric format (EMF) record.
+    """
+
+    def __init__(self, module_name, run_id, **dimensions):
+        """
+        :param module_name: String - Handler being measured, e.g. current_module.
+        :param run_id: String - Run being measured, logged but not a dimension.
+        :param dimensions: Strings - Further dimensions, e.g. survey.
+        """
+        self.dimensions = dict(module=module_name, **dimensions)
+        self.run_id = run_id
+        self.values = {}
+        self.units = {}
+        # Shards and download parts are measured from several threads.
+        self._lock = threading.Lock()
+
+    def add(self, name, value, unit=COUNT):
+        """
+        Adds to a metric, so stages and counts recorded more than once are summed.
+        :param name: String - Name of the metric.
+        :param value: Int or Float - Amount to add.
+        :param unit: String - BYTES, COUNT or MILLISECONDS.
+        """
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the wall time of a block as the metric <name>_time. Stages may be
+        nested, an outer stage's time includes the inner ones.
+        :param name: String - Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}_time", (time.perf_counter() - start) * 1000,
+                     MILLISECONDS)
+
+    def record(self):
+        """
+        :return: Dict - EMF record of every metric recorded so far.
+        """
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit}
+                                for name, unit in self.units.items()]
+                }]
+            },
+            "run_id": self.run_id
+        }
+        record.update(self.dimensions)
+        for name, value in self.values.items():
+            record[name] = round(value, 3) if isinstance(value, float) else value
+        return record
+
+
+def start(enabled, module_name, run_id, **dimensions):
+    """
+    Starts measuring an invocation. Until it is emitted, the functions below record
+    into its metrics, or do nothing if they are turned off.
+    :param enabled: Boolean - Whether to record metrics at all.
+    :param module_name: String - Handler being measured, e.g. current_module.
+    :param run_id: String - Run being measured.
+    :param dimensions: Strings - Further dimensions, e.g. survey.
+    :return: Metrics - The invocation's metrics, or None if turned off.
+    """
+    metrics = Metrics(module_name, run_id, **dimensions) if enabled else None
+    _stack.append(metrics)
+    return metrics
+
+
+def _current():
+    return _stack[-1] if _stack else None
+
+
+def enabled():
+    """
+    :return: Boolean - Whether the innermost invocation is recording metrics.
+    """
+    return _current() is not None
+
+
+def stage(name):
+    """
+    :param name: String - Name of the stage.
+    :return: Context manager measuring the wall time of a block.
+    """
+    metrics = _current()
+    if metrics is None:
+        return _null_stage()
+    return metrics.stage(name)
+
+
+def measured(name):
+    """
+    Decorator measuring every call of a function as a stage.
+    :param name: String - Name of the stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _current()
+            if metrics is None:
+                return function(*args, **kwargs)
+            with metrics.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add(name, value, unit=COUNT):
+    """
+    :param name: String - Name of the metric.
+    :param value: Int or Float - Amount to add.
+    :param unit: String - BYTES, COUNT or MILLISECONDS.
+    """
+    metrics = _current()
+    if metrics is not None:
+        metrics.add(name, value, unit)
+
+
+def emit():
+    """
+    Writes the innermost invocation's metrics as one line and stops measuring it.
+    The line goes straight to stdout, CloudWatch only reads EMF records that are a
+    bare JSON object, without the logger's prefix.
+    """
+    metrics = _stack.pop() if _stack else None
+    if metrics is None:
+        return
+    sys.stdout.write(ingest_json.dumps(metrics.record()).decode("utf-8") + "\n")
+    sys.stdout.flush()
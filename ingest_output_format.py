@@ -0,0 +1,359 @@
+import base64
+
+import ingest_codec
+import ingest_json
+
+JSON = "json"
+# Newline delimited JSON, one record per line.
+NDJSON = "ndjson"
+PARQUET = "parquet"
+FORMATS = [JSON, NDJSON, PARQUET]
+EXTENSIONS = {JSON: ".json", NDJSON: ".ndjson", PARQUET: ".parquet"}
+
+# Parquet outputs are written with this Content-Type, so readers can tell them
+# apart before reading them.
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+# Rows encoded at a time by iter_chunks, each Parquet chunk is a row group.
+CHUNK_ROWS = 10000
+PARQUET_CHUNK_ROWS = 100000
+
+_PARQUET_MAGIC = b"PAR1"
+
+
+def _pyarrow():
+    # pyarrow is optional, it is only needed for Parquet outputs.
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet output needs the pyarrow package installed.")
+    return pyarrow
+
+
+class _ChunkSink:
+    """
+    Output stream for the Parquet writer that keeps what has been written until it
+    is taken, so a file can be passed on a row group at a time.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # The writer records offsets in the footer, so this counts everything ever
+        # written rather than what is still held.
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        """
+        :return: Bytes - Everything written since the last take.
+        """
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _dictionary_encoded(data):
+    """
+    :param data: DataFrame - Output rows.
+    :return: DataFrame - The rows with every string column as categories, which
+        Parquet stores dictionary encoded.
+    """
+    import pandas as pd
+
+    strings = {column: "category" for column in data.columns
+               if not isinstance(data[column].dtype, pd.CategoricalDtype) and
+               pd.api.types.infer_dtype(data[column], skipna=True) == "string"}
+    return data.astype(strings) if strings else data
+
+
+def _check_int64(data):
+    """
+    Raises a ValueError naming the first column holding an integer outside int64,
+    e.g. a response kept as is by the columnar builder, which Parquet can't hold.
+    :param data: DataFrame - Output rows.
+    """
+    import pandas as pd
+
+    for column in data.columns:
+        if data[column].dtype == object and \
+                pd.api.types.infer_dtype(data[column], skipna=True) == "integer" and \
+                any(not -2 ** 63 <= value < 2 ** 63 for value in data[column].dropna()):
+            raise ValueError(f"Column {column} holds integers outside int64, which "
+                             f"Parquet outputs can't hold.")
+
+
+def _parquet_schema(pyarrow, frame):
+    """
+    :return: Schema - The frame's schema, with 32 bit dictionary indices so later
+        frames with more distinct strings still fit it.
+    """
+    schema = pyarrow.Schema.from_pandas(frame, preserve_index=False)
+    return pyarrow.schema(
+        [pyarrow.field(field.name, pyarrow.dictionary(pyarrow.int32(),
+                                                      field.type.value_type))
+         if pyarrow.types.is_dictionary(field.type) else field for field in schema],
+        metadata=schema.metadata)
+
+
+def _iter_parquet_chunks(frames):
+    pyarrow = _pyarrow()
+    sink = _ChunkSink()
+    writer = None
+    for frame in frames:
+        _check_int64(frame)
+        frame = _dictionary_encoded(frame)
+        if writer is None:
+            # Taken from the first frame so every row group has the same schema.
+            schema = _parquet_schema(pyarrow, frame)
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        if len(frame):
+            writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema,
+                                                         preserve_index=False))
+            yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def default_chunk_rows(output_format):
+    """
+    :param output_format: String - json, ndjson or parquet.
+    :return: Int - Rows to encode at a time, CHUNK_ROWS or PARQUET_CHUNK_ROWS.
+    """
+    return PARQUET_CHUNK_ROWS if output_format == PARQUET else CHUNK_ROWS
+
+
+def iter_frame_chunks(frames, output_format):
+    """
+    Encodes output rows a DataFrame at a time, e.g. as they are built, so neither
+    the rows nor the encoded output have to be held all at once.
+    :param frames: Iterable of DataFrames - Output rows, in order, with the same
+        columns. Parquet outputs take their schema from the first, so there has to
+        be at least one, and each non-empty frame is a row group.
+    :param output_format: String - json for a JSON array of records, ndjson for one
+        record per line, each ending with a newline, or parquet.
+    :return: Generator of strings, or of bytes for Parquet, that join up to
+        encode's output.
+    """
+    if output_format == PARQUET:
+        yield from _iter_parquet_chunks(frames)
+        return
+
+    if output_format == NDJSON:
+        for frame in frames:
+            yield encode_rows(to_records(frame), output_format).decode("utf-8")
+        return
+
+    yield "["
+    separator = ""
+    for frame in frames:
+        if len(frame):
+            chunk = encode_rows(to_records(frame), output_format).decode("utf-8")
+            # Strip the brackets, joining on to the previous chunk's records.
+            yield separator + chunk[1:-1]
+            separator = ","
+    yield "]"
+
+
+def iter_chunks(data, output_format, chunk_rows=None):
+    """
+    Encodes output rows a few at a time, so the encoded output never has to be held
+    all at once.
+    :param data: DataFrame - Output rows.
+    :param output_format: String - json for a JSON array of records, ndjson for one
+        record per line, each ending with a newline, or parquet.
+    :param chunk_rows: Int - Rows encoded at a time, default_chunk_rows by default.
+    :return: Generator of strings, or of bytes for Parquet, that join up to
+        encode's output.
+    """
+    chunk_rows = chunk_rows or default_chunk_rows(output_format)
+    if output_format == PARQUET:
+        # Encoded before it is split so every chunk has the same categories.
+        data = _dictionary_encoded(data)
+    # An empty output is still one frame, for the Parquet schema.
+    frames = [data.iloc[start:start + chunk_rows]
+              for start in range(0, len(data), chunk_rows)] or [data]
+    yield from iter_frame_chunks(frames, output_format)
+
+
+def concatenate(outputs, output_format):
+    """
+    Joins outputs encoded separately, e.g. by shards, into one. JSON and newline
+    delimited records are joined without decoding them.
+    :param outputs: List - Encoded outputs, as bytes, in order.
+    :param output_format: String - json, ndjson or parquet.
+    :return: Bytes - Encoded output.
+    """
+    if output_format == PARQUET:
+        frames = [read_dataframe(output) for output in outputs]
+        # Empty outputs may not have the columns' types, so aren't taken for the
+        # schema.
+        frames = [frame for frame in frames if len(frame)] or frames[:1]
+        return b"".join(iter_frame_chunks(frames, output_format))
+    if output_format == NDJSON:
+        return b"".join(outputs)
+    records = [output.strip()[1:-1] for output in outputs]
+    return b"[" + b",".join(record for record in records if record) + b"]"
+
+
+def encode(data, output_format):
+    """
+    :param data: DataFrame - Output rows.
+    :param output_format: String - json, ndjson or parquet.
+    :return: String - Encoded output, or Bytes for Parquet.
+    """
+    if output_format == PARQUET:
+        return b"".join(iter_chunks(data, output_format))
+    return encode_rows(to_records(data), output_format).decode("utf-8")
+
+
+def to_records(data):
+    """
+    :param data: DataFrame - Output rows.
+    :return: List - The rows as dicts of plain Python values, missing values as
+        None, ready for encode_rows.
+    """
+    columns = []
+    for column in data.columns:
+        values = data[column]
+        if values.hasnans:
+            values = values.astype(object).where(values.notna(), None)
+        columns.append(values.tolist())
+    return [dict(zip(data.columns, row)) for row in zip(*columns)]
+
+
+def encode_rows(rows, output_format):
+    """
+    Every JSON and newline delimited output is encoded here, through ingest_json,
+    so they all come out compact, in UTF-8 and with "/" unescaped.
+    :param rows: List - Output rows, as dicts.
+    :param output_format: String - json, ndjson or parquet.
+    :return: Bytes - Encoded output.
+    """
+    if output_format == PARQUET:
+        import pandas as pd
+
+        return encode(pd.DataFrame(rows), output_format)
+    if output_format == NDJSON:
+        return b"".join(ingest_json.dumps(row) + b"\n" for row in rows)
+    return ingest_json.dumps(rows)
+
+
+def content_type(output_format):
+    """
+    :param output_format: String - json, ndjson or parquet.
+    :return: String - Content-Type to write the output with, None for the default.
+    """
+    return PARQUET_CONTENT_TYPE if output_format == PARQUET else None
+
+
+def file_name(out_file_name, output_format, output_compression=None):
+    """
+    Gives an output written in another format than a JSON array, or compressed, the
+    extension to match, e.g. out.json is written as out.parquet or out.json.gz. An
+    uncompressed JSON output keeps the name it was given.
+    :param out_file_name: String - Name the output was asked to be written as.
+    :param output_format: String - json, ndjson or parquet.
+    :param output_compression: String - gzip or zstd, None if uncompressed.
+    :return: String - Name to write the output as.
+    """
+    if output_format == JSON and output_compression is None:
+        return out_file_name
+    if out_file_name.endswith(EXTENSIONS[JSON]):
+        out_file_name = out_file_name[:-len(EXTENSIONS[JSON])]
+    return out_file_name + EXTENSIONS[output_format] + \
+        ingest_codec.EXTENSIONS.get(output_compression, "")
+
+
+def file_extensions():
+    """
+    :return: List - Every extension file_name gives outputs.
+    """
+    return [extension + compression_extension
+            for extension in EXTENSIONS.values()
+            for compression_extension in [""] + list(ingest_codec.EXTENSIONS.values())]
+
+
+def encode_payload_data(output):
+    """
+    :param output: String or Bytes - Encoded output.
+    :return: String - The output, base64 encoded if it is binary as invoke payloads
+        have to be JSON.
+    """
+    if isinstance(output, bytes):
+        return base64.b64encode(output).decode("ascii")
+    return output
+
+
+def decode_payload_data(data, output_format):
+    """
+    :param data: String - Output from an invoke payload, from encode_payload_data.
+    :param output_format: String - json, ndjson or parquet.
+    :return: String or Bytes - Encoded output.
+    """
+    if output_format == PARQUET:
+        return base64.b64decode(data)
+    return data
+
+
+def detect(data):
+    """
+    Works out an output's format from its first bytes. A JSON array starts with a
+    bracket, a newline delimited record with a brace and Parquet with PAR1.
+    :param data: Bytes or String - Output, or the start of it.
+    :return: String - json, ndjson or parquet. An empty output is ndjson with no
+        records.
+    """
+    if data[:len(_PARQUET_MAGIC)] == _PARQUET_MAGIC:
+        return PARQUET
+    # Only the start is looked at, so large outputs aren't copied.
+    first = data[:1024].lstrip()[:1]
+    if first in ("[", b"["):
+        return JSON
+    if first in ("{", b"{", "", b""):
+        return NDJSON
+    raise ValueError(f"Output is not a JSON array, newline delimited JSON or "
+                     f"Parquet, it starts {data[:16]!r}.")
+
+
+def read_dataframe(data, columns=None):
+    """
+    :param data: Bytes - Parquet output.
+    :param columns: List - Columns to read, all of them by default. Only the
+        columns asked for are decoded.
+    :return: DataFrame - Output rows, with string columns as categories.
+    """
+    pyarrow = _pyarrow()
+    return pyarrow.parquet.read_table(pyarrow.BufferReader(data),
+                                      columns=columns).to_pandas()
+
+
+def to_json(data):
+    """
+    Converts a newline delimited or Parquet output to a JSON array of records.
+    Newline delimited records are joined without decoding them.
+    :param data: Bytes or String - Output.
+    :return: Bytes - JSON array of the records.
+    """
+    if detect(data) == PARQUET:
+        return encode_rows(to_records(read_dataframe(data)), JSON)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    records = [line for line in (line.strip() for line in data.split(b"\n")) if line]
+    return b"[" + b",".join(records) + b"]"
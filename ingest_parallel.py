@@ -0,0 +1,93 @@
+import logging
+import multiprocessing
+import os
+
+import ingest_metrics
+
+
+def cpu_count():
+    """
+    :return: Int - CPUs this process can run on, which Lambda sets by memory size.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_count(max_workers, size, size_per_worker):
+    """
+    Works out how many processes to split a job over, so small jobs, where starting
+    the processes would take longer than the work, run in this one.
+    :param max_workers: Int - Most processes to use.
+    :param size: Int - Size of the job, e.g. snapshot bytes.
+    :param size_per_worker: Int - Least of the job worth starting a process for.
+    :return: Int - Processes to use, 1 meaning run it in this one.
+    """
+    # Workers are forked so they inherit the job rather than have it pickled.
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return 1
+    return max(1, min(max_workers, cpu_count(), size // size_per_worker))
+
+
+def _run_worker(function, index, count, sender):
+    # Record the worker's metrics separately, for the parent to add to its own.
+    metrics = ingest_metrics.start(ingest_metrics.enabled(), "worker", None)
+    error = result = None
+    try:
+        result = function(index, count)
+    except Exception as e:
+        logging.exception(f"Worker {index} of {count} failed.")
+        error = e
+    values = None if metrics is None else (metrics.values, metrics.units)
+    try:
+        sender.send((error, result, values))
+    except Exception as e:
+        # The error couldn't be pickled, pass its message on instead.
+        sender.send((RuntimeError(repr(error or e)), None, None))
+    finally:
+        sender.close()
+
+
+def map_shards(function, count):
+    """
+    Runs function(index, count) for each index in a forked worker process. Workers
+    inherit this process's memory, so only their results are pickled. Processes
+    and pipes are used rather than multiprocessing.Pool, as Lambda has no /dev/shm
+    for the pool's semaphores.
+    :param function: Function - Takes the worker's index and the worker count.
+    :param count: Int - Number of workers.
+    :return: List - Each worker's result, in index order.
+    """
+    context = multiprocessing.get_context("fork")
+    workers = []
+    try:
+        for index in range(count):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_run_worker,
+                                      args=(function, index, count, sender),
+                                      daemon=True)
+            workers.append((process, receiver))
+            process.start()
+            sender.close()
+
+        results = []
+        for index, (process, receiver) in enumerate(workers):
+            try:
+                error, result, values = receiver.recv()
+            except EOFError:
+                process.join()
+                raise RuntimeError(f"Worker {index} of {count} exited with code "
+                                   f"{process.exitcode} before returning its result.")
+            if error is not None:
+                raise error
+            if values is not None:
+                for name, value in values[0].items():
+                    ingest_metrics.add(name, value, values[1][name])
+            results.append(result)
+        return results
+    finally:
+        for process, receiver in workers:
+            receiver.close()
+            if process.is_alive():
+                process.terminate()
+            process.join()
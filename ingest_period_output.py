@@ -0,0 +1,97 @@
+import heapq
+
+from botocore.exceptions import ClientError
+
+import ingest_json
+from ingest_plan import CONTRIBUTOR_COLUMNS
+
+_SURVEY_INDEX = CONTRIBUTOR_COLUMNS.index("survey")
+_PERIOD_INDEX = CONTRIBUTOR_COLUMNS.index("period")
+_REFERENCE_INDEX = CONTRIBUTOR_COLUMNS.index("responder_id")
+
+
+def period_file_name(prefix, survey, period):
+    """
+    :param prefix: String - Prefix the period outputs are kept under.
+    :param survey: String - Survey the rows belong to.
+    :param period: String - Period the rows belong to.
+    :return: String - Name of the period output in the results bucket.
+    """
+    return f"{prefix}{survey}-{period}.json"
+
+
+def iter_keeping_period(rows, period, kept_rows):
+    """
+    Passes rows through, keeping a copy of those for the given period.
+    :param rows: Iterable of results row values.
+    :param period: String - Period to keep the rows of.
+    :param kept_rows: List - Rows for the period are appended to this.
+    :return: Generator of the results row values.
+    """
+    for row in rows:
+        if row[_PERIOD_INDEX] == period:
+            kept_rows.append(row)
+        yield row
+
+
+def merge_rows(rows, reused_rows, survey_codes):
+    """
+    Merges the rows read from the snapshot with reused rows for another period, in
+    the order Take On lists contributors: by survey code, then reference, then
+    period, its primary key.
+    :param rows: Iterable of results row values, in snapshot order.
+    :param reused_rows: List - Results row values for another period, in the order
+        of the snapshot they were read from.
+    :param survey_codes: Dict - Take On survey code to results survey code.
+    :return: Iterator of results row values.
+    """
+    # Rows hold the results survey code, so sort on the Take On code it came from.
+    take_on_codes = {}
+    for code in sorted(survey_codes):
+        take_on_codes.setdefault(survey_codes[code], code)
+
+    def snapshot_order(row):
+        return (take_on_codes.get(row[_SURVEY_INDEX], row[_SURVEY_INDEX]),
+                row[_REFERENCE_INDEX], row[_PERIOD_INDEX])
+
+    return heapq.merge(rows, reused_rows, key=snapshot_order)
+
+
+def load_rows(s3_resource, bucket_name, file_name, plan_key, oldest_snapshot):
+    """
+    Loads the rows an earlier run produced for its current period.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the period outputs are kept in.
+    :param file_name: String - Name of the period output, from period_file_name.
+    :param plan_key: String - Key of the plan the rows must have been made with.
+    :param oldest_snapshot: Int - Unix time; rows made from a snapshot last modified
+        before this are stale.
+    :return: List - Results row values, or None if there are no usable rows.
+    """
+    try:
+        response = s3_resource.Object(bucket_name, file_name).get()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    period_output = ingest_json.loads(response["Body"].read())
+    if period_output["plan_key"] != plan_key or \
+            period_output["snapshot_last_modified"] < oldest_snapshot:
+        return None
+    return period_output["rows"]
+
+
+def save_rows(s3_resource, bucket_name, file_name, plan_key, snapshot_last_modified,
+              rows):
+    """
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the period outputs are kept in.
+    :param file_name: String - Name of the period output, from period_file_name.
+    :param plan_key: String - Key of the plan the rows were made with.
+    :param snapshot_last_modified: Int - Unix time the snapshot was last modified.
+    :param rows: List - Results row values for the period.
+    """
+    period_output = {"plan_key": plan_key,
+                     "snapshot_last_modified": snapshot_last_modified,
+                     "rows": rows}
+    s3_resource.Object(bucket_name, file_name).put(Body=ingest_json.dumps(period_output))
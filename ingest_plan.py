@@ -0,0 +1,309 @@
+import hashlib
+import json
+from array import array
+from collections import OrderedDict
+
+import ingest_json
+from ingest_snapshot_parser import RESPONSES_KEY
+
+# Contributor information columns, in the order they are written out.
+CONTRIBUTOR_COLUMNS = ["survey", "period", "responder_id", "gor_code",
+                       "enterprise_reference", "enterprise_name"]
+
+# Low cardinality string columns, stored as categories by the ColumnarBuilder.
+CATEGORICAL_COLUMNS = ["survey", "period", "gor_code"]
+
+# Response type given to statuses that are not in the statuses table, these are
+# assumed to need imputing.
+DEFAULT_RESPONSE_TYPE = 1
+
+_PLAN_CACHE_SIZE = 16
+_plan_cache = OrderedDict()
+
+
+class IngestPlan:
+    """
+    Everything needed to flatten a Take On contributor into a results row, worked out
+    once from the ingestion parameters so no per-row configuration work is left.
+    """
+
+    def __init__(self, question_labels, survey_codes, statuses):
+        """
+        :param question_labels: Dict - Take On question code to results column.
+        :param survey_codes: Dict - Take On survey code to results survey code.
+        :param statuses: Dict - Take On status to results response type.
+        """
+        self.question_labels = dict(question_labels)
+        self.survey_codes = dict(survey_codes)
+        self.statuses = dict(statuses)
+
+        # Question columns in output order, with the default answer for each.
+        self.question_columns = list(OrderedDict.fromkeys(question_labels.values()))
+        self.columns = CONTRIBUTOR_COLUMNS + self.question_columns + ["response_type"]
+        self.integer_columns = self.question_columns + ["response_type"]
+        self._default_answers = [0] * len(self.question_columns)
+
+        # Position of each question's answer within a row's values.
+        answer_offset = len(CONTRIBUTOR_COLUMNS)
+        self._answer_index = {
+            question: answer_offset + self.question_columns.index(label)
+            for question, label in question_labels.items()
+        }
+
+    def values(self, contributor):
+        """
+        :param contributor: Dict - Take On contributor node, with its responses.
+        :return: List - Results row values, in the order of columns.
+        """
+        row = [
+            self.survey_codes[contributor["survey"]],
+            str(contributor["period"]),
+            str(contributor["reference"]),
+            contributor["region"],
+            str(contributor["enterprisereference"]),
+            contributor["enterprisename"]
+        ]
+        # Pre-populate default question answers.
+        row.extend(self._default_answers)
+
+        # Where contributors provided an answer, use it instead.
+        answer_index = self._answer_index
+        for question in contributor[RESPONSES_KEY]["nodes"]:
+            index = answer_index.get(question["questioncode"])
+            if index is not None and question["response"].isnumeric():
+                row[index] = int(question["response"])
+
+        # Convert the response statuses to types,
+        # used by results to check if imputation should run.
+        row.append(self.statuses.get(contributor["status"], DEFAULT_RESPONSE_TYPE))
+        return row
+
+    def flatten(self, contributor):
+        """
+        :param contributor: Dict - Take On contributor node, with its responses.
+        :return: Dict - Results row.
+        """
+        return dict(zip(self.columns, self.values(contributor)))
+
+
+class _CategoricalBuffer:
+    """
+    Column of strings stored as integer codes into a table of distinct values.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self.codes = array("q")
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.categories)
+            self.categories.append(value)
+        self.codes.append(code)
+
+
+class ColumnarBuilder:
+    """
+    Collects flattened contributors into typed column buffers rather than a dict per
+    row: int64 arrays for the questions and response_type, categories for the low
+    cardinality strings and plain lists for the rest. An integer column holding a
+    response too large for int64 is kept as a list instead.
+    """
+
+    def __init__(self, plan):
+        """
+        :param plan: IngestPlan - Plan to flatten contributors with.
+        """
+        self.plan = plan
+        self._buffers = []
+        for column in plan.columns:
+            if column in CATEGORICAL_COLUMNS:
+                self._buffers.append(_CategoricalBuffer())
+            elif column in plan.integer_columns:
+                self._buffers.append(array("q"))
+            else:
+                self._buffers.append([])
+        self._appenders = [buffer.append for buffer in self._buffers]
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def _append_values(self, values):
+        try:
+            for append, value in zip(self._appenders, values):
+                append(value)
+        except OverflowError:
+            self._append_widened(values)
+        self._length += 1
+
+    def _append_widened(self, values):
+        """
+        Finishes appending a row that holds an integer outside int64, moving each
+        column it doesn't fit in to a list of Python ints.
+        :param values: List - Results row values, in the order of columns.
+        """
+        for index, value in enumerate(values):
+            buffer = self._buffers[index]
+            if len(buffer) > self._length:
+                # Appended before the error.
+                continue
+            try:
+                buffer.append(value)
+            except OverflowError:
+                buffer = self._buffers[index] = buffer.tolist()
+                self._appenders[index] = buffer.append
+                buffer.append(value)
+
+    def append(self, contributor):
+        """
+        :param contributor: Dict - Take On contributor node, with its responses.
+        """
+        self._append_values(self.plan.values(contributor))
+
+    def extend(self, contributors):
+        for contributor in contributors:
+            self.append(contributor)
+
+    def extend_values(self, rows):
+        """
+        :param rows: Iterable of results row values, already flattened by the plan.
+        """
+        for row in rows:
+            self._append_values(row)
+
+    def to_dataframe(self):
+        """
+        :return: DataFrame - The collected rows, with categorical string columns.
+        """
+        import numpy as np
+        import pandas as pd
+
+        data = {}
+        for column, buffer in zip(self.plan.columns, self._buffers):
+            if isinstance(buffer, _CategoricalBuffer):
+                data[column] = pd.Categorical.from_codes(
+                    np.frombuffer(buffer.codes, dtype=np.int64), buffer.categories)
+            elif isinstance(buffer, array):
+                data[column] = np.frombuffer(buffer, dtype=np.int64)
+            else:
+                data[column] = buffer
+        return pd.DataFrame(data, columns=self.plan.columns)
+
+    def iter_rows(self):
+        """
+        :return: Iterator of Dicts - The collected rows, as IngestPlan.flatten makes
+            them.
+        """
+        columns = []
+        for buffer in self._buffers:
+            if isinstance(buffer, _CategoricalBuffer):
+                # Code -1, a missing value, picks the None on the end.
+                categories = buffer.categories + [None]
+                columns.append([categories[code] for code in buffer.codes])
+            else:
+                columns.append(buffer)
+        for values in zip(*columns):
+            yield dict(zip(self.plan.columns, values))
+
+    def to_json(self):
+        """
+        :return: String - The collected rows as a JSON array of records, encoded by
+            ingest_json.
+        """
+        return ingest_json.dumps(list(self.iter_rows())).decode("utf-8")
+
+
+def iter_column_chunks(plan, rows, chunk_rows):
+    """
+    Collects rows into a ColumnarBuilder at a time, so they can be written out as
+    they are flattened rather than all held first.
+    :param plan: IngestPlan - Plan the rows were flattened with.
+    :param rows: Iterable of results row values.
+    :param chunk_rows: Int - Rows in each builder but the last.
+    :return: Generator of ColumnarBuilders, at least one even if there are no rows.
+    """
+    builder = ColumnarBuilder(plan)
+    yielded = False
+    for row in rows:
+        builder.extend_values((row,))
+        if len(builder) == chunk_rows:
+            yield builder
+            yielded = True
+            builder = ColumnarBuilder(plan)
+    if len(builder) or not yielded:
+        yield builder
+
+
+def plan_key(question_labels, survey_codes, statuses):
+    """
+    :return: String - Hash identifying a set of ingestion parameters. The order of
+        the question labels sets the column order, so it is part of the key.
+    """
+    parameters = json.dumps([question_labels, survey_codes, statuses])
+    return hashlib.sha256(parameters.encode("utf-8")).hexdigest()
+
+
+def get_plan(question_labels, survey_codes, statuses):
+    """
+    Returns the plan for the given ingestion parameters, reusing the one built by an
+    earlier invocation of a warm container where possible.
+    :return: IngestPlan
+    """
+    key = plan_key(question_labels, survey_codes, statuses)
+    plan = _plan_cache.get(key)
+    if plan is None:
+        plan = IngestPlan(question_labels, survey_codes, statuses)
+        _plan_cache[key] = plan
+        if len(_plan_cache) > _PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    else:
+        _plan_cache.move_to_end(key)
+    return plan
+
+
+def expand_brick_types(data, brick_questions, brick_types, brick_type_column):
+    """
+    Expands the questions shared by all brick types into a column per brick type.
+    Each respondent's answers go in the columns for their brick type, with 0 in the
+    columns for the other types, and the shared columns are then dropped.
+    :param data: DataFrame - Flattened contributors.
+    :param brick_questions: Dict - Brick type to a dict of shared question column to
+        brick type question column.
+    :param brick_types: List - Brick types to expand.
+    :param brick_type_column: String - Column holding each respondent's brick type.
+    :return: DataFrame - Expanded contributors.
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Brick types arrive as strings once they have been through JSON.
+    brick_questions = {str(key): value for key, value in brick_questions.items()}
+    shared_questions = []
+    for this_type in brick_types:
+        for shared_question in brick_questions[str(this_type)]:
+            if shared_question not in shared_questions:
+                shared_questions.append(shared_question)
+
+    if not data.columns.isin(shared_questions).any():
+        # Already expanded, by a takeon ingest run with the brick parameters.
+        return data
+
+    respondent_types = data[brick_type_column].to_numpy()
+    type_columns = {}
+    for this_type in brick_types:
+        is_this_type = respondent_types == this_type
+        for shared_question, type_question in brick_questions[str(this_type)].items():
+            type_columns[type_question] = np.where(
+                is_this_type, data[shared_question].to_numpy(), 0)
+
+    return pd.concat([data.drop(columns=shared_questions),
+                      pd.DataFrame(type_columns, index=data.index)], axis=1)
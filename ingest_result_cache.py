@@ -0,0 +1,79 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+import ingest_output_format
+
+# Ingestion parameters whose order doesn't change the output.
+UNORDERED_PARAMETERS = ["statuses", "survey_codes"]
+
+
+def cache_key(snapshot_etag, period, periodicity, survey, ingestion_parameters,
+              output_format=ingest_output_format.JSON):
+    """
+    :param snapshot_etag: String - ETag of the snapshot, identifying its content.
+    :param period: String - Period being ingested.
+    :param periodicity: String - Periodicity of the survey.
+    :param survey: String - Survey being ingested.
+    :param ingestion_parameters: Dict - Question labels, survey codes, statuses etc.
+        The order of the question labels sets the column order, so it is part of
+        the key, the order of the survey codes and statuses isn't.
+    :param output_format: String - Format the output is written in.
+    :return: String - Hash identifying the output of an ingest.
+    """
+    # Mappings become lists of pairs, sorted where their order doesn't matter.
+    canonical_parameters = [
+        [name, sorted(value.items()) if name in UNORDERED_PARAMETERS else
+         list(value.items()) if isinstance(value, dict) else value]
+        for name, value in sorted(ingestion_parameters.items())]
+    parameters = json.dumps([snapshot_etag, period, periodicity, survey,
+                             canonical_parameters, output_format])
+    return hashlib.sha256(parameters.encode("utf-8")).hexdigest()
+
+
+def cache_file_name(prefix, key, output_format=ingest_output_format.JSON):
+    """
+    :param prefix: String - Prefix the cache entries are kept under.
+    :param key: String - Cache key, from cache_key.
+    :param output_format: String - Format the cached output is written in.
+    :return: String - Name of the cache entry in the results bucket.
+    """
+    return f"{prefix}{key}{ingest_output_format.EXTENSIONS[output_format]}"
+
+
+def get_cached_output(s3_resource, bucket_name, file_name, ttl):
+    """
+    Looks up an earlier ingest's output. Entries older than ttl are deleted rather
+    than returned, so a stale entry is only ever read once.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the cache entries are kept in.
+    :param file_name: String - Name of the cache entry, from cache_file_name.
+    :param ttl: Int - Seconds an entry is valid for.
+    :return: Bytes - The cached output, or None on a miss.
+    """
+    cache_object = s3_resource.Object(bucket_name, file_name)
+    try:
+        response = cache_object.get()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+    age = datetime.now(timezone.utc) - response["LastModified"]
+    if age.total_seconds() > ttl:
+        response["Body"].close()
+        cache_object.delete()
+        return None
+    return response["Body"].read()
+
+
+def put_cached_output(s3_resource, bucket_name, file_name, output):
+    """
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Bucket the cache entries are kept in.
+    :param file_name: String - Name of the cache entry, from cache_file_name.
+    :param output: String or Bytes - Ingest output to keep.
+    """
+    s3_resource.Object(bucket_name, file_name).put(Body=output)
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 clients keep 10 connections open by default, so there's no gain in more parts
+# being downloaded at once.
+_MAX_WORKERS = 10
+_PART_SIZE = 8 * 1024 * 1024
+_READ_SIZE = 1024 * 1024
+
+
+class BufferStream:
+    """
+    File-like view of a buffer, so a downloaded object can be read a chunk at a
+    time like a response body without copying all of it.
+    """
+
+    def __init__(self, buffer):
+        """
+        :param buffer: Bytes-like object, e.g. the bytearray from download.
+        """
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk.tobytes()
+
+
+def part_ranges(size, part_size):
+    """
+    :param size: Int - Size of the object in bytes.
+    :param part_size: Int - Largest part to download in one request.
+    :return: List - (start, end) byte offsets of each part, end exclusive.
+    """
+    return [(start, min(start + part_size, size))
+            for start in range(0, size, part_size)]
+
+
+def download(s3_client, bucket_name, file_name, size=None, part_size=_PART_SIZE,
+             max_workers=_MAX_WORKERS, if_match=None):
+    """
+    Downloads an S3 object with concurrent ranged GETs, each one writing straight
+    into its own part of a single preallocated buffer.
+    :param s3_client: Boto3 S3 client, shared between the download threads.
+    :param bucket_name: String - Bucket to read from.
+    :param file_name: String - Full key of the object.
+    :param size: Int - Size of the object in bytes, looked up if not given.
+    :param part_size: Int - Largest part to download in one request.
+    :param max_workers: Int - Most parts to download at once.
+    :param if_match: String - ETag the object must still have.
+    :return: Bytearray - The object.
+    """
+    if size is None:
+        conditions = {} if if_match is None else {"IfMatch": if_match}
+        size = s3_client.head_object(Bucket=bucket_name, Key=file_name,
+                                     **conditions)["ContentLength"]
+    return download_range(s3_client, bucket_name, file_name, 0, size, part_size,
+                          max_workers, if_match)
+
+
+def download_range(s3_client, bucket_name, file_name, start, end, part_size=None,
+                   max_workers=_MAX_WORKERS, if_match=None):
+    """
+    Downloads part of an S3 object in the same way as download.
+    :param s3_client: Boto3 S3 client, shared between the download threads.
+    :param bucket_name: String - Bucket to read from.
+    :param file_name: String - Full key of the object.
+    :param start: Int - Byte offset of the start of the range.
+    :param end: Int - Byte offset of the end of the range, exclusive.
+    :param part_size: Int - Largest part to download in one request, 8 MiB if None.
+    :param max_workers: Int - Most parts to download at once.
+    :param if_match: String - ETag the object must still have.
+    :return: Bytearray - The range's bytes.
+    """
+    conditions = {} if if_match is None else {"IfMatch": if_match}
+    buffer = bytearray(end - start)
+    view = memoryview(buffer)
+
+    def download_part(part_range):
+        part_start, part_end = part_range
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=file_name,
+            Range=f"bytes={start + part_start}-{start + part_end - 1}", **conditions)
+        body = response["Body"]
+        position = part_start
+        chunk = body.read(_READ_SIZE)
+        while chunk:
+            if position + len(chunk) > part_end:
+                raise IOError(f"Read past the end of {file_name} bytes "
+                              f"{start + part_start}-{start + part_end - 1}.")
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+            chunk = body.read(_READ_SIZE)
+        if position != part_end:
+            raise IOError(f"Incomplete read of {file_name} bytes "
+                          f"{start + part_start}-{start + part_end - 1}, "
+                          f"got {position - part_start} bytes.")
+
+    ranges = part_ranges(end - start, part_size or _PART_SIZE)
+    if len(ranges) == 1:
+        download_part(ranges[0])
+    elif ranges:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+            # list() so any part's exception is raised here.
+            list(executor.map(download_part, ranges))
+    return buffer
@@ -0,0 +1,147 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import ingest_codec
+
+# Every part but the last must be at least 5 MiB.
+MIN_PART_SIZE = 5 * 1024 * 1024
+_PART_SIZE = 8 * 1024 * 1024
+
+
+class MultipartUpload:
+    """
+    Writes an S3 object a chunk at a time. Chunks are collected into parts that are
+    uploaded in the background while the next part fills, so at most two parts are
+    held at once. Objects smaller than one part are written with a single put.
+    """
+
+    def __init__(self, s3_client, bucket_name, file_name, part_size=_PART_SIZE,
+                 encoding=None, content_type=None):
+        """
+        :param s3_client: Boto3 S3 client.
+        :param bucket_name: String - Bucket to write to.
+        :param file_name: String - Name of the object.
+        :param part_size: Int - Bytes per part, at least MIN_PART_SIZE.
+        :param encoding: String - gzip or zstd to compress the object and set its
+            Content-Encoding, None writes it uncompressed.
+        :param content_type: String - Content-Type of the object, None for the
+            default.
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"Upload parts must be at least {MIN_PART_SIZE} bytes.")
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.file_name = file_name
+        self.part_size = part_size
+        self._extra_args = {}
+        if encoding is not None:
+            self._extra_args["ContentEncoding"] = encoding
+        if content_type is not None:
+            self._extra_args["ContentType"] = content_type
+        self._compressor = None if encoding is None else \
+            ingest_codec.compressobj(encoding)
+        # Bytes written to S3 so far, after compression.
+        self.size = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._pending = None
+        self._parts = []
+        self._finished = False
+
+    def write(self, data):
+        """
+        :param data: String or Bytes - Next chunk of the object, strings are UTF-8
+            encoded.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+
+    def close(self):
+        """
+        Writes whatever is left and completes the object.
+        """
+        if self._compressor is not None:
+            self._buffer += self._compressor.flush()
+        if self._upload_id is None:
+            self.size = len(self._buffer)
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.file_name,
+                                      Body=bytes(self._buffer), **self._extra_args)
+        else:
+            if self._buffer:
+                self._upload_part()
+            self._wait()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.file_name,
+                UploadId=self._upload_id, MultipartUpload={"Parts": self._parts})
+            self._executor.shutdown()
+        self._buffer = bytearray()
+        self._finished = True
+
+    def abort(self):
+        """
+        Abandons the upload so S3 doesn't keep the parts already uploaded. Does
+        nothing if the object was already completed.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._buffer = bytearray()
+        if self._upload_id is None:
+            return
+        self._executor.shutdown()
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name,
+                                              Key=self.file_name,
+                                              UploadId=self._upload_id)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.file_name,
+                **self._extra_args)["UploadId"]
+            # One part uploads while the next one fills.
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._wait()
+        part_number = len(self._parts) + 1
+        body = bytes(self._buffer)
+        self.size += len(body)
+        self._buffer = bytearray()
+        self._pending = self._executor.submit(
+            self.s3_client.upload_part, Bucket=self.bucket_name, Key=self.file_name,
+            UploadId=self._upload_id, PartNumber=part_number, Body=body)
+        self._parts.append({"PartNumber": part_number})
+
+    def _wait(self):
+        # Raises the previous part's error, if it had one.
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            self._parts[-1]["ETag"] = pending.result()["ETag"]
+
+
+def upload_chunks(chunks, uploads):
+    """
+    Writes a stream of chunks to one or more uploads as it is produced. If anything
+    fails every upload not yet completed is aborted and the error raised, for the
+    handler to report.
+    :param chunks: Iterable of String or Bytes.
+    :param uploads: List of MultipartUpload.
+    """
+    try:
+        for chunk in chunks:
+            for upload in uploads:
+                upload.write(chunk)
+        for upload in uploads:
+            upload.close()
+    except Exception:
+        for upload in uploads:
+            try:
+                upload.abort()
+            except Exception:
+                # Don't hide the error that caused the abort.
+                logging.exception(f"Failed to abort upload of {upload.file_name}.")
+        raise
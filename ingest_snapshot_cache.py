@@ -0,0 +1,230 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import time
+
+import ingest_codec
+import ingest_json
+import ingest_metrics
+import ingest_snapshot_parser
+
+# Lambda keeps /tmp between invocations of a warm container.
+CACHE_DIRECTORY = "/tmp/ingest-snapshot-cache"
+
+_READ_SIZE = 1024 * 1024
+# Parts untouched for longer than any invocation runs were left by one that failed.
+# Newer ones may still be being written by another process sharing the directory.
+_STALE_SECONDS = 60 * 60
+# The index loaded by the last invocation, reused while the container stays warm.
+_loaded_index = {}
+
+
+class _CacheFull(Exception):
+    pass
+
+
+class _CopyingStream:
+    """
+    Passes reads through from a stream, writing a copy of everything read to a file,
+    so a snapshot is saved and indexed in one pass.
+    """
+
+    def __init__(self, stream, file, max_size):
+        """
+        :param stream: File-like object to read from.
+        :param file: Binary file to copy what is read to.
+        :param max_size: Int - Most bytes to copy before giving up.
+        """
+        self._stream = stream
+        self._file = file
+        self._max_size = max_size
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        self.size += len(chunk)
+        if self.size > self._max_size:
+            raise _CacheFull()
+        self._file.write(chunk)
+        return chunk
+
+
+class CachedSnapshot:
+    """
+    Snapshot kept in the cache, uncompressed, with the index of where each of its
+    contributors lies.
+    """
+
+    def __init__(self, path, index):
+        """
+        :param path: String - The snapshot's file.
+        :param index: Dict - The snapshot's index, from
+            ingest_snapshot_parser.index_contributors.
+        """
+        self.path = path
+        self.index = index
+
+    def iter_contributors(self, survey_codes, periods, shard=None):
+        """
+        Maps the snapshot into memory and decodes only the contributors wanted, so
+        the pages holding the rest are never read.
+        :param survey_codes: Take On survey codes to keep.
+        :param periods: Periods to keep.
+        :param shard: Tuple - (shard index, shard count) of the contributors to keep.
+        :return: Generator of contributor dicts.
+        """
+        with open(self.path, "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from ingest_snapshot_parser.iter_indexed_contributors(
+                buffer, self.index, survey_codes, periods, shard)
+
+
+def cache_key(bucket_name, file_name, etag):
+    """
+    :param bucket_name: String - Bucket holding the snapshot.
+    :param file_name: String - Key of the snapshot.
+    :param etag: String - ETag of the snapshot, identifying its content.
+    :return: String - Hash naming the snapshot's cache entry.
+    """
+    return hashlib.sha256(json.dumps([bucket_name, file_name, etag])
+                          .encode("utf-8")).hexdigest()
+
+
+def _remove(path):
+    # Another process sharing the directory may have removed it first.
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _entries(directory):
+    """
+    Lists the complete cache entries, removing any stale part written by an
+    invocation that failed.
+    :return: List - (last used time, entry path, bytes) of each entry, least
+        recently used first.
+    """
+    names = set(os.listdir(directory))
+    stale_before = time.time() - _STALE_SECONDS
+    entries = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".index") and name[:-len(".index")] + ".json" in names:
+                entry_path = path[:-len(".index")]
+                index_stat = os.stat(path)
+                entries.append((index_stat.st_mtime, entry_path, index_stat.st_size +
+                                os.path.getsize(entry_path + ".json")))
+            elif (name.endswith(".tmp") or name.endswith(".index") or
+                  (name.endswith(".json") and
+                   name[:-len(".json")] + ".index" not in names)) and \
+                    os.stat(path).st_mtime < stale_before:
+                _remove(path)
+        except FileNotFoundError:
+            # Evicted by another process while being listed.
+            pass
+    return sorted(entries)
+
+
+def _evict(directory, max_size, needed, keep=None):
+    """
+    Deletes the least recently used entries until the cache holds at most max_size
+    bytes, less what is needed for a new entry.
+    :param keep: String - Entry path never to delete.
+    """
+    entries = _entries(directory)
+    total = sum(size for _, _, size in entries)
+    for _, entry_path, size in entries:
+        if total + needed <= max_size:
+            return
+        if entry_path != keep:
+            # The index goes first, as an entry without one isn't complete.
+            _remove(entry_path + ".index")
+            _remove(entry_path + ".json")
+            total -= size
+
+
+def _load_index(index_path):
+    if index_path not in _loaded_index:
+        _loaded_index.clear()
+        with open(index_path, "rb") as file:
+            _loaded_index[index_path] = ingest_json.loads(file.read())
+    return _loaded_index[index_path]
+
+
+def open_snapshot(s3_client, bucket_name, file_name, max_size, etag=None,
+                  directory=None):
+    """
+    Returns a snapshot from the cache, first downloading it, uncompressed, and
+    indexing its contributors as it is written if it isn't there. The least
+    recently used snapshots are evicted to keep the cache within max_size.
+    :param s3_client: Boto3 S3 client.
+    :param bucket_name: String - Bucket holding the snapshot.
+    :param file_name: String - Key of the snapshot.
+    :param max_size: Int - Most bytes of disk the cache may use.
+    :param etag: String - ETag the snapshot must have, looked up if not given.
+    :param directory: String - Directory holding the cache, CACHE_DIRECTORY if not
+        given.
+    :return: CachedSnapshot, or None if the snapshot doesn't fit in the cache.
+    """
+    directory = directory or CACHE_DIRECTORY
+    if etag is None:
+        etag = s3_client.head_object(Bucket=bucket_name, Key=file_name)["ETag"]
+    key = cache_key(bucket_name, file_name, etag)
+    entry_path = os.path.join(directory, key)
+    try:
+        # Mark it as the most recently used.
+        os.utime(entry_path + ".index")
+        cached_snapshot = CachedSnapshot(entry_path + ".json",
+                                         _load_index(entry_path + ".index"))
+        ingest_metrics.add("snapshot_cache_hits", 1)
+        return cached_snapshot
+    except FileNotFoundError:
+        # Not cached, or evicted by another process sharing the directory.
+        pass
+
+    ingest_metrics.add("snapshot_cache_misses", 1)
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_name, IfMatch=etag)
+    if response["ContentLength"] > max_size:
+        response["Body"].close()
+        return None
+    os.makedirs(directory, exist_ok=True)
+    # Make room for the snapshot as stored, a compressed one needs more once written
+    # but its size isn't known until then.
+    _evict(directory, max_size, response["ContentLength"])
+
+    # Each process writes its own parts, so processes sharing the directory never
+    # write over each other's.
+    json_file, json_part = tempfile.mkstemp(suffix=".tmp", prefix=key, dir=directory)
+    index_part = None
+    try:
+        with open(json_file, "wb") as file:
+            stream = _CopyingStream(ingest_codec.open_stream(
+                response["Body"], response.get("ContentEncoding")), file, max_size)
+            index = ingest_snapshot_parser.index_contributors(stream, _READ_SIZE)
+            # Copy anything after the end of the document too.
+            while stream.read(_READ_SIZE):
+                pass
+        index_file, index_part = tempfile.mkstemp(suffix=".tmp", prefix=key,
+                                                  dir=directory)
+        with open(index_file, "wb") as file:
+            file.write(ingest_json.dumps(index))
+        os.replace(json_part, entry_path + ".json")
+        os.replace(index_part, entry_path + ".index")
+    except _CacheFull:
+        response["Body"].close()
+        _remove(json_part)
+        return None
+    except Exception:
+        for path in [json_part, index_part]:
+            if path is not None:
+                _remove(path)
+        raise
+
+    _evict(directory, max_size, 0, keep=entry_path)
+    _loaded_index.clear()
+    _loaded_index[entry_path + ".index"] = index
+    return CachedSnapshot(entry_path + ".json", index)
@@ -0,0 +1,604 @@
+import collections
+import itertools
+import json
+import re
+
+import ingest_json
+import ingest_metrics
+from ingest_s3_download import BufferStream
+
+RESPONSES_KEY = "responsesByReferenceAndPeriodAndSurvey"
+
+_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?"
+                     r"|true|false|null")
+# Everything up to the next bracket, stepping over complete strings.
+_SKIP = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_ESCAPE = re.compile(rb"\\.", re.DOTALL)
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def _to_latin1(data):
+    """
+    Holds a document's UTF-8 bytes one character per byte, so positions in the text
+    are byte offsets and any part of it can be turned back into its bytes.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return data.decode("latin-1")
+
+
+def _bracket_ends(data):
+    """
+    Finds where each object or array in a run of array items ends, by counting the
+    brackets outside strings with numpy rather than stepping over every string.
+    :param data: Bytes - Part of the document, starting at an array item.
+    :return: Tuple - (List of the positions just after each item's closing bracket,
+        Boolean - whether the search ran to the end of data, so more of the document
+        may hold more items, rather than stopping at the end of the array or at a
+        bracket inside a string, from where items must be stepped over one by one)
+    """
+    import numpy as np
+
+    if b"\\" in data:
+        # Blank out escapes, so escaped quotes aren't taken for the end of a string.
+        data = _ESCAPE.sub(b"__", data)
+    chars = np.frombuffer(data, np.uint8)
+    brackets = np.flatnonzero((chars == ord("{")) | (chars == ord("}")) |
+                              (chars == ord("[")) | (chars == ord("]")))
+    quotes = np.flatnonzero(chars == ord('"'))
+    # A bracket is inside a string when an odd number of quotes come before it.
+    quotes_before = np.searchsorted(quotes, brackets)
+    exhausted = True
+    in_string = np.flatnonzero(quotes_before % 2)
+    if len(in_string):
+        # Unless it is in a string running past the end of data, which more of the
+        # document will finish.
+        exhausted = quotes_before[in_string[0]] == len(quotes)
+        brackets = brackets[:in_string[0]]
+    # "{" and "[" have bit 1 set, "}" and "]" don't.
+    depth = np.cumsum((chars[brackets] & 2).astype(np.int64) - 1)
+    closed = np.flatnonzero(depth < 0)
+    if len(closed):
+        # The end of the array.
+        exhausted = False
+        depth = depth[:closed[0]]
+    return (brackets[np.flatnonzero(depth == 0)] + 1).tolist(), exhausted
+
+
+class SnapshotReader:
+    """
+    Incremental reader over a Take On snapshot. Only a small window of the
+    document is held in memory, values are decoded when asked for and any
+    subtree that is not needed is stepped over without being built.
+    """
+
+    def __init__(self, source, chunk_size=_CHUNK_SIZE):
+        """
+        :param source: File-like object (read(size) returning bytes or str),
+            bytes or str holding the JSON document. A bytearray or memoryview
+            buffer, e.g. from ingest_s3_download, is read a chunk at a time
+            rather than all at once.
+        :param chunk_size: Number of bytes to read from a file-like source at a time.
+        """
+        self._chunk_size = chunk_size
+        self._mark = None
+        self._pos = 0
+        # Bytes dropped from the front of the buffer so far.
+        self._dropped = 0
+        if isinstance(source, (bytearray, memoryview)):
+            self._buffer = ""
+            self._stream = BufferStream(source)
+        elif isinstance(source, (bytes, str)):
+            self._buffer = _to_latin1(source)
+            self._stream = None
+        else:
+            self._buffer = ""
+            self._stream = source
+
+    def _fill(self):
+        """
+        Reads the next chunk into the buffer, dropping whatever has already been
+        consumed (unless a capture is in progress).
+        :return: False if the end of the document had already been reached.
+        """
+        if self._stream is None:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        text = _to_latin1(chunk)
+        if not chunk:
+            self._stream = None
+
+        keep_from = self._pos if self._mark is None else self._mark
+        self._buffer = self._buffer[keep_from:] + text
+        self._dropped += keep_from
+        self._pos -= keep_from
+        if self._mark is not None:
+            self._mark -= keep_from
+        return True
+
+    def tell(self):
+        """
+        :return: Byte offset of the next unread character from the start of the
+            document.
+        """
+        return self._dropped + self._pos
+
+    def _error(self, expected):
+        found = self._buffer[self._pos:self._pos + 20] or "end of document"
+        return SnapshotFormatError(f"Invalid snapshot: expected {expected}, "
+                                   f"found {found!r}.")
+
+    def _peek(self):
+        """
+        :return: The next non-whitespace character, or "" at the end of the document.
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self._error(repr(char))
+        self._pos += 1
+
+    def _match(self, pattern, expected):
+        """
+        Consumes a token at the current position, reading more of the document if
+        the token could be running past the end of the buffer.
+        :return: The token's text.
+        """
+        self._peek()
+        while True:
+            match = pattern.match(self._buffer, self._pos)
+            if match is not None and match.end() < len(self._buffer):
+                break
+            if not self._fill():
+                if match is None:
+                    raise self._error(expected)
+                break
+        self._pos = match.end()
+        return match.group()
+
+    def read_string(self):
+        text = self._match(_STRING, "a string")
+        if "\\" in text or not text.isascii():
+            return json.loads(text.encode("latin-1"))
+        return text[1:-1]
+
+    def skip_value(self):
+        """
+        Steps over the next value without decoding it.
+        """
+        char = self._peek()
+        if char == '"':
+            self._match(_STRING, "a string")
+        elif char in ("{", "["):
+            depth = 0
+            while True:
+                self._pos = _SKIP.match(self._buffer, self._pos).end()
+                if self._pos == len(self._buffer) or \
+                        self._buffer[self._pos] == '"':
+                    # Out of buffer, possibly part way through a string.
+                    if not self._fill():
+                        raise self._error("end of value")
+                    continue
+                if self._buffer[self._pos] in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                self._pos += 1
+                if depth == 0:
+                    return
+        else:
+            self._match(_SCALAR, "a value")
+
+    def capture_value(self):
+        """
+        Steps over the next value, keeping its text.
+        :return: The undecoded JSON text of the value.
+        """
+        self._peek()
+        self._mark = self._pos
+        try:
+            self.skip_value()
+            return self._buffer[self._mark:self._pos]
+        finally:
+            self._mark = None
+
+    def read_value(self):
+        return ingest_json.loads(self.capture_value().encode("latin-1"))
+
+    def iter_keys(self):
+        """
+        Iterates over the keys of the next object. The caller must consume each
+        key's value before asking for the next key.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_string()
+            self._expect(":")
+            yield key
+            char = self._peek()
+            self._pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                self._pos -= 1
+                raise self._error("',' or '}'")
+
+    def iter_items(self):
+        """
+        Iterates over the next array. The caller must consume each item before
+        asking for the next one.
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            char = self._peek()
+            self._pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                self._pos -= 1
+                raise self._error("',' or ']'")
+
+    def _find_item_ends(self):
+        """
+        Finds the ends of the objects and arrays in the buffer from the current
+        array item on, reading more of the document until at least the current
+        item's end is found.
+        :return: List - Byte offsets from the start of the document just after
+            each item.
+        """
+        while True:
+            ends, exhausted = _bracket_ends(
+                self._buffer[self._pos:].encode("latin-1"))
+            if ends or not exhausted or self._stream is None:
+                return [self._dropped + self._pos + end for end in ends]
+            # Read at least as much again, so a large item isn't searched for from
+            # its start once per chunk.
+            size = len(self._buffer) - self._pos
+            while len(self._buffer) - self._pos < 2 * size and self._fill():
+                pass
+
+    def capture_items(self):
+        """
+        Iterates over the next array, keeping each item's text. The ends of all the
+        objects and arrays in the buffer are found at once, rather than by stepping
+        over every string as capture_value does.
+        :return: Generator of each item's undecoded JSON text, as UTF-8 bytes held
+            one per character.
+        """
+        ends = collections.deque()
+        for _ in self.iter_items():
+            char = self._peek()
+            start = self.tell()
+            while ends and ends[0] <= start:
+                ends.popleft()
+            if char in ("{", "["):
+                if not ends:
+                    ends.extend(self._find_item_ends())
+                if ends:
+                    end = ends.popleft() - self._dropped
+                    text = self._buffer[self._pos:end]
+                    self._pos = end
+                    yield text
+                    continue
+            # A scalar, or an item holding a bracket inside a string.
+            yield self.capture_value()
+
+
+def _iter_at(reader, path, handler):
+    """
+    Follows a path of object keys, stepping over everything off the path, and
+    hands the value at the end of it to handler.
+    """
+    if not path:
+        yield from handler(reader)
+        return
+    for key in reader.iter_keys():
+        if key == path[0]:
+            yield from _iter_at(reader, path[1:], handler)
+        else:
+            reader.skip_value()
+
+
+def _quoted(codes):
+    """
+    :param codes: Survey codes or periods.
+    :return: List - How each code is written in a snapshot's text without escapes,
+        or None if some code isn't a string.
+    """
+    if not all(isinstance(code, str) for code in codes):
+        return None
+    return [_to_latin1(json.dumps(code, ensure_ascii=False)) for code in codes]
+
+
+def _decode_contributor(text):
+    """
+    :param text: String - A contributor node's text, from SnapshotReader.capture_items.
+    :return: Contributor dict.
+    """
+    try:
+        contributor = ingest_json.loads(text.encode("latin-1"))
+    except ValueError as e:
+        raise SnapshotFormatError(f"Invalid snapshot: {e}")
+    if not isinstance(contributor, dict):
+        raise SnapshotFormatError(f"Invalid snapshot: expected a contributor object, "
+                                  f"found {text!r:.20}.")
+    return contributor
+
+
+def _might_be_wanted(survey_codes, periods):
+    """
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :return: Function - Whether a contributor node's text could hold one of the periods
+        and survey codes. Without escapes they are written as they are, so a node
+        whose text holds neither can't be wanted.
+    """
+    period_codes = _quoted(periods)
+    survey_code_texts = _quoted(survey_codes)
+
+    def might_be_wanted(text):
+        if period_codes is None or survey_code_texts is None or "\\" in text:
+            return True
+        return any(code in text for code in period_codes) and \
+            any(code in text for code in survey_code_texts)
+
+    return might_be_wanted
+
+
+def _iter_node_texts(reader, survey_codes, periods):
+    """
+    Steps through a snapshot to the contributor nodes of the surveys wanted.
+    :param reader: SnapshotReader - Reader at the start of the snapshot.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :return: Generator of (Int - number of the contributorsBySurvey.nodes array
+        holding the node, String - the node's text) for each node that might be
+        wanted, with the reader just after it.
+    """
+    might_be_wanted = _might_be_wanted(survey_codes, periods)
+    arrays = itertools.count()
+
+    def read_contributors(reader):
+        array = next(arrays)
+        scanned = 0
+        for text in reader.capture_items():
+            scanned += 1
+            if might_be_wanted(text):
+                yield array, text
+        ingest_metrics.add("contributors_scanned", scanned)
+
+    def read_survey(reader):
+        for _ in reader.iter_items():
+            survey = None
+            for key in reader.iter_keys():
+                if key == "survey":
+                    survey = reader.read_value()
+                elif key == "contributorsBySurvey" and \
+                        (survey is None or survey in survey_codes):
+                    yield from _iter_at(reader, ["nodes"], read_contributors)
+                else:
+                    reader.skip_value()
+
+    return _iter_at(reader, ["data", "allSurveys", "nodes"], read_survey)
+
+
+def iter_contributor_texts(source, survey_codes, periods, chunk_size=_CHUNK_SIZE):
+    """
+    Streams the text of the contributor nodes that might be wanted out of a Take On
+    snapshot, in the order they appear in
+    data.allSurveys.nodes[].contributorsBySurvey.nodes[], without decoding them.
+    :param source: File-like object, bytes or str holding the snapshot.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param chunk_size: Number of bytes to read from a file-like source at a time.
+    :return: Generator of each node's undecoded JSON text, for decode_contributors.
+    """
+    reader = SnapshotReader(source, chunk_size)
+    for _, text in _iter_node_texts(reader, survey_codes, periods):
+        yield text
+
+
+def decode_contributors(texts, survey_codes, periods, fields=None, shard=None):
+    """
+    Decodes contributor node texts, each in one call, keeping those for the periods
+    and survey codes.
+    :param texts: Iterable of contributor node texts, e.g. from
+        iter_contributor_texts.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param fields: Contributor keys to keep (period, survey and the responses are
+        always kept), None keeps them all.
+    :param shard: Tuple - (shard index, shard count) to only keep every shard count'th
+        contributor, starting from shard index. None keeps them all.
+    :return: Generator of contributor dicts.
+    """
+    if fields is not None:
+        fields = frozenset(fields) | {"period", "survey", RESPONSES_KEY}
+    ordinals = itertools.count()
+    for text in texts:
+        contributor = _decode_contributor(text)
+        if contributor.get("period") not in periods or \
+                contributor.get("survey") not in survey_codes:
+            continue
+        if shard is not None and next(ordinals) % shard[1] != shard[0]:
+            continue
+        if fields is not None:
+            contributor = {key: value for key, value in contributor.items()
+                           if key in fields}
+        yield contributor
+
+
+def iter_contributors(source, survey_codes, periods, fields=None, shard=None,
+                      chunk_size=_CHUNK_SIZE):
+    """
+    Streams the contributors out of a Take On snapshot, one at a time, in the order
+    they appear in data.allSurveys.nodes[].contributorsBySurvey.nodes[]. Each
+    contributor node is found whole and only decoded, in one call, if its text holds
+    one of the periods and survey codes.
+    :param source: File-like object, bytes or str holding the snapshot.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param fields: Contributor keys to keep (period, survey and the responses are
+        always kept), None keeps them all.
+    :param shard: Tuple - (shard index, shard count) to only keep every shard count'th
+        contributor, starting from shard index. None keeps them all.
+    :param chunk_size: Number of bytes to read from a file-like source at a time.
+    :return: Generator of contributor dicts.
+    """
+    return decode_contributors(
+        iter_contributor_texts(source, survey_codes, periods, chunk_size),
+        survey_codes, periods, fields, shard)
+
+
+def find_contributor_ranges(source, survey_codes, periods, chunk_size=_CHUNK_SIZE):
+    """
+    Finds where the contributor nodes that might be wanted lie in an uncompressed
+    snapshot, without decoding them, so they can be split between shards that each
+    read only their own.
+    :param source: Bytes-like or binary file-like object holding the snapshot.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param chunk_size: Number of bytes to read from a file-like source at a time.
+    :return: List - (number of the contributorsBySurvey.nodes array holding the node,
+        start, end) byte range of each node, in document order.
+    """
+    reader = SnapshotReader(source, chunk_size)
+    ranges = []
+    for array, text in _iter_node_texts(reader, survey_codes, periods):
+        end = reader.tell()
+        ranges.append((array, end - len(text), end))
+    return ranges
+
+
+def split_ranges(ranges, count):
+    """
+    Splits contributor nodes between shards, each taking an equal run of them in
+    document order. Consecutive nodes of the same array are read as one span, which
+    also holds the nodes between them that can't be wanted.
+    :param ranges: List - Node ranges, from find_contributor_ranges.
+    :param count: Int - Number of shards.
+    :return: List - Each shard's [start, end] spans, in document order. Shards past
+        the number of nodes get none.
+    """
+    shards = []
+    for index in range(count):
+        spans = []
+        previous_array = None
+        for array, start, end in ranges[len(ranges) * index // count:
+                                        len(ranges) * (index + 1) // count]:
+            if array == previous_array:
+                spans[-1][1] = end
+            else:
+                spans.append([start, end])
+            previous_array = array
+        shards.append(spans)
+    return shards
+
+
+def iter_span_texts(span, survey_codes, periods, chunk_size=_CHUNK_SIZE):
+    """
+    Streams the text of the contributor nodes that might be wanted out of a span from
+    split_ranges, read on its own.
+    :param span: Bytes-like object - The snapshot's bytes from the span's start to
+        its end.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param chunk_size: Number of bytes to read at a time.
+    :return: Generator of each node's undecoded JSON text, for decode_contributors.
+    """
+    # The span is a run of array items, so it is read as an array of its own.
+    buffer = bytearray(b"[")
+    buffer += span
+    buffer += b"]"
+    reader = SnapshotReader(buffer, chunk_size)
+    might_be_wanted = _might_be_wanted(survey_codes, periods)
+    scanned = 0
+    for text in reader.capture_items():
+        scanned += 1
+        if might_be_wanted(text):
+            yield text
+    ingest_metrics.add("contributors_scanned", scanned)
+
+
+def index_contributors(source, chunk_size=_CHUNK_SIZE):
+    """
+    Finds where each contributor lies in an uncompressed snapshot, so the ones a run
+    needs can later be decoded on their own without reading the rest.
+    :param source: Bytes-like or binary file-like object holding the snapshot.
+    :param chunk_size: Number of bytes to read from a file-like source at a time.
+    :return: Dict - Survey to period to the contributors' byte ranges, flattened as
+        [start, end, start, end...] in document order.
+    """
+    reader = SnapshotReader(source, chunk_size)
+    index = {}
+
+    def read_contributors(reader):
+        for text in reader.capture_items():
+            contributor = _decode_contributor(text)
+            end = reader.tell()
+            yield contributor.get("survey"), contributor.get("period"), \
+                end - len(text), end
+
+    def read_survey(reader):
+        for _ in reader.iter_items():
+            for key in reader.iter_keys():
+                if key == "contributorsBySurvey":
+                    yield from _iter_at(reader, ["nodes"], read_contributors)
+                else:
+                    reader.skip_value()
+
+    for survey, period, start, end in _iter_at(
+            reader, ["data", "allSurveys", "nodes"], read_survey):
+        # Contributors without string codes never match a run, so aren't indexed.
+        if isinstance(survey, str) and isinstance(period, str):
+            index.setdefault(survey, {}).setdefault(period, []).extend((start, end))
+    return index
+
+
+def iter_indexed_contributors(buffer, index, survey_codes, periods, shard=None):
+    """
+    Decodes only the contributors for the given surveys and periods out of an
+    indexed snapshot, in the same order as iter_contributors.
+    :param buffer: Bytes-like object holding the snapshot, e.g. an mmap of it.
+    :param index: Dict - The snapshot's index, from index_contributors.
+    :param survey_codes: Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param shard: Tuple - (shard index, shard count) to only keep every shard count'th
+        contributor, starting from shard index. None keeps them all.
+    :return: Generator of contributor dicts.
+    """
+    ranges = []
+    scanned = 0
+    for survey in survey_codes:
+        survey_index = index.get(survey, {})
+        for period in periods:
+            offsets = survey_index.get(period, [])
+            ranges.extend(zip(offsets[::2], offsets[1::2]))
+        # Counted as iter_contributors counts them, every contributor of the surveys
+        # whatever its period, though only the ranges kept are read.
+        scanned += sum(len(offsets) for offsets in survey_index.values()) // 2
+    ranges.sort()
+    if shard is not None:
+        ranges = ranges[shard[0]::shard[1]]
+    ingest_metrics.add("contributors_scanned", scanned)
+    for start, end in ranges:
+        yield ingest_json.loads(buffer[start:end])
@@ -1,8 +1,62 @@
-import json
+import itertools
 import logging
+from urllib.parse import urlparse
 
+import boto3
 from es_aws_functions import general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, ValidationError, fields, validates_schema
+from marshmallow.validate import Length, OneOf, Range
+
+import ingest_codec
+import ingest_delta
+import ingest_json
+import ingest_metrics
+import ingest_output_format
+import ingest_parallel
+import ingest_period_output
+import ingest_plan
+import ingest_result_cache
+import ingest_s3_download
+import ingest_s3_upload
+import ingest_snapshot_cache
+import ingest_snapshot_parser
+import ingest_warm_state
+
+# Contributor fields used by the transform, anything else is skipped when streaming.
+CONTRIBUTOR_FIELDS = ["enterprisename", "enterprisereference", "period", "reference",
+                      "region", "status", "survey"]
+
+
+def validate_snapshot_data(data):
+    """
+    Cheap structural check of an inline snapshot. Only the outer levels are looked
+    at, so the cost doesn't grow with the snapshot; anything wrong further in is
+    reported by the transform as it reaches it.
+    :param data: Take On snapshot, as passed in the runtime variables.
+    """
+    if isinstance(data, str):
+        # Compressed, it is checked once decompressed.
+        return
+    if not isinstance(data, dict):
+        raise ValidationError("Not a valid mapping type.")
+    try:
+        surveys = data["data"]["allSurveys"]["nodes"]
+    except (KeyError, TypeError):
+        raise ValidationError("Missing data.allSurveys.nodes.")
+    if not isinstance(surveys, list):
+        raise ValidationError("data.allSurveys.nodes is not a list.")
+
+
+class RunSchema(Schema):
+
+    class Meta:
+        unknown = EXCLUDE
+
+    out_file_name = fields.Str(required=True)
+    period = fields.Str(required=True)
+    periodicity = fields.Str(required=True)
+    question_labels = fields.Dict(required=True)
+    survey_codes = fields.Dict(required=True)
 
 
 class RuntimeSchema(Schema):
@@ -15,14 +69,445 @@ class RuntimeSchema(Schema):
         raise ValueError(f"Error validating runtime params: {e}")
 
     bpm_queue_url = fields.Str(required=True)
-    data = fields.Dict(required=True)
+    brick_questions = fields.Dict()
+    brick_type_column = fields.Str()
+    brick_types = fields.List(fields.Int(required=True))
+    cache_file_name = fields.Str()
+    # Passed through as is rather than walked and copied by fields.Dict.
+    data = fields.Raw(validate=validate_snapshot_data)
+    delta_file_name = fields.Str()
+    download_part_size = fields.Int()
     environment = fields.Str(required=True)
-    period = fields.Str(required=True)
-    periodicity = fields.Str(required=True)
-    question_labels = fields.Dict(required=True)
+    metrics = fields.Bool(missing=False)
+    out_file_name = fields.Str()
+    output_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    output_format = fields.Str(missing=ingest_output_format.JSON,
+                               validate=OneOf(ingest_output_format.FORMATS))
+    # Read and flatten a snapshot passed by reference in up to this many processes,
+    # one per parallel_snapshot_size bytes of it.
+    parallel_snapshot_size = fields.Int(missing=20000000, validate=Range(min=1))
+    parallel_workers = fields.Int(validate=Range(min=1))
+    payload_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    period = fields.Str()
+    period_output_prefix = fields.Str()
+    periodicity = fields.Str()
+    previous_period_max_age = fields.Int()
+    question_labels = fields.Dict()
+    results_bucket_name = fields.Str()
+    # Several runs ingested from one scan of the snapshot, in place of period,
+    # periodicity, question_labels and survey_codes.
+    runs = fields.List(fields.Nested(RunSchema), validate=Length(min=1))
+    shard_count = fields.Int()
+    shard_index = fields.Int()
+    # Keep snapshots passed by reference, uncompressed and indexed, in up to this
+    # many bytes of /tmp for later invocations of a warm container to reuse.
+    snapshot_cache_size = fields.Int(validate=Range(min=1))
+    snapshot_etag = fields.Str()
+    snapshot_last_modified = fields.Int()
+    # Only read these [start, end] byte ranges of the uncompressed snapshot passed by
+    # reference, a shard's share of its contributors.
+    snapshot_ranges = fields.List(fields.List(fields.Int(), validate=Length(equal=2)))
+    snapshot_s3_uri = fields.Str()
+    snapshot_size = fields.Int()
     statuses = fields.Dict(required=True)
     survey = fields.Str(required=True)
-    survey_codes = fields.Dict(required=True)
+    survey_codes = fields.Dict()
+    upload_part_size = fields.Int(validate=Range(min=ingest_s3_upload.MIN_PART_SIZE))
+
+    @validates_schema
+    def validate_snapshot_source(self, data, **kwargs):
+        # The snapshot is either passed inline or by reference to S3.
+        if "snapshot_s3_uri" not in data and "data" not in data:
+            raise ValidationError("Missing data for required field.", "data")
+        # When given an output file the method writes to the results bucket itself.
+        if any(field in data for field in ["cache_file_name", "delta_file_name",
+                                           "out_file_name", "period_output_prefix"]) and \
+                "results_bucket_name" not in data:
+            raise ValidationError("Missing data for required field.",
+                                  "results_bucket_name")
+
+    @validates_schema
+    def validate_runs(self, data, **kwargs):
+        if "runs" not in data:
+            for field in ["period", "periodicity", "question_labels", "survey_codes"]:
+                if field not in data:
+                    raise ValidationError("Missing data for required field.", field)
+            return
+        # Each run's output is written to the results bucket by the method.
+        if "results_bucket_name" not in data:
+            raise ValidationError("Missing data for required field.",
+                                  "results_bucket_name")
+        for field in ["cache_file_name", "delta_file_name", "out_file_name",
+                      "period_output_prefix", "shard_index", "snapshot_ranges"]:
+            if field in data:
+                raise ValidationError("Can't be given with runs.", field)
+
+    @validates_schema
+    def validate_payload_compression(self, data, **kwargs):
+        # Compressed data is passed as a base64 string.
+        if isinstance(data.get("data"), str) and "payload_compression" not in data:
+            raise ValidationError("Not a valid mapping type.", "data")
+
+    @validates_schema
+    def validate_shard(self, data, **kwargs):
+        if ("shard_index" in data) != ("shard_count" in data):
+            raise ValidationError("Shard index and count must be given together.")
+        if "shard_index" in data and \
+                not 0 <= data["shard_index"] < data["shard_count"]:
+            raise ValidationError("Shard index must be less than shard count.",
+                                  "shard_index")
+        if "snapshot_ranges" in data and "snapshot_s3_uri" not in data:
+            raise ValidationError("Missing data for required field.",
+                                  "snapshot_s3_uri")
+        # Each shard would only see part of the previous run's contributors.
+        if ("shard_index" in data or "snapshot_ranges" in data) and \
+                "delta_file_name" in data:
+            raise ValidationError("Delta ingest can't be sharded.", "delta_file_name")
+
+    @validates_schema
+    def validate_period_output(self, data, **kwargs):
+        # Reusing the previous period's rows needs to know how old they can be.
+        if "period_output_prefix" in data:
+            for field in ["previous_period_max_age", "snapshot_last_modified"]:
+                if field not in data:
+                    raise ValidationError("Missing data for required field.", field)
+            if "shard_index" in data or "snapshot_ranges" in data:
+                raise ValidationError("Period outputs can't be sharded.",
+                                      "period_output_prefix")
+
+    @validates_schema
+    def validate_brick_parameters(self, data, **kwargs):
+        # Brick type expansion needs all of its parameters or none of them.
+        brick_fields = ["brick_questions", "brick_type_column", "brick_types"]
+        if any(field in data for field in brick_fields):
+            for field in brick_fields:
+                if field not in data:
+                    raise ValidationError(
+                        "Missing data for required field.", field)
+
+
+def iter_snapshot_contributors(input_json, survey_codes, periods):
+    """
+    Walks an already decoded snapshot, yielding the contributors the transform needs.
+    :param input_json: Dict - Take On snapshot.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :return: Generator of contributor dicts.
+    """
+    for survey in input_json["data"]["allSurveys"]["nodes"]:
+        if not isinstance(survey, dict):
+            raise ingest_snapshot_parser.SnapshotFormatError(
+                f"Invalid snapshot: expected a survey object, found {survey!r:.20}.")
+        if survey["survey"] in survey_codes:
+            contributors = survey["contributorsBySurvey"]["nodes"]
+            ingest_metrics.add("contributors_scanned", len(contributors))
+            for contributor in contributors:
+                if not isinstance(contributor, dict):
+                    raise ingest_snapshot_parser.SnapshotFormatError(
+                        f"Invalid snapshot: expected a contributor object, "
+                        f"found {contributor!r:.20}.")
+                if contributor["period"] in periods:
+                    yield contributor
+
+
+def open_snapshot_body(snapshot_bucket, snapshot_file, snapshot_etag=None,
+                       snapshot_buffer=None, s3_resource=None):
+    """
+    Opens a snapshot passed by reference for the parser to read, decompressing it as
+    it is read if it is compressed.
+    :param snapshot_bucket: String - Bucket holding the snapshot.
+    :param snapshot_file: String - Key of the snapshot.
+    :param snapshot_etag: String - ETag the snapshot in S3 must still have.
+    :param snapshot_buffer: Bytearray - The snapshot if already downloaded.
+    :param s3_resource: Boto3 S3 resource to read it with, if not downloaded.
+    :return: Bytes-like or file-like snapshot.
+    """
+    if snapshot_buffer is not None:
+        if ingest_codec.detect(snapshot_buffer[:4]) is None:
+            return snapshot_buffer
+        return ingest_codec.open_stream(ingest_s3_download.BufferStream(snapshot_buffer))
+
+    snapshot_object = s3_resource.Object(snapshot_bucket, snapshot_file)
+    if snapshot_etag is not None:
+        # Make sure we read the same version of the snapshot the wrangler saw.
+        snapshot_response = snapshot_object.get(IfMatch=snapshot_etag)
+    else:
+        snapshot_response = snapshot_object.get()
+    return ingest_codec.open_stream(snapshot_response["Body"],
+                                    snapshot_response.get("ContentEncoding"))
+
+
+def iter_range_texts(s3_client, snapshot_bucket, snapshot_file, snapshot_ranges,
+                     survey_codes, periods, snapshot_etag=None,
+                     download_part_size=None):
+    """
+    Reads byte ranges of a snapshot passed by reference one at a time, for the
+    contributor nodes in them.
+    :param s3_client: Boto3 S3 client.
+    :param snapshot_bucket: String - Bucket holding the snapshot.
+    :param snapshot_file: String - Key of the snapshot.
+    :param snapshot_ranges: List - [start, end] byte ranges of contributor nodes, from
+        ingest_snapshot_parser.split_ranges.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param snapshot_etag: String - ETag the snapshot in S3 must still have.
+    :param download_part_size: Int - Download each range in concurrent parts of this
+        many bytes.
+    :return: Generator of contributor node texts, for
+        ingest_snapshot_parser.decode_contributors.
+    """
+    for start, end in snapshot_ranges:
+        with ingest_metrics.stage("read_snapshot"):
+            span = ingest_s3_download.download_range(
+                s3_client, snapshot_bucket, snapshot_file, start, end,
+                download_part_size, if_match=snapshot_etag)
+        yield from ingest_snapshot_parser.iter_span_texts(span, survey_codes, periods)
+
+
+def snapshot_texts(snapshot_s3_uri, survey_codes, periods, snapshot_etag=None,
+                   snapshot_size=None, download_part_size=None, snapshot_ranges=None):
+    """
+    Opens a snapshot passed by reference for the contributor nodes the transform
+    might need to be read from it, without decoding them.
+    :param snapshot_s3_uri: String - S3 URI of the snapshot.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param snapshot_etag: String - ETag the snapshot in S3 must still have.
+    :param snapshot_size: Int - Size in bytes of the snapshot in S3.
+    :param download_part_size: Int - Download the snapshot in concurrent parts of this
+        many bytes, rather than streaming it.
+    :param snapshot_ranges: List - [start, end] byte ranges of the snapshot to read
+        rather than all of it.
+    :return: Generator of contributor node texts, for
+        ingest_snapshot_parser.decode_contributors.
+    """
+    snapshot_parsed_uri = urlparse(snapshot_s3_uri)
+    snapshot_bucket = snapshot_parsed_uri.netloc
+    snapshot_file = snapshot_parsed_uri.path[1:]  # Remove the leading '/'
+    s3_resource = ingest_warm_state.get_resource(boto3.resource, "s3")
+
+    if snapshot_ranges is not None:
+        # Read only this shard's share of the snapshot, straight from S3.
+        ingest_metrics.add("snapshot_bytes",
+                           sum(end - start for start, end in snapshot_ranges),
+                           ingest_metrics.BYTES)
+        return iter_range_texts(s3_resource.meta.client, snapshot_bucket,
+                                snapshot_file, snapshot_ranges, survey_codes, periods,
+                                snapshot_etag, download_part_size)
+    if snapshot_size is not None:
+        ingest_metrics.add("snapshot_bytes", snapshot_size, ingest_metrics.BYTES)
+    snapshot_buffer = None
+    if download_part_size is not None:
+        # Download the snapshot in concurrent parts, then parse the buffer.
+        with ingest_metrics.stage("read_snapshot"):
+            snapshot_buffer = ingest_s3_download.download(
+                s3_resource.meta.client, snapshot_bucket, snapshot_file,
+                snapshot_size, download_part_size, if_match=snapshot_etag)
+    # Stream the contributors out of the snapshot rather than decoding all of it,
+    # only the parts the transform needs are ever built.
+    return ingest_snapshot_parser.iter_contributor_texts(
+        open_snapshot_body(snapshot_bucket, snapshot_file, snapshot_etag,
+                           snapshot_buffer, s3_resource),
+        survey_codes, periods)
+
+
+def snapshot_contributors(input_json, snapshot_s3_uri, survey_codes, periods,
+                          payload_compression=None, snapshot_etag=None,
+                          snapshot_size=None, download_part_size=None, shard=None,
+                          snapshot_cache_size=None, snapshot_ranges=None):
+    """
+    Opens the snapshot, passed inline or by reference to S3, for the contributors the
+    transform needs to be read from it.
+    :param input_json: Dict - Inline Take On snapshot, or None when passed by reference.
+    :param snapshot_s3_uri: String - S3 URI of the snapshot, or None when inline.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param payload_compression: String - Compression of an inline snapshot.
+    :param snapshot_etag: String - ETag the snapshot in S3 must still have.
+    :param snapshot_size: Int - Size in bytes of the snapshot in S3.
+    :param download_part_size: Int - Download the snapshot in concurrent parts of this
+        many bytes, rather than streaming it.
+    :param shard: Tuple - (index, count) of the share of contributors to keep.
+    :param snapshot_cache_size: Int - Most bytes of /tmp to keep snapshots passed by
+        reference in, None to always read them from S3.
+    :param snapshot_ranges: List - [start, end] byte ranges of the snapshot to read
+        rather than all of it.
+    :return: Generator of contributor dicts.
+    """
+    if snapshot_s3_uri is not None:
+        # Snapshot passed by reference, read it from S3 directly.
+        if snapshot_cache_size is not None and snapshot_ranges is None:
+            # Decode only the contributors wanted from a copy kept in /tmp, saving
+            # and indexing it first if this container hasn't already.
+            snapshot_parsed_uri = urlparse(snapshot_s3_uri)
+            with ingest_metrics.stage("read_snapshot"):
+                cached_snapshot = ingest_snapshot_cache.open_snapshot(
+                    ingest_warm_state.get_resource(boto3.resource, "s3").meta.client,
+                    snapshot_parsed_uri.netloc, snapshot_parsed_uri.path[1:],
+                    snapshot_cache_size, snapshot_etag)
+            if cached_snapshot is not None:
+                if snapshot_size is not None:
+                    ingest_metrics.add("snapshot_bytes", snapshot_size,
+                                       ingest_metrics.BYTES)
+                return cached_snapshot.iter_contributors(survey_codes, periods, shard)
+        return ingest_snapshot_parser.decode_contributors(
+            snapshot_texts(snapshot_s3_uri, survey_codes, periods, snapshot_etag,
+                           snapshot_size, download_part_size, snapshot_ranges),
+            survey_codes, periods, fields=CONTRIBUTOR_FIELDS, shard=shard)
+
+    if payload_compression is not None:
+        with ingest_metrics.stage("decode"):
+            input_json = ingest_codec.decode_payload_data(input_json,
+                                                          payload_compression)
+            input_json = ingest_json.loads(input_json)
+        validate_snapshot_data(input_json)
+    contributors = iter_snapshot_contributors(input_json, survey_codes, periods)
+    if shard is not None:
+        contributors = itertools.islice(contributors, shard[0], None, shard[1])
+    return contributors
+
+
+def parallel_rows(texts, plan, survey_codes, periods, workers, shard=None):
+    """
+    Decodes and flattens contributor nodes in worker processes, once the first row is
+    asked for. The snapshot is read once, here, and each worker takes an equal run of
+    the nodes found, inherited rather than sent to it, so only the flattened rows
+    are sent back.
+    :param texts: Iterable of contributor node texts, from snapshot_texts.
+    :param plan: IngestPlan - Plan to flatten contributors with.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param workers: Int - Number of worker processes.
+    :param shard: Tuple - (index, count) of the share of contributors to keep.
+    :return: Generator of results row values, in snapshot order.
+    """
+    with ingest_metrics.stage("read_snapshot"):
+        texts = list(texts)
+
+    def transform_share(index, count):
+        contributors = ingest_snapshot_parser.decode_contributors(
+            texts[len(texts) * index // count:len(texts) * (index + 1) // count],
+            survey_codes, periods, fields=CONTRIBUTOR_FIELDS)
+        return [plan.values(contributor) for contributor in contributors]
+
+    rows = itertools.chain.from_iterable(ingest_parallel.map_shards(transform_share,
+                                                                    workers))
+    if shard is not None:
+        # Which contributors are kept is only known once they are decoded.
+        rows = itertools.islice(rows, shard[0], None, shard[1])
+    yield from rows
+
+
+def build_runs(contributors, runs, statuses):
+    """
+    Flattens each contributor for every run wanting its survey and period, so one
+    scan of the snapshot serves all of them. Runs with the same parameters share the
+    flattened values.
+    :param contributors: Iterable of contributor dicts.
+    :param runs: List - Run dicts, with their period, periodicity, question_labels
+        and survey_codes.
+    :param statuses: Dict - Take On status to response type.
+    :return: List - A ColumnarBuilder per run, in the order given.
+    """
+    builders = []
+    routes = {}
+    for run in runs:
+        builder = ingest_plan.ColumnarBuilder(ingest_plan.get_plan(
+            run["question_labels"], run["survey_codes"], statuses))
+        builders.append(builder)
+        previous_period = general_functions.calculate_adjacent_periods(
+            run["period"], run["periodicity"])
+        for survey_code in run["survey_codes"]:
+            for period in {run["period"], previous_period}:
+                routes.setdefault((survey_code, period), []).append(builder)
+
+    for contributor in contributors:
+        rows = {}
+        for builder in routes.get((contributor["survey"], contributor["period"]), ()):
+            row = rows.get(builder.plan)
+            if row is None:
+                row = rows[builder.plan] = builder.plan.values(contributor)
+            builder.extend_values((row,))
+    return builders
+
+
+def build_output(output_columns, brick_questions, brick_types, brick_type_column):
+    """
+    :param output_columns: ColumnarBuilder - Flattened contributors.
+    :param brick_questions: Dict - Brick type question columns, None for surveys
+        without brick types.
+    :param brick_types: List - Brick types to expand.
+    :param brick_type_column: String - Column holding each respondent's brick type,
+        None to not expand them.
+    :return: DataFrame - Output rows.
+    """
+    output_data = output_columns.to_dataframe()
+    if brick_type_column is not None:
+        # Expand the brick types here rather than in a separate bricks step.
+        output_data = ingest_plan.expand_brick_types(
+            output_data, brick_questions, brick_types, brick_type_column)
+    return output_data
+
+
+def upload_output(chunks, bucket_name, out_file_name, output_compression,
+                  output_format, upload_part_size, cache_file_name=None):
+    """
+    Streams the output to the results bucket as a multipart upload as it is encoded,
+    keeping it in the result cache too if given a cache file.
+    :param chunks: Iterable of the encoded output's chunks, from
+        ingest_output_format.iter_chunks or iter_frame_chunks.
+    :param bucket_name: String - Results bucket.
+    :param out_file_name: String - File to write the output to.
+    :param output_compression: String - Compression of the output, or None.
+    :param output_format: String - One of ingest_output_format.FORMATS.
+    :param upload_part_size: Int - Size of each uploaded part in bytes.
+    :param cache_file_name: String - Result cache file to also write the output to.
+    """
+    s3_resource = ingest_warm_state.get_resource(boto3.resource, "s3")
+    # A failed upload is aborted before the error is raised.
+    uploads = [ingest_s3_upload.MultipartUpload(
+        s3_resource.meta.client, bucket_name, out_file_name, upload_part_size,
+        output_compression, ingest_output_format.content_type(output_format))]
+    if cache_file_name is not None:
+        uploads.append(ingest_s3_upload.MultipartUpload(
+            s3_resource.meta.client, bucket_name, cache_file_name, upload_part_size))
+    # Encoded as it is uploaded, so this includes encoding it.
+    with ingest_metrics.stage("write_output"):
+        ingest_s3_upload.upload_chunks(chunks, uploads)
+    ingest_metrics.add("output_bytes", uploads[0].size, ingest_metrics.BYTES)
+
+
+def write_output(output_data, bucket_name, out_file_name, output_compression,
+                 output_format, upload_part_size=None, cache_file_name=None):
+    """
+    Writes the output to the results bucket, and keeps it in the result cache if
+    given a cache file.
+    :param output_data: DataFrame - Output rows.
+    :param bucket_name: String - Results bucket.
+    :param out_file_name: String - File to write the output to.
+    :param output_compression: String - Compression of the output, or None.
+    :param output_format: String - One of ingest_output_format.FORMATS.
+    :param upload_part_size: Int - Upload the output as it is encoded in parts of
+        this many bytes, rather than encoding all of it first.
+    :param cache_file_name: String - Result cache file to also write the output to.
+    """
+    if upload_part_size is not None:
+        upload_output(ingest_output_format.iter_chunks(output_data, output_format),
+                      bucket_name, out_file_name, output_compression, output_format,
+                      upload_part_size, cache_file_name)
+        return
+
+    s3_resource = ingest_warm_state.get_resource(boto3.resource, "s3")
+    with ingest_metrics.stage("encode"):
+        output = ingest_output_format.encode(output_data, output_format)
+    ingest_metrics.add("output_bytes", len(output), ingest_metrics.BYTES)
+    with ingest_metrics.stage("write_output"):
+        ingest_codec.save_to_s3(s3_resource, bucket_name, out_file_name, output,
+                                output_compression,
+                                ingest_output_format.content_type(output_format))
+        if cache_file_name is not None:
+            ingest_result_cache.put_cached_output(s3_resource, bucket_name,
+                                                  cache_file_name, output)
 
 
 def lambda_handler(event, context):
@@ -44,19 +529,45 @@ def lambda_handler(event, context):
         run_id = event["RuntimeVariables"]["run_id"]
 
         # Extract runtime variables.
-        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        runtime_variables = ingest_warm_state.get_schema(
+            RuntimeSchema).load(event["RuntimeVariables"])
 
         bpm_queue_url = runtime_variables["bpm_queue_url"]
+        brick_questions = runtime_variables.get("brick_questions")
+        brick_type_column = runtime_variables.get("brick_type_column")
+        brick_types = runtime_variables.get("brick_types")
+        cache_file_name = runtime_variables.get("cache_file_name")
+        delta_file_name = runtime_variables.get("delta_file_name")
+        download_part_size = runtime_variables.get("download_part_size")
         environment = runtime_variables["environment"]
-        input_json = runtime_variables["data"]
-        period = runtime_variables["period"]
-        periodicity = runtime_variables["periodicity"]
-        previous_period = general_functions.calculate_adjacent_periods(period,
-                                                                       periodicity)
-        question_labels = runtime_variables["question_labels"]
+        input_json = runtime_variables.get("data")
+        metrics_enabled = runtime_variables["metrics"]
+        out_file_name = runtime_variables.get("out_file_name")
+        output_compression = runtime_variables.get("output_compression")
+        output_format = runtime_variables["output_format"]
+        parallel_snapshot_size = runtime_variables["parallel_snapshot_size"]
+        parallel_workers = runtime_variables.get("parallel_workers")
+        payload_compression = runtime_variables.get("payload_compression")
+        period = runtime_variables.get("period")
+        period_output_prefix = runtime_variables.get("period_output_prefix")
+        periodicity = runtime_variables.get("periodicity")
+        previous_period_max_age = runtime_variables.get("previous_period_max_age")
+        question_labels = runtime_variables.get("question_labels")
+        results_bucket_name = runtime_variables.get("results_bucket_name")
+        runs = runtime_variables.get("runs")
+        shard = None
+        if "shard_index" in runtime_variables:
+            shard = (runtime_variables["shard_index"], runtime_variables["shard_count"])
+        snapshot_cache_size = runtime_variables.get("snapshot_cache_size")
+        snapshot_etag = runtime_variables.get("snapshot_etag")
+        snapshot_last_modified = runtime_variables.get("snapshot_last_modified")
+        snapshot_ranges = runtime_variables.get("snapshot_ranges")
+        snapshot_s3_uri = runtime_variables.get("snapshot_s3_uri")
+        snapshot_size = runtime_variables.get("snapshot_size")
         statuses = runtime_variables["statuses"]
         survey = runtime_variables["survey"]
-        survey_codes = runtime_variables["survey_codes"]
+        survey_codes = runtime_variables.get("survey_codes")
+        upload_part_size = runtime_variables.get("upload_part_size")
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -64,7 +575,7 @@ def lambda_handler(event, context):
         return {"success": False, "error": error_message}
 
     try:
-        logger = general_functions.get_logger(survey, current_module, environment,
+        logger = ingest_warm_state.get_logger(survey, current_module, environment,
                                               run_id)
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
@@ -73,56 +584,199 @@ def lambda_handler(event, context):
         return {"success": False, "error": error_message}
 
     try:
+        ingest_metrics.start(metrics_enabled, current_module, run_id, survey=survey)
         logger.info("Started - retrieved wrangler configuration variables.")
-        output_json = []
-        for survey in input_json["data"]["allSurveys"]["nodes"]:
-            if survey["survey"] in survey_codes:
-                for contributor in survey["contributorsBySurvey"]["nodes"]:
-                    if contributor["period"] in (period, previous_period):
-                        out_contrib = {}
-
-                        # Basic contributor information.
-                        out_contrib["survey"] = survey_codes[contributor["survey"]]
-                        out_contrib["period"] = str(contributor["period"])
-                        out_contrib["responder_id"] = str(contributor["reference"])
-                        out_contrib["gor_code"] = contributor["region"]
-                        out_contrib["enterprise_reference"] = str(
-                            contributor["enterprisereference"])
-                        out_contrib["enterprise_name"] = contributor["enterprisename"]
-
-                        # Pre-populate default question answers.
-                        for expected_question in question_labels.keys():
-                            out_contrib[question_labels[expected_question]] = 0
-
-                        # Where contributors provided an aswer, use it instead.
-                        for question in contributor["responsesByReferenceAndPeriodAndSurvey"]["nodes"]:  # noqa: E501
-                            if question["questioncode"] in question_labels.keys() and \
-                                    question["response"].isnumeric():
-                                out_contrib[question_labels[question["questioncode"]]] \
-                                    = int(question["response"])
-
-                        # Convert the response statuses to types,
-                        # used by results to check if imputation should run
-                        # assume all unknown statuses need to be imputed
-                        # (this may change after further cross-team talks).
-                        if contributor["status"] in statuses:
-                            out_contrib["response_type"] = statuses[contributor["status"]]
-                        else:
-                            out_contrib["response_type"] = 1
-
-                        output_json.append(out_contrib)
-
-        logger.info("Successfully extracted data from take on.")
-        final_output = {"data": json.dumps(output_json)}
+
+        if snapshot_s3_uri is not None:
+            logger.info(f"Streaming Snapshot {snapshot_s3_uri} from S3.")
+
+        delta_counts = None
+        if runs is not None:
+            # Scan the snapshot once for everything any of the runs needs.
+            batch_survey_codes = {}
+            batch_periods = set()
+            for run in runs:
+                batch_survey_codes.update(run["survey_codes"])
+                batch_periods.update([run["period"],
+                                      general_functions.calculate_adjacent_periods(
+                                          run["period"], run["periodicity"])])
+            contributors = snapshot_contributors(
+                input_json, snapshot_s3_uri, batch_survey_codes, batch_periods,
+                payload_compression, snapshot_etag, snapshot_size, download_part_size,
+                snapshot_cache_size=snapshot_cache_size)
+            with ingest_metrics.stage("transform"):
+                run_columns = build_runs(contributors, runs, statuses)
+
+            final_output = {"runs": []}
+            for run, output_columns in zip(runs, run_columns):
+                ingest_metrics.add("contributors_kept", len(output_columns))
+                with ingest_metrics.stage("build_output"):
+                    output_data = build_output(output_columns, brick_questions,
+                                               brick_types, brick_type_column)
+                write_output(output_data, results_bucket_name, run["out_file_name"],
+                             output_compression, output_format, upload_part_size)
+                final_output["runs"].append({"out_file_name": run["out_file_name"],
+                                             "contributors": len(output_columns)})
+                logger.info(f"Successfully extracted {len(output_columns)} "
+                            f"contributors from take on for {run['period']}. "
+                            f"Written to S3.")
+        else:
+            plan = ingest_plan.get_plan(question_labels, survey_codes, statuses)
+            plan_key = ingest_plan.plan_key(question_labels, survey_codes, statuses)
+            previous_period = general_functions.calculate_adjacent_periods(
+                period, periodicity)
+            periods = (period, previous_period)
+            previous_period_rows = None
+            if period_output_prefix is not None:
+                # Reuse the rows the previous period's run made, unless they are
+                # missing or came from a snapshot that is too old.
+                with ingest_metrics.stage("load_previous_period"):
+                    previous_period_rows = ingest_period_output.load_rows(
+                        ingest_warm_state.get_resource(boto3.resource, "s3"),
+                        results_bucket_name,
+                        ingest_period_output.period_file_name(
+                            period_output_prefix, survey, previous_period),
+                        plan_key, snapshot_last_modified - previous_period_max_age)
+                if previous_period_rows is not None:
+                    periods = (period,)
+                    logger.info(f"Reusing {len(previous_period_rows)} rows for "
+                                f"{previous_period} from its own run.")
+                else:
+                    logger.info(f"No usable rows for {previous_period}, "
+                                f"transforming it from the snapshot.")
+
+            workers = 1
+            if parallel_workers is not None and snapshot_s3_uri is not None and \
+                    snapshot_size is not None and delta_file_name is None and \
+                    snapshot_cache_size is None:
+                # Small snapshots are quicker to transform than to start processes
+                # for. Delta ingests need every contributor in one place, and cached
+                # snapshots only have the contributors needed decoded anyway.
+                transform_size = snapshot_size
+                if snapshot_ranges is not None:
+                    transform_size = sum(end - start for start, end in snapshot_ranges)
+                workers = ingest_parallel.worker_count(
+                    parallel_workers, transform_size, parallel_snapshot_size)
+
+            delta = None
+            if workers > 1:
+                logger.info(f"Transforming the snapshot in {workers} processes.")
+                rows = parallel_rows(
+                    snapshot_texts(snapshot_s3_uri, survey_codes, periods,
+                                   snapshot_etag, snapshot_size, download_part_size,
+                                   snapshot_ranges),
+                    plan, survey_codes, periods, workers, shard)
+            else:
+                contributors = snapshot_contributors(
+                    input_json, snapshot_s3_uri, survey_codes, periods,
+                    payload_compression, snapshot_etag, snapshot_size,
+                    download_part_size, shard, snapshot_cache_size, snapshot_ranges)
+                if delta_file_name is not None:
+                    # Only flatten the contributors that changed since the previous
+                    # run.
+                    delta = ingest_delta.DeltaIngest(
+                        plan, plan_key, ingest_delta.load_state(
+                            ingest_warm_state.get_resource(boto3.resource, "s3"),
+                            results_bucket_name, delta_file_name), periods)
+                    rows = delta.values(contributors)
+                else:
+                    rows = (plan.values(contributor) for contributor in contributors)
+            if period_output_prefix is not None:
+                # Keep this period's rows for the next period's run to reuse.
+                period_rows = []
+                rows = ingest_period_output.iter_keeping_period(rows, period,
+                                                                period_rows)
+            if previous_period_rows is not None:
+                rows = ingest_period_output.merge_rows(rows, previous_period_rows,
+                                                       survey_codes)
+                ingest_metrics.add("rows_reused", len(previous_period_rows))
+            if out_file_name is not None and upload_part_size is not None:
+                # Flatten, encode and upload the rows a chunk at a time, so neither
+                # the output rows nor the encoded output are ever held whole.
+                output_rows = 0
+
+                def output_frames():
+                    nonlocal output_rows
+                    for output_columns in ingest_plan.iter_column_chunks(
+                            plan, rows,
+                            ingest_output_format.default_chunk_rows(output_format)):
+                        output_rows += len(output_columns)
+                        yield build_output(output_columns, brick_questions,
+                                           brick_types, brick_type_column)
+
+                # Streamed snapshots are read as they are transformed, and
+                # transformed as they are uploaded, so this includes both.
+                upload_output(ingest_output_format.iter_frame_chunks(output_frames(),
+                                                                     output_format),
+                              results_bucket_name, out_file_name, output_compression,
+                              output_format, upload_part_size, cache_file_name)
+                output_data = None
+            else:
+                # Flatten each contributor into typed columns.
+                output_columns = ingest_plan.ColumnarBuilder(plan)
+                # Streamed snapshots are read as they are transformed, so this
+                # includes reading them.
+                with ingest_metrics.stage("transform"):
+                    output_columns.extend_values(rows)
+                output_rows = len(output_columns)
+                with ingest_metrics.stage("build_output"):
+                    output_data = build_output(output_columns, brick_questions,
+                                               brick_types, brick_type_column)
+            ingest_metrics.add("contributors_kept",
+                               output_rows - len(previous_period_rows or ()))
+
+            with ingest_metrics.stage("save_state"):
+                if delta is not None:
+                    ingest_delta.save_state(
+                        ingest_warm_state.get_resource(boto3.resource, "s3"),
+                        results_bucket_name, delta_file_name, delta.state())
+                    delta_counts = delta.counts()
+                    logger.info(f"Delta against previous run: {delta_counts}")
+                if period_output_prefix is not None:
+                    ingest_period_output.save_rows(
+                        ingest_warm_state.get_resource(boto3.resource, "s3"),
+                        results_bucket_name,
+                        ingest_period_output.period_file_name(period_output_prefix,
+                                                              survey, period),
+                        plan_key, snapshot_last_modified, period_rows)
+
+            logger.info(f"Successfully extracted {output_rows} contributors "
+                        f"from take on.")
+            if brick_type_column is not None:
+                logger.info("Successfully expanded brick data.")
+
+            if out_file_name is not None:
+                if output_data is not None:
+                    # Write straight to the results bucket rather than returning the
+                    # data.
+                    write_output(output_data, results_bucket_name, out_file_name,
+                                 output_compression, output_format,
+                                 cache_file_name=cache_file_name)
+                logger.info("Data ready for Results pipeline. Written to S3.")
+                final_output = {"contributors": output_rows,
+                                "out_file_name": out_file_name}
+            else:
+                with ingest_metrics.stage("encode"):
+                    output = ingest_output_format.encode(output_data, output_format)
+                ingest_metrics.add("output_bytes", len(output), ingest_metrics.BYTES)
+                if payload_compression is not None:
+                    final_output = {"data": ingest_codec.encode_payload_data(
+                        output, payload_compression)}
+                else:
+                    final_output = {"data": ingest_output_format.encode_payload_data(
+                        output)}
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module, run_id,
                                                            context=context,
                                                            bpm_queue_url=bpm_queue_url)
     finally:
+        ingest_metrics.emit()
         if (len(error_message)) > 0:
             logger.error(error_message)
             return {"success": False, "error": error_message}
 
     logger.info("Successfully completed module.")
+    if delta_counts is not None:
+        final_output["delta"] = delta_counts
     final_output["success"] = True
     return final_output
@@ -1,11 +1,22 @@
-import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 import boto3
 from es_aws_functions import aws_functions, exception_classes, general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, ValidationError, fields, validates_schema
+from marshmallow.validate import Length, OneOf, Range
+
+import ingest_codec
+import ingest_json
+import ingest_metrics
+import ingest_output_format
+import ingest_result_cache
+import ingest_s3_download
+import ingest_s3_upload
+import ingest_snapshot_parser
+import ingest_warm_state
 
 
 class EnvironmentSchema(Schema):
@@ -17,8 +28,48 @@ class EnvironmentSchema(Schema):
         logging.error(f"Error validating environment params: {e}")
         raise ValueError(f"Error validating environment params: {e}")
 
+    delta_state_prefix = fields.Str(missing="ingest-delta-state/")
+    # Download snapshots in concurrent parts of this many bytes, rather than with
+    # a single GET.
+    download_part_size = fields.Int()
+    # Snapshots larger than this (in bytes) are passed to the method by reference.
+    inline_snapshot_limit = fields.Int(missing=4000000)
+    # Most method invocations to split an ingest between, each reading its own byte
+    # ranges of the snapshot.
+    max_shards = fields.Int(missing=1, validate=Range(min=1))
+    # Log one record of per stage timings and sizes for each run, in CloudWatch
+    # embedded metric format. Also turns them on in the method.
+    metrics_enabled = fields.Bool(missing=False)
     method_name = fields.Str(required=True)
+    # Compression of the output written to the results bucket, none by default.
+    output_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    # Format of the output written to the results bucket, a JSON array by default.
+    output_format = fields.Str(missing=ingest_output_format.JSON,
+                               validate=OneOf(ingest_output_format.FORMATS))
+    # Have the method read and flatten snapshots passed by reference in up to this
+    # many processes, one per parallel_snapshot_size bytes of snapshot and at most
+    # one per vCPU its memory size gives it.
+    parallel_snapshot_size = fields.Int(missing=20000000, validate=Range(min=1))
+    parallel_workers = fields.Int(validate=Range(min=1))
+    # Compression of the data in the method's invoke payload and response.
+    payload_compression = fields.Str(validate=OneOf(ingest_codec.ENCODINGS))
+    period_output_prefix = fields.Str(missing="ingest-period-output/")
+    # Seconds older than the snapshot being ingested the previous period's rows can
+    # come from and still be reused. By default only rows from the same snapshot are,
+    # as older rows miss late returns.
+    previous_period_max_age = fields.Int(missing=0, validate=Range(min=0))
     results_bucket_name = fields.Str(required=True)
+    result_cache_prefix = fields.Str(missing="ingest-result-cache/")
+    # Seconds to reuse an earlier output of the same ingest for, 0 turns caching off.
+    result_cache_ttl = fields.Int(missing=0)
+    # Snapshot bytes per method invocation when the shard count is not given.
+    shard_snapshot_size = fields.Int(missing=50000000)
+    # Have the method keep snapshots passed by reference in up to this many bytes of
+    # its /tmp, for later invocations of a warm container to reuse.
+    snapshot_cache_size = fields.Int(validate=Range(min=1))
+    # Have a method writing the output itself stream it to the results bucket in
+    # parts of this many bytes.
+    upload_part_size = fields.Int(validate=Range(min=ingest_s3_upload.MIN_PART_SIZE))
 
 
 class IngestionParamsSchema(Schema):
@@ -26,10 +77,38 @@ class IngestionParamsSchema(Schema):
     class Meta:
         unknown = EXCLUDE
 
+    brick_questions = fields.Dict()
+    brick_types = fields.List(fields.Int(required=True))
+    brick_type_column = fields.Str()
     question_labels = fields.Dict(required=True)
     survey_codes = fields.Dict(required=True)
     statuses = fields.Dict(required=True)
 
+    @validates_schema
+    def validate_brick_parameters(self, data, **kwargs):
+        # Brick type expansion needs all of its parameters or none of them.
+        brick_fields = ["brick_questions", "brick_type_column", "brick_types"]
+        if any(field in data for field in brick_fields):
+            for field in brick_fields:
+                if field not in data:
+                    raise ValidationError(
+                        "Missing data for required field.", field)
+
+
+class RunSchema(Schema):
+
+    class Meta:
+        unknown = EXCLUDE
+
+    out_file_name = fields.Str(required=True)
+    period = fields.Str(required=True)
+    periodicity = fields.Str(required=True)
+    # The batch's ingestion parameters are used where these aren't given.
+    question_labels = fields.Dict()
+    survey_codes = fields.Dict()
+    # BPM status is reported under the batch's run_id where this isn't given.
+    run_id = fields.Str()
+
 
 class RuntimeSchema(Schema):
 
@@ -41,16 +120,187 @@ class RuntimeSchema(Schema):
         raise ValueError(f"Error validating runtime params: {e}")
 
     bpm_queue_url = fields.Str(required=True)
+    delta = fields.Bool(missing=False)
     environment = fields.Str(required=True)
+    force_refresh = fields.Bool(missing=False)
     ingestion_parameters = fields.Nested(IngestionParamsSchema, required=True)
-    out_file_name = fields.Str(required=True)
-    period = fields.Str(required=True)
-    periodicity = fields.Str(required=True)
+    out_file_name = fields.Str()
+    period = fields.Str()
+    periodicity = fields.Str()
+    reuse_previous_period = fields.Bool(missing=False)
+    # Several runs ingested from one parse of the snapshot, in place of
+    # out_file_name, period and periodicity.
+    runs = fields.List(fields.Nested(RunSchema), validate=Length(min=1))
+    shard_count = fields.Int()
     snapshot_s3_uri = fields.Str(required=True)
     sns_topic_arn = fields.Str(required=True)
     survey = fields.Str(required=True)
     total_steps = fields.Int(required=True)
 
+    @validates_schema
+    def validate_runs(self, data, **kwargs):
+        if "runs" not in data:
+            for field in ["out_file_name", "period", "periodicity"]:
+                if field not in data:
+                    raise ValidationError("Missing data for required field.", field)
+            return
+        # The delta state and period outputs are kept per run, and the method
+        # writes every run's output itself rather than through shards.
+        for field in ["delta", "reuse_previous_period"]:
+            if data[field]:
+                raise ValidationError("Can't be given with runs.", field)
+        if "shard_count" in data:
+            raise ValidationError("Can't be given with runs.", "shard_count")
+
+
+def batch_runs(runs, ingestion_parameters, run_id):
+    """
+    :param runs: List - Run dicts, as given in the runtime variables.
+    :param ingestion_parameters: Dict - The batch's ingestion parameters.
+    :param run_id: String - The batch's run_id.
+    :return: List - The runs with their question_labels, survey_codes and run_id
+        filled in from the batch where not given.
+    """
+    return [dict({"question_labels": ingestion_parameters["question_labels"],
+                  "run_id": run_id,
+                  "survey_codes": ingestion_parameters["survey_codes"]}, **run)
+            for run in runs]
+
+
+@ingest_metrics.measured("invoke")
+def invoke_method(lambda_client, method_name, payload):
+    """
+    Invokes the method and checks it succeeded.
+    :param lambda_client: Boto3 Lambda client, or an in process one from
+        ingest_local, see ingest_warm_state.invoke.
+    :param method_name: String - Name of the method Lambda.
+    :param payload: Dict - Method payload.
+    :return: Dict - The method's response, with any compressed or base64 encoded
+        data decoded.
+    """
+    runtime_variables = payload["RuntimeVariables"]
+    json_response = ingest_warm_state.invoke(lambda_client, method_name, payload)
+
+    if not json_response["success"]:
+        raise exception_classes.MethodFailure(json_response["error"])
+
+    payload_compression = runtime_variables.get("payload_compression")
+    if payload_compression is not None and "data" in json_response:
+        json_response["data"] = ingest_codec.decode_payload_data(
+            json_response["data"], payload_compression)
+    elif "data" in json_response:
+        json_response["data"] = ingest_output_format.decode_payload_data(
+            json_response["data"], runtime_variables.get("output_format"))
+
+    return json_response
+
+
+def find_shard_ranges(s3_resource, snapshot_bucket, snapshot_file, snapshot_etag,
+                      snapshot_size, survey_codes, periods, shard_count):
+    """
+    Scans the snapshot for where the contributors wanted lie, without decoding them,
+    and splits them between shards, so each shard reads only its own share.
+    :param s3_resource: Boto3 S3 resource.
+    :param snapshot_bucket: String - Bucket holding the snapshot.
+    :param snapshot_file: String - Key of the snapshot.
+    :param snapshot_etag: String - ETag the snapshot in S3 must still have.
+    :param snapshot_size: Int - Size in bytes of the snapshot.
+    :param survey_codes: Dict - Take On survey codes to keep.
+    :param periods: Periods to keep.
+    :param shard_count: Int - Most shards to split the contributors between.
+    :return: List - Each shard's [start, end] byte ranges of the snapshot, leaving out
+        shards with none, or None if the snapshot is compressed, so has no byte
+        ranges to give them.
+    """
+    s3_client = s3_resource.meta.client
+    # Compressed snapshots without a Content-Encoding are only known by their start.
+    start = ingest_s3_download.download_range(s3_client, snapshot_bucket,
+                                              snapshot_file, 0, min(snapshot_size, 4),
+                                              if_match=snapshot_etag)
+    if ingest_codec.detect(bytes(start)) is not None:
+        return None
+    body = s3_client.get_object(Bucket=snapshot_bucket, Key=snapshot_file,
+                                IfMatch=snapshot_etag)["Body"]
+    ranges = ingest_snapshot_parser.find_contributor_ranges(body, survey_codes,
+                                                            periods)
+    shard_ranges = [spans for spans in ingest_snapshot_parser.split_ranges(
+        ranges, shard_count) if spans]
+    # A snapshot without any of the contributors still needs one shard to write
+    # an empty output.
+    return shard_ranges or [[]]
+
+
+def invoke_shards(lambda_client, method_name, payload, shard_ranges,
+                  out_file_name):
+    """
+    Invokes a method per shard concurrently, each one reading only its byte ranges
+    of the snapshot and writing its part of the output, uncompressed, alongside
+    out_file_name in the results bucket.
+    :param lambda_client: Boto3 Lambda client.
+    :param method_name: String - Name of the method Lambda.
+    :param payload: Dict - Method payload, without the shard's ranges.
+    :param shard_ranges: List - Each shard's byte ranges, from find_shard_ranges.
+    :param out_file_name: String - Name the output is written as.
+    :return: List - Names of the shards' parts, in shard order.
+    """
+    def invoke_shard(shard_index):
+        shard_payload = {"RuntimeVariables": dict(
+            payload["RuntimeVariables"],
+            out_file_name=shard_file_name(out_file_name, shard_index),
+            snapshot_ranges=shard_ranges[shard_index])}
+        json_response = invoke_method(lambda_client, method_name, shard_payload)
+        return json_response["out_file_name"]
+
+    with ThreadPoolExecutor(max_workers=len(shard_ranges)) as executor:
+        return list(executor.map(invoke_shard, range(len(shard_ranges))))
+
+
+def shard_file_name(out_file_name, shard_index):
+    """
+    :param out_file_name: String - Name the output is written as.
+    :param shard_index: Int - Number of the shard.
+    :return: String - Name of the shard's part of the output.
+    """
+    return f"{out_file_name}.shard-{shard_index}"
+
+
+def merge_shard_outputs(s3_resource, bucket_name, shard_file_names, output_format):
+    """
+    Reads the shards' parts of the output and joins them in shard order, which is
+    snapshot order as each shard takes the contributors after the previous one's.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Results bucket.
+    :param shard_file_names: List - Names of the shards' parts, in shard order.
+    :param output_format: String - json, ndjson or parquet.
+    :return: Bytes - Encoded output.
+    """
+    outputs = [s3_resource.Object(bucket_name, name).get()["Body"].read()
+               for name in shard_file_names]
+    return ingest_output_format.concatenate(outputs, output_format)
+
+
+@ingest_metrics.measured("write_output")
+def save_output(s3_resource, bucket_name, out_file_name, output, output_compression,
+                output_format, cache_file_name=None):
+    """
+    Writes the output to the results bucket, and keeps it in the result cache.
+    :param s3_resource: Boto3 S3 resource.
+    :param bucket_name: String - Results bucket.
+    :param out_file_name: String - Name to write the output as.
+    :param output: String or Bytes - Encoded output.
+    :param output_compression: String - gzip or zstd, None writes it uncompressed.
+    :param output_format: String - json, ndjson or parquet.
+    :param cache_file_name: String - Name of the result cache entry, None if the
+        output isn't cached.
+    """
+    ingest_metrics.add("output_bytes", len(output), ingest_metrics.BYTES)
+    ingest_codec.save_to_s3(s3_resource, bucket_name, out_file_name, output,
+                            output_compression,
+                            ingest_output_format.content_type(output_format))
+    if cache_file_name is not None:
+        ingest_result_cache.put_cached_output(s3_resource, bucket_name,
+                                              cache_file_name, output)
+
 
 def lambda_handler(event, context):
     """
@@ -71,24 +321,62 @@ def lambda_handler(event, context):
         run_id = event["RuntimeVariables"]["run_id"]
 
         # Load variables.
-        environment_variables = EnvironmentSchema().load(os.environ)
-        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        environment_variables = ingest_warm_state.get_schema(
+            EnvironmentSchema).load(os.environ)
+        runtime_variables = ingest_warm_state.get_schema(
+            RuntimeSchema).load(event["RuntimeVariables"])
 
         # Environment Variables.
+        delta_state_prefix = environment_variables["delta_state_prefix"]
+        download_part_size = environment_variables.get("download_part_size")
+        inline_snapshot_limit = environment_variables["inline_snapshot_limit"]
+        max_shards = environment_variables["max_shards"]
+        metrics_enabled = environment_variables["metrics_enabled"]
         method_name = environment_variables["method_name"]
+        output_compression = environment_variables.get("output_compression")
+        output_format = environment_variables["output_format"]
+        parallel_snapshot_size = environment_variables["parallel_snapshot_size"]
+        parallel_workers = environment_variables.get("parallel_workers")
+        payload_compression = environment_variables.get("payload_compression")
+        period_output_prefix = environment_variables["period_output_prefix"]
+        previous_period_max_age = environment_variables["previous_period_max_age"]
         results_bucket_name = environment_variables["results_bucket_name"]
+        result_cache_prefix = environment_variables["result_cache_prefix"]
+        result_cache_ttl = environment_variables["result_cache_ttl"]
+        shard_snapshot_size = environment_variables["shard_snapshot_size"]
+        snapshot_cache_size = environment_variables.get("snapshot_cache_size")
+        upload_part_size = environment_variables.get("upload_part_size")
 
         # Runtime Variables.
         bpm_queue_url = runtime_variables["bpm_queue_url"]
+        delta = runtime_variables["delta"]
         environment = runtime_variables["environment"]
+        force_refresh = runtime_variables["force_refresh"]
         ingestion_parameters = runtime_variables["ingestion_parameters"]
-        out_file_name = runtime_variables["out_file_name"]
-        period = runtime_variables["period"]
-        periodicity = runtime_variables["periodicity"]
+        out_file_name = runtime_variables.get("out_file_name")
+        if out_file_name is not None:
+            # Outputs other than uncompressed JSON get the extension to match.
+            out_file_name = ingest_output_format.file_name(
+                out_file_name, output_format, output_compression)
+        period = runtime_variables.get("period")
+        periodicity = runtime_variables.get("periodicity")
+        reuse_previous_period = runtime_variables["reuse_previous_period"]
+        runs = runtime_variables.get("runs")
+        if runs is not None:
+            runs = batch_runs(runs, ingestion_parameters, run_id)
+            for run in runs:
+                run["out_file_name"] = ingest_output_format.file_name(
+                    run["out_file_name"], output_format, output_compression)
+        shard_count = runtime_variables.get("shard_count")
         snapshot_s3_uri = runtime_variables["snapshot_s3_uri"]
         sns_topic_arn = runtime_variables["sns_topic_arn"]
         survey = runtime_variables["survey"]
         total_steps = runtime_variables["total_steps"]
+
+        # BPM status is reported for each run of a batch, under its own run_id.
+        run_ids = [run_id]
+        if runs is not None:
+            run_ids = list(dict.fromkeys(run["run_id"] for run in runs))
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module, run_id,
                                                            context=context,
@@ -96,7 +384,7 @@ def lambda_handler(event, context):
         raise exception_classes.LambdaFailure(error_message)
 
     try:
-        logger = general_functions.get_logger(survey, current_module, environment,
+        logger = ingest_warm_state.get_logger(survey, current_module, environment,
                                               run_id)
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module, run_id,
@@ -105,15 +393,14 @@ def lambda_handler(event, context):
         raise exception_classes.LambdaFailure(error_message)
 
     try:
+        ingest_metrics.start(metrics_enabled, current_module, run_id, survey=survey)
         logger.info("Started - retrieved configuration variables.")
         # Send in progress status to BPM.
         current_step_num = 1
         status = "IN PROGRESS"
-        aws_functions.send_bpm_status(bpm_queue_url, current_module, status, run_id,
-                                      current_step_num, total_steps)
-
-        # Set up client.
-        lambda_client = boto3.client("lambda", region_name="eu-west-2")
+        for status_run_id in run_ids:
+            aws_functions.send_bpm_status(bpm_queue_url, current_module, status,
+                                          status_run_id, current_step_num, total_steps)
 
         # Wrangle the S3 URI into bucket + name.
         snapshot_parsed_uri = urlparse(snapshot_s3_uri)
@@ -121,51 +408,240 @@ def lambda_handler(event, context):
         snapshot_file = snapshot_parsed_uri.path
         snapshot_file = snapshot_file[1:]  # Remove the leading '/'
 
-        # Get the file from S3
-        input_file = aws_functions.read_from_s3(snapshot_bucket,
-                                                snapshot_file,
-                                                file_extension="")
-
-        logger.info(f"Read Snapshot {snapshot_file} from S3 bucket {snapshot_bucket}")
+        # Look up the snapshot size to decide how it is passed to the method.
+        s3_resource = ingest_warm_state.get_resource(boto3.resource, "s3")
+        snapshot_object = s3_resource.Object(snapshot_bucket, snapshot_file)
+        snapshot_size = snapshot_object.content_length
+        snapshot_etag = snapshot_object.e_tag
+        ingest_metrics.add("snapshot_bytes", snapshot_size, ingest_metrics.BYTES)
+        # Compressed snapshots are streamed by the method, so they are decompressed
+        # a chunk at a time rather than all at once.
+        pass_by_reference = snapshot_size > inline_snapshot_limit or \
+            snapshot_object.content_encoding in ingest_codec.ENCODINGS
+
+        # Look for the output of an earlier ingest of the same snapshot content
+        # with the same parameters.
+        cache_file_name = None
+        cached_output = None
+        if result_cache_ttl > 0 and runs is None:
+            cache_file_name = ingest_result_cache.cache_file_name(
+                result_cache_prefix, ingest_result_cache.cache_key(
+                    snapshot_etag, period, periodicity, survey, ingestion_parameters,
+                    output_format), output_format)
+            if not force_refresh:
+                with ingest_metrics.stage("cache_lookup"):
+                    cached_output = ingest_result_cache.get_cached_output(
+                        s3_resource, results_bucket_name, cache_file_name,
+                        result_cache_ttl)
+
+        if delta or reuse_previous_period or runs is not None:
+            # The delta state and period outputs cover every contributor, so they
+            # can't be made by shards. A batch's single pass covers all of its runs.
+            shard_count = 1
+        elif snapshot_object.content_encoding in ingest_codec.ENCODINGS:
+            # Shards read byte ranges of the snapshot, which compressed ones don't
+            # have.
+            shard_count = 1
+        elif shard_count is None:
+            # Ceiling division, so every shard gets at most shard_snapshot_size.
+            shard_count = min(max_shards, -(-snapshot_size // shard_snapshot_size))
+
+        # Set up client, reused by later invocations of a warm container.
+        lambda_client = ingest_warm_state.get_client(
+            boto3.client, "lambda", max_pool_connections=max(10, shard_count))
 
         payload = {
 
             "RuntimeVariables": {
                 "bpm_queue_url": bpm_queue_url,
-                "data": json.loads(input_file),
                 "environment": environment,
-                "period": period,
-                "periodicity": periodicity,
-                "question_labels": ingestion_parameters["question_labels"],
                 "run_id": run_id,
                 "statuses": ingestion_parameters["statuses"],
-                "survey": survey,
-                "survey_codes": ingestion_parameters["survey_codes"]
+                "survey": survey
             },
         }
 
-        method_return = lambda_client.invoke(
-            FunctionName=method_name, Payload=json.dumps(payload)
-        )
-        logger.info("Successfully invoked method.")
-
-        json_response = json.loads(method_return.get("Payload").read().decode("utf-8"))
-        logger.info("JSON extracted from method response.")
-
-        if not json_response["success"]:
-            raise exception_classes.MethodFailure(json_response["error"])
-
-        aws_functions.save_to_s3(results_bucket_name, out_file_name,
-                                 json_response["data"])
+        if runs is None:
+            payload["RuntimeVariables"].update({
+                "period": period,
+                "periodicity": periodicity,
+                "question_labels": ingestion_parameters["question_labels"],
+                "survey_codes": ingestion_parameters["survey_codes"]
+            })
+
+        if "brick_type_column" in ingestion_parameters:
+            # Have the method expand the brick types in the same pass.
+            for brick_parameter in ["brick_questions", "brick_type_column",
+                                    "brick_types"]:
+                payload["RuntimeVariables"][brick_parameter] = \
+                    ingestion_parameters[brick_parameter]
+
+        if delta:
+            # The method keeps the previous run's contributors in the results bucket.
+            payload["RuntimeVariables"].update({
+                "delta_file_name": f"{delta_state_prefix}{survey}-{period}.json",
+                "results_bucket_name": results_bucket_name
+            })
+
+        if reuse_previous_period:
+            # The method keeps each period's rows for the next period's run.
+            payload["RuntimeVariables"].update({
+                "period_output_prefix": period_output_prefix,
+                "previous_period_max_age": previous_period_max_age,
+                "results_bucket_name": results_bucket_name,
+                "snapshot_last_modified": int(
+                    snapshot_object.last_modified.timestamp())
+            })
+
+        if payload_compression is not None:
+            payload["RuntimeVariables"]["payload_compression"] = payload_compression
+        if download_part_size is not None:
+            payload["RuntimeVariables"]["download_part_size"] = download_part_size
+        if snapshot_cache_size is not None:
+            payload["RuntimeVariables"]["snapshot_cache_size"] = snapshot_cache_size
+        if parallel_workers is not None:
+            payload["RuntimeVariables"].update({
+                "parallel_snapshot_size": parallel_snapshot_size,
+                "parallel_workers": parallel_workers
+            })
+        if metrics_enabled:
+            payload["RuntimeVariables"]["metrics"] = True
+
+        if shard_count > 1 and cached_output is None:
+            with ingest_metrics.stage("read_snapshot"):
+                shard_ranges = find_shard_ranges(
+                    s3_resource, snapshot_bucket, snapshot_file, snapshot_etag,
+                    snapshot_size, ingestion_parameters["survey_codes"],
+                    (period, general_functions.calculate_adjacent_periods(
+                        period, periodicity)), shard_count)
+            if shard_ranges is None:
+                shard_count = 1
+            else:
+                shard_count = len(shard_ranges)
+
+        if cached_output is not None:
+            logger.info(f"Reusing cached output {cache_file_name}.")
+            save_output(s3_resource, results_bucket_name, out_file_name, cached_output,
+                        output_compression, output_format)
+        elif shard_count > 1:
+            # Each shard reads its own byte ranges of the snapshot and writes its
+            # part of the output to the results bucket.
+            payload["RuntimeVariables"].update({
+                "results_bucket_name": results_bucket_name,
+                "snapshot_etag": snapshot_etag,
+                "snapshot_s3_uri": snapshot_s3_uri,
+                "snapshot_size": snapshot_size
+            })
+            if output_format != ingest_output_format.JSON:
+                payload["RuntimeVariables"]["output_format"] = output_format
+            if upload_part_size is not None:
+                payload["RuntimeVariables"]["upload_part_size"] = upload_part_size
+            logger.info(f"Passing Snapshot {snapshot_file} ({snapshot_size} bytes) "
+                        f"to {shard_count} method shards by byte range.")
+
+            shard_file_names = [shard_file_name(out_file_name, shard_index)
+                                for shard_index in range(shard_count)]
+            try:
+                shard_file_names = invoke_shards(lambda_client, method_name, payload,
+                                                 shard_ranges, out_file_name)
+                logger.info("Successfully invoked method shards.")
+                with ingest_metrics.stage("encode"):
+                    output = merge_shard_outputs(s3_resource, results_bucket_name,
+                                                 shard_file_names, output_format)
+            finally:
+                # Including the parts of shards that succeeded when others failed.
+                s3_resource.meta.client.delete_objects(
+                    Bucket=results_bucket_name,
+                    Delete={"Objects": [{"Key": name} for name in shard_file_names],
+                            "Quiet": True})
+            save_output(s3_resource, results_bucket_name, out_file_name, output,
+                        output_compression, output_format, cache_file_name)
+        elif pass_by_reference or runs is not None:
+            # The method reads the snapshot and writes its output itself, so
+            # neither has to travel through the invoke payload.
+            payload["RuntimeVariables"].update({
+                "results_bucket_name": results_bucket_name,
+                "snapshot_etag": snapshot_etag,
+                "snapshot_s3_uri": snapshot_s3_uri,
+                "snapshot_size": snapshot_size
+            })
+            if runs is not None:
+                # The method parses the snapshot once and writes an output for
+                # each run.
+                payload["RuntimeVariables"]["runs"] = [
+                    {field: run[field] for field in ["out_file_name", "period",
+                                                     "periodicity", "question_labels",
+                                                     "survey_codes"]}
+                    for run in runs]
+            else:
+                payload["RuntimeVariables"]["out_file_name"] = out_file_name
+            if output_compression is not None:
+                payload["RuntimeVariables"]["output_compression"] = output_compression
+            if output_format != ingest_output_format.JSON:
+                payload["RuntimeVariables"]["output_format"] = output_format
+            if upload_part_size is not None:
+                payload["RuntimeVariables"]["upload_part_size"] = upload_part_size
+            if cache_file_name is not None:
+                # The output never reaches the wrangler, so the method caches it.
+                payload["RuntimeVariables"]["cache_file_name"] = cache_file_name
+            logger.info(f"Passing Snapshot {snapshot_file} ({snapshot_size} bytes) "
+                        f"to method by reference.")
+
+            json_response = invoke_method(lambda_client, method_name, payload)
+            logger.info("Successfully invoked method.")
+            for run_output in json_response.get("runs", []):
+                logger.info(f"Wrote {run_output['contributors']} contributors to "
+                            f"{run_output['out_file_name']}.")
+        else:
+            # Get the file from S3
+            with ingest_metrics.stage("read_snapshot"):
+                if download_part_size is not None:
+                    # Download in concurrent parts, straight into a single buffer.
+                    input_file = ingest_codec.decompress(ingest_s3_download.download(
+                        s3_resource.meta.client, snapshot_bucket, snapshot_file,
+                        snapshot_size, download_part_size, if_match=snapshot_etag))
+                elif payload_compression is not None:
+                    input_file = ingest_codec.read_from_s3(
+                        s3_resource, snapshot_bucket, snapshot_file)
+                else:
+                    input_file = aws_functions.read_from_s3(snapshot_bucket,
+                                                            snapshot_file,
+                                                            file_extension="")
+
+            with ingest_metrics.stage("prepare_payload"):
+                if payload_compression is not None:
+                    # Pass the snapshot on compressed, without decoding it.
+                    payload["RuntimeVariables"]["data"] = \
+                        ingest_codec.encode_payload_data(input_file,
+                                                         payload_compression)
+                else:
+                    payload["RuntimeVariables"]["data"] = ingest_json.loads(input_file)
+            if output_format != ingest_output_format.JSON:
+                payload["RuntimeVariables"]["output_format"] = output_format
+
+            logger.info(f"Read Snapshot {snapshot_file} from S3 bucket "
+                        f"{snapshot_bucket}")
+
+            json_response = invoke_method(lambda_client, method_name, payload)
+            logger.info("Successfully invoked method.")
+
+            save_output(s3_resource, results_bucket_name, out_file_name,
+                        json_response["data"], output_compression, output_format,
+                        cache_file_name)
+
+        if delta and cached_output is None:
+            logger.info(f"Delta against previous run: {json_response['delta']}")
 
         logger.info("Data ready for Results pipeline. Written to S3.")
 
         aws_functions.send_sns_message(sns_topic_arn, "Ingest.")
     except Exception as e:
-        error_message = general_functions.handle_exception(e, current_module, run_id,
-                                                           context=context,
-                                                           bpm_queue_url=bpm_queue_url)
+        for status_run_id in run_ids:
+            error_message = general_functions.handle_exception(
+                e, current_module, status_run_id, context=context,
+                bpm_queue_url=bpm_queue_url)
     finally:
+        ingest_metrics.emit()
         if (len(error_message)) > 0:
             logger.error(error_message)
             raise exception_classes.LambdaFailure(error_message)
@@ -174,7 +650,8 @@ def lambda_handler(event, context):
 
     # Send end status to BPM.
     status = "DONE"
-    aws_functions.send_bpm_status(bpm_queue_url, current_module, status, run_id,
-                                  current_step_num, total_steps)
+    for status_run_id in run_ids:
+        aws_functions.send_bpm_status(bpm_queue_url, current_module, status,
+                                      status_run_id, current_step_num, total_steps)
 
     return {"success": True}
@@ -0,0 +1,145 @@
+import io
+from collections import OrderedDict
+
+from botocore.config import Config
+from es_aws_functions import general_functions
+
+import ingest_json
+import ingest_metrics
+
+_LOGGER_CACHE_SIZE = 16
+
+_clients = {}
+# Clients used instead of boto3's, by service name, see set_client.
+_client_overrides = {}
+_loggers = OrderedDict()
+_resources = {}
+_schemas = {}
+
+
+class InProcessLambdaClient:
+    """
+    Lambda client running the methods in this process, e.g. for ingest_local. It is
+    invoked like boto3's, with the JSON encoded payload, and answers with the JSON
+    encoded response, so the wranglers can't tell it apart from Lambda.
+    """
+
+    def __init__(self, handlers):
+        """
+        :param handlers: Dict - Method name to lambda_handler.
+        """
+        self.handlers = handlers
+
+    def invoke(self, FunctionName, Payload):
+        """
+        :param FunctionName: String - Name of the method.
+        :param Payload: Bytes - JSON encoded method payload.
+        :return: Dict - The method's JSON encoded response as a stream, under
+            "Payload".
+        """
+        response = self.handlers[FunctionName](ingest_json.loads(Payload), None)
+        return {"Payload": io.BytesIO(ingest_json.dumps(response))}
+
+
+def invoke(client, function_name, payload):
+    """
+    Invokes a method Lambda, or its handler through an InProcessLambdaClient, and
+    decodes its response.
+    :param client: Boto3 Lambda client, or the one set by set_client.
+    :param function_name: String - Name of the method.
+    :param payload: Dict, or Bytes already JSON encoded - Method payload.
+    :return: Dict - The method's response.
+    """
+    if isinstance(payload, dict):
+        payload = ingest_json.dumps(payload)
+    ingest_metrics.add("payload_bytes", len(payload), ingest_metrics.BYTES)
+    method_return = client.invoke(FunctionName=function_name, Payload=payload)
+    return ingest_json.loads(method_return.get("Payload").read().decode("utf-8"))
+
+
+def get_client(client_factory, service_name, max_pool_connections=10):
+    """
+    Returns a boto3 client, reusing the one made by an earlier invocation of a warm
+    container (and so its open connections) where possible.
+    :param client_factory: Function - The handler's boto3.client, passed in so it can
+        be mocked per handler.
+    :param service_name: String - AWS service, e.g. "lambda".
+    :param max_pool_connections: Int - Connections to keep open, at least one per
+        thread that will use the client at once.
+    :return: Boto3 client, or the client set for the service by set_client.
+    """
+    if service_name in _client_overrides:
+        return _client_overrides[service_name]
+    key = (client_factory, service_name, max_pool_connections)
+    if key not in _clients:
+        _clients[key] = client_factory(
+            service_name, region_name="eu-west-2",
+            config=Config(max_pool_connections=max_pool_connections))
+    return _clients[key]
+
+
+def set_client(service_name, client):
+    """
+    Has get_client return the given client for a service rather than a boto3 one,
+    e.g. ingest_local's client running the methods in process.
+    :param service_name: String - AWS service, e.g. "lambda".
+    :param client: Client to use, None to go back to boto3's.
+    """
+    if client is None:
+        _client_overrides.pop(service_name, None)
+    else:
+        _client_overrides[service_name] = client
+
+
+def get_resource(resource_factory, service_name):
+    """
+    Returns a boto3 resource, reusing the one made by an earlier invocation of a warm
+    container where possible. Resources must only be used from the handler's thread.
+    :param resource_factory: Function - The handler's boto3.resource.
+    :param service_name: String - AWS service, e.g. "s3".
+    :return: Boto3 resource.
+    """
+    key = (resource_factory, service_name)
+    if key not in _resources:
+        _resources[key] = resource_factory(service_name, region_name="eu-west-2")
+    return _resources[key]
+
+
+def get_schema(schema_class):
+    """
+    :param schema_class: Marshmallow Schema class.
+    :return: Schema - Instance of the class, shared between invocations.
+    """
+    if schema_class not in _schemas:
+        _schemas[schema_class] = schema_class()
+    return _schemas[schema_class]
+
+
+def get_logger(survey, current_module, environment, run_id):
+    """
+    Returns the logger for a run, reusing it across invocations of a warm container.
+    :return: Logger
+    """
+    key = (survey, current_module, environment, run_id)
+    logger = _loggers.get(key)
+    if logger is None:
+        logger = general_functions.get_logger(survey, current_module, environment,
+                                              run_id)
+        _loggers[key] = logger
+        if len(_loggers) > _LOGGER_CACHE_SIZE:
+            _loggers.popitem(last=False)
+    else:
+        _loggers.move_to_end(key)
+    return logger
+
+
+def reset():
+    """
+    Forgets everything kept between invocations, e.g. so tests get clients made
+    inside their own mocks.
+    """
+    _client_overrides.clear()
+    _clients.clear()
+    _loggers.clear()
+    _resources.clear()
+    _schemas.clear()
@@ -0,0 +1,45 @@
+import pytest
+
+import ingest_snapshot_parser
+
+question_labels = {
+    "0601": "Q601_asphalting_sand",
+    "0602": "Q602_building_soft_sand",
+    "0603": "Q603_concreting_sand",
+    "0604": "Q604_bituminous_gravel",
+    "0605": "Q605_concreting_gravel",
+    "0606": "Q606_other_gravel",
+    "0607": "Q607_constructional_fill",
+    "0608": "Q608_total"
+}
+
+survey_codes = {
+    "0066": "066",
+    "0076": "076"
+}
+
+statuses = {
+    "Form Sent Out": 1,
+    "Clear": 2,
+    "Overridden": 2
+}
+
+ingestion_parameters = {
+    "question_labels": question_labels,
+    "survey_codes": survey_codes,
+    "statuses": statuses
+}
+
+# The period ingested and the one before it.
+periods = ("201809", "201806")
+
+
+@pytest.fixture
+def contributors():
+    """
+    The test snapshot's contributors in the surveys and periods ingested.
+    """
+    with open("tests/fixtures/test_ingest_input.json", "r") as file:
+        snapshot = file.read()
+    return list(ingest_snapshot_parser.iter_contributors(snapshot, survey_codes,
+                                                         periods))
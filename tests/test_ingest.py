@@ -1,4 +1,9 @@
+import base64
+import copy
+import gzip
+import io
 import json
+import os
 from unittest import mock
 
 import pandas as pd
@@ -9,8 +14,13 @@ from pandas.testing import assert_frame_equal
 
 import ingest_brick_type_method as lambda_method_function_bricks
 import ingest_brick_type_wrangler as lambda_wrangler_function_bricks
+import ingest_output_format
+import ingest_plan
+import ingest_s3_upload
+import ingest_snapshot_parser
 import ingest_takeon_data_method as lambda_method_function_data
 import ingest_takeon_data_wrangler as lambda_wrangler_function_data
+import ingest_warm_state
 
 wrangler_environment_variables = {
                 "results_bucket_name": "test_bucket",
@@ -146,7 +156,7 @@ wrangler_runtime_variables_bricks = {"RuntimeVariables": {
 method_runtime_variables_data = {
     "RuntimeVariables": {
         "bpm_queue_url": "fake_queue_url",
-        "data": {},
+        "data": {"data": {"allSurveys": {"nodes": []}}},
         "environment": "sandbox",
         "period": "201809",
         "periodicity": "03",
@@ -260,6 +270,17 @@ method_runtime_variables_bricks = {
         }
     }
 }
+
+
+@pytest.fixture(autouse=True)
+def reset_warm_state():
+    """
+    Makes sure each test's clients and loggers are made inside its own mocks, rather
+    than being reused from an earlier test.
+    """
+    ingest_warm_state.reset()
+
+
 ##########################################################################################
 #                                     Generic                                            #
 ##########################################################################################
@@ -440,35 +461,35 @@ def test_method_success(which_lambda, input_file, prepared_file, which_runtime_v
 @mock.patch('ingest_takeon_data_wrangler.aws_functions.read_from_s3')
 @pytest.mark.parametrize(
     "which_lambda,input_file,wrangler_file,runtime_file," +
-    "which_runtime_variables_wrangler,which_runtime_variables_method," +
-    "which_environment_variables,which_file_list,wrangler_boto3",
+    "which_runtime_variables_wrangler,which_environment_variables,which_file_list," +
+    "wrangler_boto3",
     [
         (lambda_wrangler_function_data, "tests/fixtures/test_ingest_input.json",
          "tests/fixtures/test_wrangler_to_method_input.json",
          "tests/fixtures/test_wrangler_to_method_runtime.json",
-         wrangler_runtime_variables_data, method_runtime_variables_data,
-         wrangler_environment_variables, ["test_ingest_input.json"],
+         wrangler_runtime_variables_data, wrangler_environment_variables,
+         ["test_ingest_input.json"],
          "ingest_takeon_data_wrangler.boto3.client"),
         (lambda_wrangler_function_bricks, "tests/fixtures/test_bricks_method_input.json",
          "tests/fixtures/test_bricks_wrangler_to_method_input.json",
          "tests/fixtures/test_bricks_wrangler_to_method_runtime.json",
-         wrangler_runtime_variables_bricks, method_runtime_variables_bricks,
-         wrangler_environment_variables, ["test_bricks_method_input.json"],
+         wrangler_runtime_variables_bricks, wrangler_environment_variables,
+         ["test_bricks_method_input.json"],
          "ingest_brick_type_wrangler.boto3.client")
     ]
 )
 def test_wrangler_success_passed(mock_s3_get, which_lambda, input_file, wrangler_file,
                                  runtime_file, which_runtime_variables_wrangler,
-                                 which_runtime_variables_method,
                                  which_environment_variables, which_file_list,
                                  wrangler_boto3):
     """
-    Runs the wrangler function.
+    Runs the wrangler function, checking the payload it invokes the method with.
     :param mock_s3_get - Replacement Function For The Data Retrieval AWS Functionality.
     :return Test Pass/Fail
     """
     with open(input_file, "r") as file:
-        wrangler_input = json.dumps(file.read())
+        wrangler_input = file.read()
+    # read_from_s3 returns the decoded contents of the file.
     mock_s3_get.return_value = wrangler_input
     bucket_name = which_environment_variables["bucket_name"]
     client = test_generic_library.create_bucket(bucket_name)
@@ -477,42 +498,44 @@ def test_wrangler_success_passed(mock_s3_get, which_lambda, input_file, wrangler
 
     test_generic_library.upload_files(client, bucket_name, file_list)
 
+    payloads = []
+
+    def replacement_invoke(FunctionName, Payload):
+        # Keeps the payload, then fails the method so the wrangler stops there.
+        payloads.append(json.loads(Payload))
+        raise exception_classes.MethodFailure("Replacement invoke.")
+
     with mock.patch.dict(which_lambda.os.environ,
                          which_environment_variables):
         with mock.patch(wrangler_boto3) as mock_client:
             mock_client_object = mock.Mock()
             mock_client.return_value = mock_client_object
-
-            # Rather than mock the get/decode we tell the code that when the invoke is
-            # called pass the variables to this replacement function instead.
-            mock_client_object.invoke.side_effect =\
-                test_generic_library.replacement_invoke
+            mock_client_object.invoke.side_effect = replacement_invoke
 
             # This stops the Error caused by the replacement function from stopping
             # the test.
-            with pytest.raises(exception_classes.LambdaFailure):
+            with pytest.raises(exception_classes.LambdaFailure) as exc_info:
                 which_lambda.lambda_handler(
                     which_runtime_variables_wrangler, test_generic_library.context_object
                 )
 
-    with open(input_file, "r") as file_2:
-        test_data_prepared = file_2.read()
-    prepared_data = pd.DataFrame(json.loads(test_data_prepared))
-
-    with open(wrangler_file, "r") as file_3:
-        test_data_produced = file_3.read()
-    produced_data = pd.DataFrame(json.loads(test_data_produced))
+    assert "Replacement invoke." in exc_info.value.error_message
+    assert len(payloads) == 1
+    produced_variables = payloads[0]["RuntimeVariables"]
 
     # Compares the data.
-    assert_frame_equal(produced_data, prepared_data)
+    assert produced_variables["data"] == json.loads(wrangler_input)
 
-    with open(runtime_file, "r") as file_4:
-        test_dict_prepared = file_4.read()
-    produced_dict = json.loads(test_dict_prepared)
+    with open(wrangler_file, "r") as file_2:
+        prepared_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(pd.DataFrame(produced_variables["data"]), prepared_data)
+
+    with open(runtime_file, "r") as file_3:
+        prepared_dict = json.loads(file_3.read())
 
     # Ensures data is not in the RuntimeVariables and then compares.
-    which_runtime_variables_method["RuntimeVariables"]["data"] = None
-    assert produced_dict == which_runtime_variables_method["RuntimeVariables"]
+    produced_variables["data"] = None
+    assert produced_variables == prepared_dict
 
 
 @mock_s3
@@ -581,3 +604,1180 @@ def test_wrangler_success_returned(mock_s3_put, which_lambda,
 
     assert output
     assert_frame_equal(produced_data, prepared_data)
+
+
+@mock_s3
+def test_method_success_by_reference():
+    """
+    Runs the method function with the snapshot passed by S3 reference.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].pop("data")
+    runtime_variables["RuntimeVariables"].update({
+        "out_file_name": "test_method_by_reference_output",
+        "results_bucket_name": bucket_name,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json"
+    })
+
+    output = lambda_method_function_data.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    # Find the output whatever file extension save_to_s3 has given it.
+    produced_key = client.list_objects_v2(
+        Bucket=bucket_name,
+        Prefix="test_method_by_reference_output")["Contents"][0]["Key"]
+    produced_file = client.get_object(Bucket=bucket_name, Key=produced_key)
+    produced_data = pd.DataFrame(json.loads(produced_file["Body"].read()))
+
+    assert output["success"]
+    assert "data" not in output
+    assert_frame_equal(produced_data, prepared_data)
+
+
+@mock_s3
+@pytest.mark.parametrize("download_part_size", [None, 1000])
+def test_method_success_parallel(download_part_size):
+    """
+    Runs the method function with the snapshot flattened in two processes, streamed
+    or downloaded once, checking the rows keep snapshot order.
+    :param download_part_size: Int - Size of download parts, None streams it.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].pop("data")
+    runtime_variables["RuntimeVariables"].update({
+        "parallel_snapshot_size": 1,
+        "parallel_workers": 2,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json",
+        "snapshot_size": os.path.getsize("tests/fixtures/test_ingest_input.json")
+    })
+    if download_part_size is not None:
+        runtime_variables["RuntimeVariables"]["download_part_size"] = \
+            download_part_size
+
+    with mock.patch("ingest_parallel.cpu_count", return_value=2), \
+            mock.patch("ingest_parallel.map_shards",
+                       wraps=lambda_method_function_data.ingest_parallel.map_shards
+                       ) as mock_map_shards:
+        output = lambda_method_function_data.lambda_handler(
+            runtime_variables, test_generic_library.context_object)
+
+    produced_data = pd.DataFrame(json.loads(output["data"]))
+
+    assert output["success"]
+    assert mock_map_shards.call_args[0][1] == 2
+    assert_frame_equal(produced_data, prepared_data)
+
+
+def test_parallel_rows():
+    """
+    Checks the snapshot's contributor nodes are read once, by the parent, and each
+    worker flattens a run of them, the runs joining up in snapshot order with or
+    without a shard.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_1:
+        snapshot = file_1.read()
+    runtime_variables = method_runtime_variables_data["RuntimeVariables"]
+    survey_codes = runtime_variables["survey_codes"]
+    periods = ("201809", "201806")
+    plan = ingest_plan.IngestPlan(runtime_variables["question_labels"], survey_codes,
+                                  runtime_variables["statuses"])
+    expected_rows = [plan.values(contributor) for contributor in
+                     ingest_snapshot_parser.iter_contributors(snapshot, survey_codes,
+                                                              periods)]
+    texts_read = []
+    share_sizes = []
+
+    def snapshot_texts():
+        for text in ingest_snapshot_parser.iter_contributor_texts(
+                snapshot, survey_codes, periods):
+            texts_read.append(text)
+            yield text
+
+    def map_shards(function, count):
+        # Each worker's share, run in this process so what it reads can be seen.
+        results = [function(index, count) for index in range(count)]
+        share_sizes.extend(len(result) for result in results)
+        return results
+
+    with mock.patch("ingest_parallel.map_shards", side_effect=map_shards):
+        rows = list(lambda_method_function_data.parallel_rows(
+            snapshot_texts(), plan, survey_codes, periods, 3))
+        sharded_rows = list(lambda_method_function_data.parallel_rows(
+            snapshot_texts(), plan, survey_codes, periods, 3, shard=(1, 2)))
+
+    assert rows == expected_rows
+    assert sharded_rows == expected_rows[1::2]
+    assert len(texts_read) == 2 * len(list(
+        ingest_snapshot_parser.iter_contributor_texts(snapshot, survey_codes,
+                                                      periods)))
+    assert all(share_sizes) and len(share_sizes) == 6
+
+
+@mock_s3
+def test_method_success_snapshot_cache(tmp_path):
+    """
+    Runs the method function twice with the snapshot cache turned on, checking the
+    second run reads the contributors it needs from the cached copy.
+    :param tmp_path: Pytest temporary directory.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].pop("data")
+    runtime_variables["RuntimeVariables"].update({
+        "snapshot_cache_size": 10000000,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json"
+    })
+
+    outputs = []
+    with mock.patch("ingest_snapshot_cache.CACHE_DIRECTORY", str(tmp_path)):
+        for _ in range(2):
+            with mock.patch("ingest_takeon_data_method.ingest_snapshot_parser."
+                            "iter_contributor_texts") as mock_contributors:
+                outputs.append(lambda_method_function_data.lambda_handler(
+                    runtime_variables, test_generic_library.context_object))
+
+    assert all(output["success"] for output in outputs)
+    assert not mock_contributors.called
+    for output in outputs:
+        assert_frame_equal(pd.DataFrame(json.loads(output["data"])), prepared_data)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+@mock_s3
+def test_method_success_batch():
+    """
+    Runs the method function for two periods from one scan of the snapshot, checking
+    each output matches its own run.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    run_variables = runtime_variables["RuntimeVariables"]
+    run_variables.pop("data")
+    runs = [{"out_file_name": f"test_method_batch_{period}", "period": period,
+             "periodicity": "03", "question_labels": run_variables["question_labels"],
+             "survey_codes": run_variables["survey_codes"]}
+            for period in ["201809", "201812"]]
+    for field in ["period", "periodicity", "question_labels", "survey_codes"]:
+        run_variables.pop(field)
+    run_variables.update({
+        "results_bucket_name": bucket_name,
+        "runs": runs,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json"
+    })
+
+    with mock.patch("ingest_takeon_data_method.ingest_snapshot_parser."
+                    "iter_contributor_texts",
+                    wraps=lambda_method_function_data.ingest_snapshot_parser.
+                    iter_contributor_texts) as mock_contributors:
+        output = lambda_method_function_data.lambda_handler(
+            runtime_variables, test_generic_library.context_object)
+
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_2:
+        single_variables = copy.deepcopy(method_runtime_variables_data)
+        single_variables["RuntimeVariables"].update({"data": json.loads(file_2.read()),
+                                                     "period": "201812"})
+    single_output = lambda_method_function_data.lambda_handler(
+        single_variables, test_generic_library.context_object)
+
+    produced_data = []
+    for run in runs:
+        produced_key = client.list_objects_v2(
+            Bucket=bucket_name, Prefix=run["out_file_name"])["Contents"][0]["Key"]
+        produced_file = client.get_object(Bucket=bucket_name, Key=produced_key)
+        produced_data.append(pd.DataFrame(json.loads(produced_file["Body"].read())))
+
+    assert output["success"]
+    assert mock_contributors.call_count == 1
+    assert [run["contributors"] for run in output["runs"]] == \
+        [len(data) for data in produced_data]
+    assert_frame_equal(produced_data[0], prepared_data)
+    assert_frame_equal(produced_data[1],
+                       pd.DataFrame(json.loads(single_output["data"])))
+
+
+@mock_s3
+def test_method_success_compressed_snapshot():
+    """
+    Runs the method function with a gzipped snapshot passed by S3 reference, that has
+    no Content-Encoding, and a gzipped output.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        client.put_object(Bucket=bucket_name, Key="test_ingest_input.json.gz",
+                          Body=gzip.compress(file_1.read()))
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_2:
+        prepared_data = pd.DataFrame(json.loads(file_2.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].pop("data")
+    runtime_variables["RuntimeVariables"].update({
+        "out_file_name": "test_method_compressed_output.json",
+        "output_compression": "gzip",
+        "results_bucket_name": bucket_name,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json.gz"
+    })
+
+    output = lambda_method_function_data.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    produced_file = client.get_object(Bucket=bucket_name,
+                                      Key="test_method_compressed_output.json")
+    produced_data = pd.DataFrame(json.loads(gzip.decompress(
+        produced_file["Body"].read())))
+
+    assert output["success"]
+    assert produced_file["ContentEncoding"] == "gzip"
+    assert_frame_equal(produced_data, prepared_data)
+
+
+@mock_s3
+def test_method_success_ranged_download():
+    """
+    Runs the method function with a snapshot passed by S3 reference, downloaded in
+    several ranged parts.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        client.put_object(Bucket=bucket_name, Key="test_ingest_input.json",
+                          Body=file_1.read())
+    e_tag = client.head_object(Bucket=bucket_name, Key="test_ingest_input.json")["ETag"]
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_2:
+        prepared_data = pd.DataFrame(json.loads(file_2.read()))
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].pop("data")
+    runtime_variables["RuntimeVariables"].update({
+        "download_part_size": 200000,
+        "out_file_name": "test_method_ranged_output",
+        "results_bucket_name": bucket_name,
+        "snapshot_etag": e_tag,
+        "snapshot_s3_uri": f"s3://{bucket_name}/test_ingest_input.json"
+    })
+
+    output = lambda_method_function_data.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    produced_key = client.list_objects_v2(
+        Bucket=bucket_name, Prefix="test_method_ranged_output")["Contents"][0]["Key"]
+    produced_file = client.get_object(Bucket=bucket_name, Key=produced_key)
+    produced_data = pd.DataFrame(json.loads(produced_file["Body"].read()))
+
+    assert output["success"]
+    assert_frame_equal(produced_data, prepared_data)
+
+
+@mock_s3
+@pytest.mark.parametrize(
+    "which_lambda,input_file,prepared_file,which_runtime_variables",
+    [
+        (lambda_method_function_data, "tests/fixtures/test_ingest_input.json",
+         "tests/fixtures/test_method_prepared_output.json",
+         method_runtime_variables_data),
+        (lambda_method_function_bricks, "tests/fixtures/test_bricks_method_input.json",
+         "tests/fixtures/test_bricks_method_prepared_output.json",
+         method_runtime_variables_bricks)
+    ]
+)
+def test_method_success_streamed(which_lambda, input_file, prepared_file,
+                                 which_runtime_variables):
+    """
+    Runs the method function with its output streamed to S3.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    with open(prepared_file, "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(which_runtime_variables)
+    with open(input_file, "r") as file_2:
+        runtime_variables["RuntimeVariables"]["data"] = json.loads(file_2.read())
+    runtime_variables["RuntimeVariables"].update({
+        "out_file_name": "test_method_streamed_output.json",
+        "results_bucket_name": bucket_name,
+        "upload_part_size": ingest_s3_upload.MIN_PART_SIZE
+    })
+
+    # Rows are built, encoded and uploaded 7 at a time.
+    with mock.patch("ingest_output_format.default_chunk_rows", return_value=7):
+        output = which_lambda.lambda_handler(
+            runtime_variables, test_generic_library.context_object)
+
+    produced_file = client.get_object(Bucket=bucket_name,
+                                      Key="test_method_streamed_output.json")
+    produced_data = pd.DataFrame(json.loads(produced_file["Body"].read()))
+
+    assert output["success"]
+    assert "data" not in output
+    assert_frame_equal(produced_data, prepared_data)
+
+
+@pytest.mark.parametrize(
+    "which_lambda,input_file,prepared_file,which_runtime_variables",
+    [
+        (lambda_method_function_data, "tests/fixtures/test_ingest_input.json",
+         "tests/fixtures/test_method_prepared_output.json",
+         method_runtime_variables_data),
+        (lambda_method_function_bricks, "tests/fixtures/test_bricks_method_input.json",
+         "tests/fixtures/test_bricks_method_prepared_output.json",
+         method_runtime_variables_bricks)
+    ]
+)
+def test_method_success_ndjson(which_lambda, input_file, prepared_file,
+                               which_runtime_variables):
+    """
+    Runs the method function with newline delimited JSON output.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open(prepared_file, "r") as file_1:
+        prepared_rows = json.loads(file_1.read())
+
+    runtime_variables = copy.deepcopy(which_runtime_variables)
+    with open(input_file, "r") as file_2:
+        runtime_variables["RuntimeVariables"]["data"] = json.loads(file_2.read())
+    runtime_variables["RuntimeVariables"]["output_format"] = "ndjson"
+
+    output = which_lambda.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    assert output["success"]
+    assert output["data"].endswith("\n")
+    assert [json.loads(line) for line in output["data"].splitlines()] == \
+        prepared_rows
+
+
+def emitted_records(out):
+    """
+    :param out: String - Captured stdout.
+    :return: List - The EMF metric records written to it.
+    """
+    return [json.loads(line) for line in out.splitlines() if line.startswith('{"_aws"')]
+
+
+@pytest.mark.parametrize(
+    "which_lambda,input_file,which_runtime_variables,expected_metrics",
+    [
+        (lambda_method_function_data, "tests/fixtures/test_ingest_input.json",
+         method_runtime_variables_data,
+         ["contributors_scanned", "contributors_kept", "transform_time"]),
+        (lambda_method_function_bricks, "tests/fixtures/test_bricks_method_input.json",
+         method_runtime_variables_bricks, ["respondents", "expand_time"])
+    ]
+)
+def test_method_success_metrics(which_lambda, input_file, which_runtime_variables,
+                                expected_metrics, capsys):
+    """
+    Runs the method function with metrics turned on, checking it writes one metric
+    record.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    runtime_variables = copy.deepcopy(which_runtime_variables)
+    with open(input_file, "r") as file_1:
+        runtime_variables["RuntimeVariables"]["data"] = json.loads(file_1.read())
+    runtime_variables["RuntimeVariables"]["metrics"] = True
+
+    output = which_lambda.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    records = emitted_records(capsys.readouterr().out)
+    assert output["success"]
+    assert len(records) == 1
+    assert records[0]["survey"] == runtime_variables["RuntimeVariables"]["survey"]
+    assert records[0]["output_bytes"] > 0
+    assert "encode_time" in records[0]
+    for metric in expected_metrics:
+        assert metric in records[0]
+
+
+@mock_s3
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_sns_message')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.save_to_s3')
+def test_bricks_wrangler_ndjson_input(mock_s3_put, mock_sns, mock_bpm):
+    """
+    Runs the brick type wrangler on a newline delimited takeon output, checking the
+    method is passed the same rows as a JSON array.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    with open("tests/fixtures/test_bricks_method_input.json", "r") as file_1:
+        input_rows = json.loads(file_1.read())
+    in_file_name = wrangler_runtime_variables_bricks["RuntimeVariables"]["in_file_name"]
+    client.put_object(Bucket=bucket_name, Key=in_file_name + ".ndjson",
+                      Body="".join(json.dumps(row) + "\n" for row in input_rows))
+
+    with mock.patch.dict(lambda_wrangler_function_bricks.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("ingest_brick_type_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.return_value.get.return_value.read \
+                .return_value.decode.return_value = json.dumps(
+                    {"data": "[]", "success": True})
+
+            output = lambda_wrangler_function_bricks.lambda_handler(
+                wrangler_runtime_variables_bricks, test_generic_library.context_object)
+
+    payload = json.loads(mock_client_object.invoke.call_args[1]["Payload"])
+
+    assert output["success"]
+    assert payload["RuntimeVariables"]["data"] == input_rows
+
+
+@mock_s3
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_bpm_status')
+def test_bricks_wrangler_unrecognised_input(mock_bpm):
+    """
+    Checks a takeon output in none of the output formats fails the brick type
+    wrangler with an error saying so, rather than being read as newline delimited.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    in_file_name = wrangler_runtime_variables_bricks["RuntimeVariables"]["in_file_name"]
+    client.put_object(Bucket=bucket_name, Key=in_file_name + ".json",
+                      Body=b"<html>Gateway Timeout</html>")
+
+    with mock.patch.dict(lambda_wrangler_function_bricks.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("ingest_brick_type_wrangler.boto3.client") as mock_client:
+            with pytest.raises(exception_classes.LambdaFailure) as exc_info:
+                lambda_wrangler_function_bricks.lambda_handler(
+                    wrangler_runtime_variables_bricks,
+                    test_generic_library.context_object)
+
+    assert "not a JSON array, newline delimited JSON or Parquet" in \
+        str(exc_info.value)
+    mock_client.return_value.invoke.assert_not_called()
+
+
+@mock_s3
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_sns_message')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.save_to_s3')
+def test_bricks_wrangler_metrics(mock_s3_put, mock_sns, mock_bpm, capsys):
+    """
+    Runs the brick type wrangler with metrics turned on, checking it writes one
+    metric record and turns them on in the method.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    in_file_name = wrangler_runtime_variables_bricks["RuntimeVariables"]["in_file_name"]
+    client.put_object(Bucket=bucket_name, Key=in_file_name + ".json",
+                      Body='[{"a": 1}]')
+
+    with mock.patch.dict(lambda_wrangler_function_bricks.os.environ,
+                         {**wrangler_environment_variables, "metrics_enabled": "true"}):
+        with mock.patch("ingest_brick_type_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.return_value.get.return_value.read \
+                .return_value.decode.return_value = json.dumps(
+                    {"data": "[]", "success": True})
+
+            output = lambda_wrangler_function_bricks.lambda_handler(
+                wrangler_runtime_variables_bricks, test_generic_library.context_object)
+
+    payload = json.loads(mock_client_object.invoke.call_args[1]["Payload"])
+    records = emitted_records(capsys.readouterr().out)
+
+    assert output["success"]
+    assert payload["RuntimeVariables"]["metrics"]
+    assert len(records) == 1
+    assert records[0]["input_bytes"] == 10
+    assert records[0]["payload_bytes"] == len(
+        mock_client_object.invoke.call_args[1]["Payload"])
+    assert records[0]["output_bytes"] == 2
+    for metric in ["read_input_time", "invoke_time", "write_output_time"]:
+        assert metric in records[0]
+
+
+@mock_s3
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_sns_message')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.save_to_s3')
+def test_bricks_wrangler_in_process(mock_s3_put, mock_sns, mock_bpm, capsys):
+    """
+    Runs the brick type wrangler with its method in process, as ingest_local does,
+    checking the payload is measured as it is for Lambda.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name,
+                                      ["test_bricks_method_input.json"])
+    with open("tests/fixtures/test_bricks_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+    ingest_warm_state.set_client("lambda", ingest_warm_state.InProcessLambdaClient({
+        "mock-function": lambda_method_function_bricks.lambda_handler}))
+
+    with mock.patch.dict(lambda_wrangler_function_bricks.os.environ,
+                         {**wrangler_environment_variables, "metrics_enabled": "true"}):
+        output = lambda_wrangler_function_bricks.lambda_handler(
+            wrangler_runtime_variables_bricks, test_generic_library.context_object)
+
+    produced_data = pd.DataFrame(json.loads(mock_s3_put.call_args[0][2]))
+    records = emitted_records(capsys.readouterr().out)
+    assert output["success"]
+    assert_frame_equal(produced_data, prepared_data)
+    assert [record["payload_bytes"] > 0 for record in records
+            if "payload_bytes" in record] == [True]
+
+
+@pytest.mark.parametrize(
+    "which_lambda,input_file,prepared_file,which_runtime_variables",
+    [
+        (lambda_method_function_data, "tests/fixtures/test_ingest_input.json",
+         "tests/fixtures/test_method_prepared_output.json",
+         method_runtime_variables_data),
+        (lambda_method_function_bricks, "tests/fixtures/test_bricks_method_input.json",
+         "tests/fixtures/test_bricks_method_prepared_output.json",
+         method_runtime_variables_bricks)
+    ]
+)
+def test_method_success_parquet(which_lambda, input_file, prepared_file,
+                                which_runtime_variables):
+    """
+    Runs the method function with Parquet output, returned base64 encoded.
+    :param None
+    :return Test Pass/Fail
+    """
+    pytest.importorskip("pyarrow")
+    with open(prepared_file, "r") as file_1:
+        prepared_rows = json.loads(file_1.read())
+
+    runtime_variables = copy.deepcopy(which_runtime_variables)
+    with open(input_file, "r") as file_2:
+        runtime_variables["RuntimeVariables"]["data"] = json.loads(file_2.read())
+    runtime_variables["RuntimeVariables"]["output_format"] = "parquet"
+
+    output = which_lambda.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    produced_data = ingest_output_format.read_dataframe(base64.b64decode(output["data"]))
+
+    assert output["success"]
+    assert json.loads(produced_data.to_json(orient="records")) == prepared_rows
+
+
+@mock_s3
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_brick_type_wrangler.aws_functions.send_sns_message')
+def test_bricks_wrangler_parquet(mock_sns, mock_bpm):
+    """
+    Runs the brick type wrangler on a Parquet takeon output, checking the method is
+    passed the rows as a JSON array and its Parquet output is written with the
+    Parquet Content-Type.
+    :param None
+    :return Test Pass/Fail
+    """
+    pytest.importorskip("pyarrow")
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    with open("tests/fixtures/test_bricks_method_input.json", "r") as file_1:
+        input_rows = json.loads(file_1.read())
+    in_file_name = wrangler_runtime_variables_bricks["RuntimeVariables"]["in_file_name"]
+    client.put_object(Bucket=bucket_name, Key=in_file_name + ".parquet",
+                      Body=ingest_output_format.encode_rows(input_rows, "parquet"),
+                      ContentType=ingest_output_format.PARQUET_CONTENT_TYPE)
+    with open("tests/fixtures/test_bricks_method_prepared_output.json", "r") as file_2:
+        prepared_rows = json.loads(file_2.read())
+    method_output = ingest_output_format.encode_rows(prepared_rows, "parquet")
+
+    with mock.patch.dict(lambda_wrangler_function_bricks.os.environ,
+                         dict(wrangler_environment_variables, output_format="parquet")):
+        with mock.patch("ingest_brick_type_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.return_value.get.return_value.read \
+                .return_value.decode.return_value = json.dumps({
+                    "data": ingest_output_format.encode_payload_data(method_output),
+                    "success": True})
+
+            output = lambda_wrangler_function_bricks.lambda_handler(
+                wrangler_runtime_variables_bricks, test_generic_library.context_object)
+
+    payload = json.loads(mock_client_object.invoke.call_args[1]["Payload"])
+    out_file_name = wrangler_runtime_variables_bricks["RuntimeVariables"]["out_file_name"]
+    produced_file = client.get_object(
+        Bucket=bucket_name, Key=out_file_name[:-len(".json")] + ".parquet")
+
+    assert output["success"]
+    assert payload["RuntimeVariables"]["data"] == input_rows
+    assert payload["RuntimeVariables"]["output_format"] == "parquet"
+    assert produced_file["ContentType"] == ingest_output_format.PARQUET_CONTENT_TYPE
+    assert produced_file["Body"].read() == method_output
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_method.general_functions.handle_exception',
+            return_value="Upload failed.")
+def test_method_streamed_upload_aborted(mock_handle_exception):
+    """
+    Checks that when the output fails part way through being streamed, the upload
+    is aborted and the error is handled.
+    :param mock_handle_exception: Replacement for general_functions.handle_exception.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    def failing_chunks(frames, output_format):
+        # More than one part, so the multipart upload has been started.
+        yield " " * (ingest_s3_upload.MIN_PART_SIZE + 1)
+        raise KeyError("Q608_total")
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_1:
+        runtime_variables["RuntimeVariables"]["data"] = json.loads(file_1.read())
+    runtime_variables["RuntimeVariables"].update({
+        "out_file_name": "test_method_streamed_output.json",
+        "results_bucket_name": bucket_name,
+        "upload_part_size": ingest_s3_upload.MIN_PART_SIZE
+    })
+
+    with mock.patch(
+            "ingest_takeon_data_method.ingest_output_format.iter_frame_chunks",
+            side_effect=failing_chunks):
+        output = lambda_method_function_data.lambda_handler(
+            runtime_variables, test_generic_library.context_object)
+
+    assert not output["success"]
+    assert output["error"] == "Upload failed."
+    assert isinstance(mock_handle_exception.call_args[0][0], KeyError)
+    assert "Uploads" not in client.list_multipart_uploads(Bucket=bucket_name)
+    assert "Contents" not in client.list_objects_v2(Bucket=bucket_name)
+
+
+@mock_s3
+def test_method_success_delta():
+    """
+    Runs the method function twice in delta mode, checking the second run reuses the
+    first run's rows and still produces the full output.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    test_generic_library.create_bucket(bucket_name)
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_2:
+        test_data = json.loads(file_2.read())
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].update({
+        "data": test_data,
+        "delta_file_name": "delta/BMI_SG-201809.json",
+        "results_bucket_name": bucket_name
+    })
+
+    first_output = lambda_method_function_data.lambda_handler(
+        copy.deepcopy(runtime_variables), test_generic_library.context_object)
+    second_output = lambda_method_function_data.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    assert first_output["delta"]["added"] == len(prepared_data)
+    assert second_output["delta"] == {"added": 0, "changed": 0, "removed": 0,
+                                      "unchanged": len(prepared_data)}
+    for output in [first_output, second_output]:
+        assert output["success"]
+        assert_frame_equal(pd.DataFrame(json.loads(output["data"])), prepared_data)
+
+
+@mock_s3
+def test_method_success_reuse_previous_period():
+    """
+    Runs the method for the previous period and then the current one, checking the
+    current run reuses the previous period's rows and produces the same output.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    test_generic_library.create_bucket(bucket_name)
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_2:
+        test_data = json.loads(file_2.read())
+
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].update({
+        "data": test_data,
+        "period": "201806",
+        "period_output_prefix": "periods/",
+        "previous_period_max_age": 100,
+        "results_bucket_name": bucket_name,
+        "snapshot_last_modified": 1000
+    })
+    lambda_method_function_data.lambda_handler(
+        copy.deepcopy(runtime_variables), test_generic_library.context_object)
+
+    runtime_variables["RuntimeVariables"]["period"] = "201809"
+    with mock.patch("ingest_takeon_data_method.iter_snapshot_contributors",
+                    wraps=lambda_method_function_data.iter_snapshot_contributors) \
+            as mock_contributors:
+        output = lambda_method_function_data.lambda_handler(
+            runtime_variables, test_generic_library.context_object)
+
+    assert output["success"]
+    assert mock_contributors.call_args[0][2] == ("201809",)
+    # The reused rows are merged back into snapshot order.
+    assert_frame_equal(pd.DataFrame(json.loads(output["data"])), prepared_data)
+
+
+@pytest.mark.parametrize(
+    "which_lambda,which_runtime_variables,bad_data",
+    [
+        (lambda_method_function_data, method_runtime_variables_data, []),
+        (lambda_method_function_data, method_runtime_variables_data, {"data": {}}),
+        (lambda_method_function_bricks, method_runtime_variables_bricks, {}),
+        (lambda_method_function_bricks, method_runtime_variables_bricks, ["a"])
+    ])
+def test_method_invalid_data(which_lambda, which_runtime_variables, bad_data):
+    """
+    Checks the structural check of the data reports the runtime params error.
+    :param which_lambda: Method module to test.
+    :param which_runtime_variables: RuntimeVariables to pass.
+    :param bad_data: Malformed data.
+    :return Test Pass/Fail
+    """
+    runtime_variables = copy.deepcopy(which_runtime_variables)
+    runtime_variables["RuntimeVariables"]["data"] = bad_data
+
+    output = which_lambda.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    assert not output["success"]
+    assert "Error validating runtime params" in output["error"]
+
+
+@pytest.mark.parametrize("raw_data", ['[{"a": 1}]', b'[{"a": 1}]'])
+def test_bricks_build_payload(raw_data):
+    """
+    Checks already encoded data is spliced into the bricks method payload intact.
+    :param raw_data: JSON encoded data, as bytes or a string.
+    :return Test Pass/Fail
+    """
+    runtime_variables = {"run_id": "bob", "survey": "BMI_SG"}
+
+    payload = lambda_wrangler_function_bricks.build_payload(
+        runtime_variables, raw_data)
+
+    assert json.loads(payload) == {"RuntimeVariables": {"data": [{"a": 1}],
+                                                        "run_id": "bob",
+                                                        "survey": "BMI_SG"}}
+
+
+@mock_s3
+def test_method_success_brick_types():
+    """
+    Runs the method function with the brick type parameters, so the brick types are
+    expanded in the same pass. Response type stands in for the brick type column.
+    :param None
+    :return Test Pass/Fail
+    """
+    brick_questions = {
+        "1": {"Q601_asphalting_sand": "type_1_asphalting_sand",
+              "Q602_building_soft_sand": "type_1_building_soft_sand"},
+        "2": {"Q601_asphalting_sand": "type_2_asphalting_sand",
+              "Q602_building_soft_sand": "type_2_building_soft_sand"}
+    }
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data = lambda_method_function_data.ingest_plan.expand_brick_types(
+        prepared_data, brick_questions, [1, 2], "response_type")
+
+    with open("tests/fixtures/test_ingest_input.json", "r") as file_2:
+        test_data = file_2.read()
+    runtime_variables = copy.deepcopy(method_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].update({
+        "brick_questions": brick_questions,
+        "brick_type_column": "response_type",
+        "brick_types": [1, 2],
+        "data": json.loads(test_data)
+    })
+
+    output = lambda_method_function_data.lambda_handler(
+        runtime_variables, test_generic_library.context_object)
+
+    produced_data = pd.DataFrame(json.loads(output["data"]))
+
+    assert output["success"]
+    assert "type_2_asphalting_sand" in produced_data.columns
+    assert "Q601_asphalting_sand" not in produced_data.columns
+    assert_frame_equal(produced_data, prepared_data)
+
+
+def method_invoke(FunctionName, Payload):  # noqa: N803
+    """
+    Replacement for the Lambda invoke that runs the takeon method in process.
+    :param FunctionName: String - Name of the method Lambda.
+    :param Payload: String - Method payload.
+    :return: Dict - Invoke response.
+    """
+    output = lambda_method_function_data.lambda_handler(
+        json.loads(Payload), test_generic_library.context_object)
+    return {"Payload": io.BytesIO(json.dumps(output).encode("utf-8"))}
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_sns_message')
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "parquet"])
+def test_wrangler_success_sharded(mock_sns, mock_bpm, output_format):
+    """
+    Runs the wrangler function with the method split into shards, checking each shard
+    is given only its own byte ranges of the snapshot, and the parts they write are
+    joined in order and then deleted.
+    :param output_format: String - json, ndjson or parquet.
+    :return Test Pass/Fail
+    """
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+    snapshot_size = client.head_object(Bucket=bucket_name,
+                                       Key="test_ingest_input.json")["ContentLength"]
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(wrangler_runtime_variables_data)
+    runtime_variables["RuntimeVariables"]["shard_count"] = 3
+
+    with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                         {**wrangler_environment_variables,
+                          "output_format": output_format}):
+        with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+            mock_client.return_value.invoke.side_effect = method_invoke
+
+            output = lambda_wrangler_function_data.lambda_handler(
+                runtime_variables, test_generic_library.context_object)
+
+    shard_variables = [json.loads(call[1]["Payload"])["RuntimeVariables"]
+                       for call in mock_client.return_value.invoke.call_args_list]
+    shard_ranges = sorted(byte_range for variables in shard_variables
+                          for byte_range in variables["snapshot_ranges"])
+    out_file_name = ingest_output_format.file_name(
+        runtime_variables["RuntimeVariables"]["out_file_name"], output_format)
+    produced_output = client.get_object(Bucket=bucket_name,
+                                        Key=out_file_name)["Body"].read()
+    if output_format != "json":
+        produced_output = ingest_output_format.to_json(produced_output)
+    produced_data = pd.DataFrame(json.loads(produced_output))
+
+    assert output["success"]
+    assert len(shard_variables) == 3
+    assert all(variables["snapshot_ranges"] for variables in shard_variables)
+    # The shards' ranges don't overlap and leave out the rest of the snapshot.
+    assert all(end <= start for (_, end), (start, _) in
+               zip(shard_ranges, shard_ranges[1:]))
+    assert sum(end - start for start, end in shard_ranges) < snapshot_size / 2
+    assert [item["Key"] for item in client.list_objects_v2(
+        Bucket=bucket_name)["Contents"]] == \
+        sorted(["test_ingest_input.json", out_file_name])
+    assert_frame_equal(produced_data, prepared_data)
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_sns_message')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.save_to_s3')
+def test_wrangler_metrics(mock_s3_put, mock_sns, mock_bpm, capsys):
+    """
+    Runs the wrangler function and the method with metrics turned on, checking each
+    writes its own metric record.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                         {**wrangler_environment_variables, "metrics_enabled": "true"}):
+        with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+            mock_client.return_value.invoke.side_effect = method_invoke
+
+            output = lambda_wrangler_function_data.lambda_handler(
+                wrangler_runtime_variables_data, test_generic_library.context_object)
+
+    method_record, wrangler_record = emitted_records(capsys.readouterr().out)
+
+    assert output["success"]
+    assert method_record["module"] == "Results Ingest - Takeon Data - Method"
+    assert "transform_time" in method_record
+    assert "invoke_time" not in method_record
+    assert wrangler_record["module"] == "Results Ingest - Takeon Data - Wrangler"
+    assert wrangler_record["output_bytes"] == len(mock_s3_put.call_args[0][2])
+    for metric in ["snapshot_bytes", "payload_bytes", "invoke_time",
+                   "write_output_time"]:
+        assert metric in wrangler_record
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_sns_message')
+def test_wrangler_success_batch(mock_sns, mock_bpm):
+    """
+    Runs the wrangler function for a batch of two runs, checking the method is
+    invoked once, writes both outputs and BPM status is sent for each run.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    runtime_variables = copy.deepcopy(wrangler_runtime_variables_data)
+    for field in ["out_file_name", "period", "periodicity"]:
+        runtime_variables["RuntimeVariables"].pop(field)
+    runtime_variables["RuntimeVariables"]["runs"] = [
+        {"out_file_name": f"test_wrangler_batch_{period}", "period": period,
+         "periodicity": "03", "run_id": f"bob-{period}"}
+        for period in ["201809", "201812"]]
+
+    with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+            mock_client.return_value.invoke.side_effect = method_invoke
+
+            output = lambda_wrangler_function_data.lambda_handler(
+                runtime_variables, test_generic_library.context_object)
+
+    produced_key = client.list_objects_v2(
+        Bucket=bucket_name, Prefix="test_wrangler_batch_201809")["Contents"][0]["Key"]
+    produced_file = client.get_object(Bucket=bucket_name, Key=produced_key)
+    produced_data = pd.DataFrame(json.loads(produced_file["Body"].read()))
+    statuses = [(call[0][2], call[0][3]) for call in mock_bpm.call_args_list]
+
+    assert output["success"]
+    assert mock_client.return_value.invoke.call_count == 1
+    assert client.list_objects_v2(
+        Bucket=bucket_name, Prefix="test_wrangler_batch_201812")["KeyCount"] == 1
+    assert_frame_equal(produced_data, prepared_data)
+    assert statuses == [("IN PROGRESS", "bob-201809"), ("IN PROGRESS", "bob-201812"),
+                        ("DONE", "bob-201809"), ("DONE", "bob-201812")]
+
+
+@pytest.mark.parametrize("field,value", [("delta", True), ("shard_count", 2)])
+def test_wrangler_batch_invalid(field, value):
+    """
+    Checks options that keep state per run, or shard it, can't be batched.
+    :param field: String - Runtime variable that can't be given with runs.
+    :param value: Its value.
+    :return Test Pass/Fail
+    """
+    runtime_variables = copy.deepcopy(wrangler_runtime_variables_data)
+    runtime_variables["RuntimeVariables"].update({
+        "runs": [{"out_file_name": "test_wrangler_batch", "period": "201809",
+                  "periodicity": "03"}],
+        field: value
+    })
+
+    with pytest.raises(ValueError) as exc_info:
+        ingest_warm_state.get_schema(lambda_wrangler_function_data.RuntimeSchema).load(
+            runtime_variables["RuntimeVariables"])
+    assert field in str(exc_info.value)
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+def test_wrangler_sharded_method_error(mock_bpm):
+    """
+    Checks a failing shard fails the wrangler.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    runtime_variables = copy.deepcopy(wrangler_runtime_variables_data)
+    runtime_variables["RuntimeVariables"]["shard_count"] = 3
+
+    def failing_invoke(FunctionName, Payload):  # noqa: N803
+        if json.loads(Payload)["RuntimeVariables"]["out_file_name"].endswith(
+                ".shard-1"):
+            output = {"success": False, "error": "Shard failed."}
+            return {"Payload": io.BytesIO(json.dumps(output).encode("utf-8"))}
+        return method_invoke(FunctionName, Payload)
+
+    with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+            mock_client.return_value.invoke.side_effect = failing_invoke
+
+            with pytest.raises(exception_classes.LambdaFailure) as exc_info:
+                lambda_wrangler_function_data.lambda_handler(
+                    runtime_variables, test_generic_library.context_object)
+
+    assert "Shard failed." in str(exc_info.value)
+    # The other shards' parts are deleted.
+    assert [item["Key"] for item in client.list_objects_v2(
+        Bucket=bucket_name)["Contents"]] == ["test_ingest_input.json"]
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_sns_message')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.save_to_s3')
+def test_wrangler_result_cache(mock_s3_put, mock_sns, mock_bpm):
+    """
+    Runs the wrangler twice against the same snapshot, checking the second run reuses
+    the first run's output unless told to refresh it.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    environment_variables = dict(wrangler_environment_variables,
+                                 result_cache_ttl="3600")
+
+    def run_wrangler(runtime_variables):
+        with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                             environment_variables):
+            with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+                mock_client.return_value.invoke.side_effect = method_invoke
+
+                output = lambda_wrangler_function_data.lambda_handler(
+                    runtime_variables, test_generic_library.context_object)
+        assert output["success"]
+        return mock_client.return_value.invoke.call_count
+
+    assert run_wrangler(copy.deepcopy(wrangler_runtime_variables_data)) == 1
+    produced_output = mock_s3_put.call_args[0][2]
+    cache_files = client.list_objects_v2(Bucket=bucket_name,
+                                         Prefix="ingest-result-cache/")
+    assert cache_files["KeyCount"] == 1
+
+    assert run_wrangler(copy.deepcopy(wrangler_runtime_variables_data)) == 0
+    assert json.loads(mock_s3_put.call_args[0][2]) == json.loads(produced_output)
+
+    runtime_variables = copy.deepcopy(wrangler_runtime_variables_data)
+    runtime_variables["RuntimeVariables"]["force_refresh"] = True
+    assert run_wrangler(runtime_variables) == 1
+
+
+@mock_s3
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_bpm_status')
+@mock.patch('ingest_takeon_data_wrangler.aws_functions.send_sns_message')
+def test_wrangler_success_compressed(mock_sns, mock_bpm):
+    """
+    Runs the wrangler function with a compressed method payload and output.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+    test_generic_library.upload_files(client, bucket_name, ["test_ingest_input.json"])
+
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    environment_variables = dict(wrangler_environment_variables,
+                                 output_compression="gzip",
+                                 payload_compression="gzip")
+    payloads = []
+
+    def recording_invoke(FunctionName, Payload):  # noqa: N803
+        payloads.append(json.loads(Payload))
+        return method_invoke(FunctionName, Payload)
+
+    with mock.patch.dict(lambda_wrangler_function_data.os.environ,
+                         environment_variables):
+        with mock.patch("ingest_takeon_data_wrangler.boto3.client") as mock_client:
+            mock_client.return_value.invoke.side_effect = recording_invoke
+
+            output = lambda_wrangler_function_data.lambda_handler(
+                copy.deepcopy(wrangler_runtime_variables_data),
+                test_generic_library.context_object)
+
+    out_file_name = wrangler_runtime_variables_data["RuntimeVariables"]["out_file_name"]
+    produced_file = client.get_object(Bucket=bucket_name, Key=out_file_name + ".gz")
+    produced_data = pd.DataFrame(json.loads(gzip.decompress(
+        produced_file["Body"].read())))
+
+    assert output["success"]
+    assert isinstance(payloads[0]["RuntimeVariables"]["data"], str)
+    assert produced_file["ContentEncoding"] == "gzip"
+    assert_frame_equal(produced_data, prepared_data)
+
+
+def test_warm_state_reused():
+    """
+    Checks clients and schemas are reused between invocations until reset.
+    :param None
+    :return Test Pass/Fail
+    """
+    client_factory = mock.Mock()
+    client = ingest_warm_state.get_client(client_factory, "lambda")
+    schema = ingest_warm_state.get_schema(lambda_wrangler_function_data.RuntimeSchema)
+
+    assert ingest_warm_state.get_client(client_factory, "lambda") is client
+    assert ingest_warm_state.get_schema(
+        lambda_wrangler_function_data.RuntimeSchema) is schema
+    assert client_factory.call_count == 1
+
+    ingest_warm_state.reset()
+
+    assert ingest_warm_state.get_schema(
+        lambda_wrangler_function_data.RuntimeSchema) is not schema
+    ingest_warm_state.get_client(client_factory, "lambda")
+    assert client_factory.call_count == 2
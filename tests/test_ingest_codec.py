@@ -0,0 +1,82 @@
+import gzip
+import io
+
+import boto3
+import pytest
+from moto import mock_s3
+
+import ingest_codec
+
+data = b'{"data": {"allSurveys": {"nodes": []}}}' * 100
+
+
+@pytest.mark.parametrize("encoding", [ingest_codec.GZIP, ingest_codec.ZSTD])
+def test_compress_round_trip(encoding):
+    """
+    Compresses and decompresses data, with the compression detected from the data.
+    :param encoding: Compression to use.
+    :return Test Pass/Fail
+    """
+    if encoding == ingest_codec.ZSTD:
+        pytest.importorskip("zstandard")
+
+    compressed = ingest_codec.compress(data, encoding)
+
+    assert len(compressed) < len(data)
+    assert ingest_codec.detect(compressed) == encoding
+    assert ingest_codec.decompress(compressed) == data
+    assert ingest_codec.decode_payload_data(
+        ingest_codec.encode_payload_data(data, encoding), encoding) == data
+
+
+def test_detect():
+    """
+    Checks Content-Encoding is used when given, and uncompressed data is left alone.
+    :param None
+    :return Test Pass/Fail
+    """
+    assert ingest_codec.detect(data) is None
+    assert ingest_codec.detect(b"", "gzip") == ingest_codec.GZIP
+    assert ingest_codec.decompress(data) is data
+    # Same data, same bytes.
+    assert ingest_codec.compress(data, "gzip") == ingest_codec.compress(data, "gzip")
+
+
+@pytest.mark.parametrize("source", [data, gzip.compress(data)])
+@pytest.mark.parametrize("read_size", [1, 7, 1024])
+def test_open_stream(source, read_size):
+    """
+    Reads a stream that may be compressed a few bytes at a time.
+    :param source: Bytes - Stream content.
+    :param read_size: Int - Bytes to read at a time.
+    :return Test Pass/Fail
+    """
+    stream = ingest_codec.open_stream(io.BytesIO(source))
+
+    chunks = []
+    chunk = stream.read(read_size)
+    while chunk:
+        chunks.append(chunk)
+        chunk = stream.read(read_size)
+
+    assert b"".join(chunks) == data
+
+
+@mock_s3
+def test_save_and_read_compressed():
+    """
+    Writes compressed to S3 and reads it back.
+    :param None
+    :return Test Pass/Fail
+    """
+    s3_resource = boto3.resource("s3", region_name="eu-west-2")
+    s3_resource.create_bucket(
+        Bucket="test_bucket",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+
+    ingest_codec.save_to_s3(s3_resource, "test_bucket", "output.json", data, "gzip")
+
+    s3_object = s3_resource.Object("test_bucket", "output.json")
+    assert s3_object.content_encoding == "gzip"
+    assert gzip.decompress(s3_object.get()["Body"].read()) == data
+    assert ingest_codec.read_from_s3(s3_resource, "test_bucket", "output.json") == data
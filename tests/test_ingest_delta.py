@@ -0,0 +1,78 @@
+import copy
+
+import boto3
+from moto import mock_s3
+
+import ingest_delta
+import ingest_plan
+from tests.conftest import question_labels, statuses, survey_codes
+
+
+def test_delta_ingest(contributors):
+    """
+    Runs a delta ingest against the previous run's state, checking the rows match a
+    full ingest and only the changed contributors are flattened again.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    plan_key = ingest_plan.plan_key(question_labels, survey_codes, statuses)
+
+    first_run = ingest_delta.DeltaIngest(plan, plan_key)
+    first_rows = list(first_run.values(contributors))
+
+    assert first_rows == [plan.values(contributor) for contributor in contributors]
+    assert first_run.counts() == {"added": len(contributors), "changed": 0,
+                                  "removed": 0, "unchanged": 0}
+
+    # Drop the first contributor and change the second's status.
+    changed_contributors = copy.deepcopy(contributors[1:])
+    changed_contributors[0]["status"] = "Clear"
+
+    second_run = ingest_delta.DeltaIngest(plan, plan_key, first_run.state())
+    second_rows = list(second_run.values(changed_contributors))
+
+    assert second_rows == [plan.values(contributor)
+                           for contributor in changed_contributors]
+    assert second_run.counts() == {"added": 0, "changed": 1, "removed": 1,
+                                   "unchanged": len(contributors) - 2}
+
+    # A run reading only 201809 doesn't count the 201806 contributors as removed,
+    # and keeps them for the next run.
+    current_contributors = [contributor for contributor in contributors
+                            if contributor["period"] == "201809"]
+    period_run = ingest_delta.DeltaIngest(plan, plan_key, first_run.state(),
+                                          ("201809",))
+    list(period_run.values(current_contributors[1:]))
+
+    assert 0 < len(current_contributors) < len(contributors)
+    assert period_run.counts() == {"added": 0, "changed": 0, "removed": 1,
+                                   "unchanged": len(current_contributors) - 1}
+    assert period_run.state()["contributors"].keys() == \
+        first_run.state()["contributors"].keys() - \
+        {ingest_delta.contributor_key(current_contributors[0])}
+
+    # State from other ingestion parameters is ignored.
+    other_run = ingest_delta.DeltaIngest(plan, "other", first_run.state())
+    list(other_run.values(contributors))
+    assert other_run.counts()["added"] == len(contributors)
+
+
+@mock_s3
+def test_delta_state():
+    """
+    Saves and loads delta state through S3.
+    :param None
+    :return Test Pass/Fail
+    """
+    s3_resource = boto3.resource("s3", region_name="eu-west-2")
+    s3_resource.create_bucket(
+        Bucket="test_bucket",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+    state = {"plan_key": "abc", "contributors": {"0066|201809|1": ["f", [1, "a"]]}}
+
+    assert ingest_delta.load_state(s3_resource, "test_bucket", "state.json") is None
+
+    ingest_delta.save_state(s3_resource, "test_bucket", "state.json", state)
+
+    assert ingest_delta.load_state(s3_resource, "test_bucket", "state.json") == state
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import ingest_json
+import ingest_plan
+from tests.conftest import question_labels, statuses, survey_codes
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    """
+    Runs a test with orjson, where it is installed, and with the standard library.
+    """
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(ingest_json, "orjson", None)
+    return request.param
+
+
+def test_dumps_matches_method_output(backend, contributors):
+    """
+    Checks the rows the method writes encode to the same bytes, so outputs merged
+    from shards match the method's own.
+    :param backend: Library doing the encoding.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    output_columns = ingest_plan.ColumnarBuilder(plan)
+    output_columns.extend(contributors)
+    method_output = output_columns.to_json()
+
+    assert ingest_json.dumps(json.loads(method_output)) == method_output.encode("utf-8")
+
+
+def test_round_trip(backend):
+    """
+    Encodes and decodes documents, including the cases orjson leaves to the
+    standard library.
+    :param backend: Library doing the encoding.
+    :return Test Pass/Fail
+    """
+    document = {"name": "Café £", "big": 2 ** 70, "nodes": [1, None, True]}
+
+    encoded = ingest_json.dumps(document)
+
+    assert encoded == '{"name":"Café £","big":1180591620717411303424,' \
+                      '"nodes":[1,null,true]}'.encode("utf-8")
+    assert ingest_json.loads(encoded) == document
+    assert ingest_json.loads(encoded.decode("utf-8")) == document
+    assert ingest_json.dumps({1: "a"}) == b'{"1":"a"}'
+    with pytest.raises(ValueError):
+        ingest_json.loads(b"{")
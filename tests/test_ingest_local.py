@@ -0,0 +1,65 @@
+import argparse
+import json
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import ingest_local
+from tests.conftest import ingestion_parameters
+
+config = {
+    "snapshot": "tests/fixtures/test_ingest_input.json",
+    "surveys": {
+        "BMI_SG": {
+            "periodicity": "03",
+            "ingestion_parameters": ingestion_parameters
+        }
+    }
+}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run(tmp_path, workers):
+    """
+    Runs the takeon ingest locally, in this process and in a pool, checking each
+    job's output matches the Lambda one.
+    :param tmp_path: Pytest temporary directory.
+    :param workers: Int - Processes to run the jobs in.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+
+    results = ingest_local.run(config, [("BMI_SG", "201809"), ("BMI_SG", "201812")],
+                               str(tmp_path), workers)
+
+    assert [result["period"] for result in results] == ["201809", "201812"]
+    assert all(result["success"] for result in results)
+    with open(results[0]["outputs"][0], "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(produced_data, prepared_data)
+
+
+def test_run_job_failed(tmp_path):
+    """
+    Checks a failing job is reported without stopping the others.
+    :param tmp_path: Pytest temporary directory.
+    :return Test Pass/Fail
+    """
+    results = ingest_local.run(config, [("BMI_SG", "2018"), ("BMI_SG", "201809")],
+                               str(tmp_path), 1)
+
+    assert not results[0]["success"]
+    assert "error" in results[0]
+    assert results[1]["success"]
+
+
+def test_parse_job():
+    """
+    Checks jobs are parsed from survey:period.
+    :return Test Pass/Fail
+    """
+    assert ingest_local.parse_job("BMI_SG:201809") == ("BMI_SG", "201809")
+    with pytest.raises(argparse.ArgumentTypeError):
+        ingest_local.parse_job("201809")
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+import ingest_metrics
+
+
+@pytest.fixture(autouse=True)
+def stop_metrics():
+    """
+    Makes sure no test leaves metrics turned on for the next one.
+    """
+    yield
+    ingest_metrics._stack.clear()
+
+
+def test_disabled(capsys):
+    """
+    Checks nothing is recorded or written when metrics are turned off.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    assert ingest_metrics.start(False, "module", "run") is None
+
+    with ingest_metrics.stage("stage"):
+        ingest_metrics.add("rows", 1)
+    assert ingest_metrics.measured("call")(lambda value: value * 2)(2) == 4
+    ingest_metrics.emit()
+
+    assert capsys.readouterr().out == ""
+
+
+def test_values_summed():
+    """
+    Checks repeated stages and counts are added together.
+    :return Test Pass/Fail
+    """
+    metrics = ingest_metrics.start(True, "module", "run")
+
+    ingest_metrics.add("rows", 2)
+    ingest_metrics.add("rows", 3)
+    ingest_metrics.add("payload_bytes", 10, ingest_metrics.BYTES)
+    for _ in range(2):
+        with ingest_metrics.stage("transform"):
+            pass
+    ingest_metrics.measured("invoke")(lambda: None)()
+
+    assert metrics.values["rows"] == 5
+    assert metrics.values["payload_bytes"] == 10
+    assert metrics.units == {"rows": ingest_metrics.COUNT,
+                             "payload_bytes": ingest_metrics.BYTES,
+                             "transform_time": ingest_metrics.MILLISECONDS,
+                             "invoke_time": ingest_metrics.MILLISECONDS}
+
+
+def test_stage_timed_on_error():
+    """
+    Checks a stage that raises is still timed, and the error passed on.
+    :return Test Pass/Fail
+    """
+    metrics = ingest_metrics.start(True, "module", "run")
+
+    with pytest.raises(KeyError):
+        with ingest_metrics.stage("transform"):
+            raise KeyError("question")
+
+    assert metrics.values["transform_time"] >= 0
+
+
+def test_emit(capsys):
+    """
+    Checks one EMF record is written to stdout and metrics stop once emitted.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    ingest_metrics.start(True, "module", "run", survey="066")
+    ingest_metrics.add("rows", 2)
+    ingest_metrics.add("payload_bytes", 10, ingest_metrics.BYTES)
+
+    ingest_metrics.emit()
+    ingest_metrics.add("rows", 1)
+    ingest_metrics.emit()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert not ingest_metrics._stack
+    record = json.loads(lines[0])
+    definition = record["_aws"]["CloudWatchMetrics"][0]
+    assert definition["Namespace"] == ingest_metrics.NAMESPACE
+    assert definition["Dimensions"] == [["module", "survey"]]
+    assert definition["Metrics"] == [{"Name": "rows", "Unit": "Count"},
+                                     {"Name": "payload_bytes", "Unit": "Bytes"}]
+    assert isinstance(record["_aws"]["Timestamp"], int)
+    assert record["module"] == "module"
+    assert record["survey"] == "066"
+    assert record["run_id"] == "run"
+    assert record["rows"] == 2
+    assert record["payload_bytes"] == 10
+
+
+def test_nested(capsys):
+    """
+    Checks an invocation started inside another, as a method run in the wrangler's
+    process is, records and emits separately.
+    :param capsys: Pytest capture of stdout.
+    :return Test Pass/Fail
+    """
+    outer = ingest_metrics.start(True, "wrangler", "run")
+    ingest_metrics.add("rows", 1)
+    ingest_metrics.start(False, "method", "run")
+    ingest_metrics.add("rows", 10)
+    ingest_metrics.emit()
+    inner = ingest_metrics.start(True, "method", "run")
+    ingest_metrics.add("rows", 100)
+    ingest_metrics.emit()
+    ingest_metrics.add("rows", 1000)
+    ingest_metrics.emit()
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert outer.values == {"rows": 1001}
+    assert inner.values == {"rows": 100}
+    assert [record["module"] for record in records] == ["method", "wrangler"]
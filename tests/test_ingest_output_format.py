@@ -0,0 +1,272 @@
+import gzip
+import json
+
+import pytest
+
+import ingest_output_format
+import ingest_plan
+from tests.conftest import question_labels, statuses, survey_codes
+
+
+@pytest.fixture
+def output_data(contributors):
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    builder = ingest_plan.ColumnarBuilder(plan)
+    builder.extend(contributors)
+    return builder.to_dataframe()
+
+
+def test_iter_chunks_json(output_data):
+    """
+    Checks the chunks join up to the same JSON as encoding all of the rows at once,
+    whether or not the rows divide into whole chunks.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    for chunk_rows in [1, 7, len(output_data), len(output_data) + 1]:
+        assert "".join(ingest_output_format.iter_chunks(
+            output_data, ingest_output_format.JSON, chunk_rows)) == \
+            ingest_output_format.encode(output_data, ingest_output_format.JSON)
+    assert "".join(ingest_output_format.iter_chunks(
+        output_data.iloc[0:0], ingest_output_format.JSON)) == "[]"
+
+
+def test_iter_chunks_ndjson(output_data):
+    """
+    Checks newline delimited output has one record per line, in order, however it
+    is chunked.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    expected_rows = json.loads(output_data.to_json(orient="records"))
+
+    for chunk_rows in [1, 7, len(output_data) + 1]:
+        produced = "".join(ingest_output_format.iter_chunks(
+            output_data, ingest_output_format.NDJSON, chunk_rows))
+        assert produced.endswith("\n")
+        assert [json.loads(line) for line in produced.splitlines()] == expected_rows
+    assert ingest_output_format.encode(output_data.iloc[0:0],
+                                       ingest_output_format.NDJSON) == ""
+
+
+def test_encode_rows():
+    """
+    Checks rows encoded either way decode to the same records.
+    :param None
+    :return Test Pass/Fail
+    """
+    rows = [{"a": 1, "b": "x"}, {"a": 2, "b": "é"}]
+
+    produced_json = ingest_output_format.encode_rows(rows, ingest_output_format.JSON)
+    produced_ndjson = ingest_output_format.encode_rows(rows,
+                                                       ingest_output_format.NDJSON)
+
+    assert json.loads(produced_json) == rows
+    assert [json.loads(line) for line in produced_ndjson.splitlines()] == rows
+
+
+def test_encode_same_bytes():
+    """
+    Checks output rows encode to the same bytes whichever way they are written,
+    with "/" and non-ASCII characters as they are and missing values as null.
+    :param None
+    :return Test Pass/Fail
+    """
+    import pandas as pd
+
+    rows = [{"enterprise_name": "Sand/Gravel Café Ω", "region": 3, "period": None},
+            {"enterprise_name": "Brick ✓", "region": 4, "period": "201809"}]
+    data = pd.DataFrame(rows)
+    expected = '[{"enterprise_name":"Sand/Gravel Café Ω","region":3,"period":null},' \
+        '{"enterprise_name":"Brick ✓","region":4,"period":"201809"}]'
+
+    assert ingest_output_format.encode(data, ingest_output_format.JSON) == expected
+    assert "".join(ingest_output_format.iter_chunks(
+        data, ingest_output_format.JSON, 1)) == expected
+    assert ingest_output_format.encode_rows(rows, ingest_output_format.JSON) == \
+        expected.encode("utf-8")
+    assert ingest_output_format.to_json(ingest_output_format.encode(
+        data, ingest_output_format.NDJSON)) == expected.encode("utf-8")
+    assert ingest_output_format.encode(data, ingest_output_format.NDJSON) == \
+        ingest_output_format.encode_rows(
+            rows, ingest_output_format.NDJSON).decode("utf-8")
+
+
+def test_to_json(output_data):
+    """
+    Checks newline delimited output converts to the same JSON array, and is told
+    apart from it.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    output_json = ingest_output_format.encode(output_data, ingest_output_format.JSON)
+    output_ndjson = ingest_output_format.encode(output_data,
+                                                ingest_output_format.NDJSON)
+
+    assert ingest_output_format.detect(output_json) == ingest_output_format.JSON
+    assert ingest_output_format.detect(output_ndjson.encode("utf-8")) == \
+        ingest_output_format.NDJSON
+    assert ingest_output_format.detect(b"") == ingest_output_format.NDJSON
+    with pytest.raises(ValueError, match="starts b'<html>'"):
+        ingest_output_format.detect(b"<html>")
+    with pytest.raises(ValueError):
+        ingest_output_format.detect(gzip.compress(output_json.encode("utf-8")))
+    assert ingest_output_format.to_json(output_ndjson) == output_json.encode("utf-8")
+    assert ingest_output_format.to_json(b"{\"a\":1}\r\n\n") == b"[{\"a\":1}]"
+    assert ingest_output_format.to_json(b"") == b"[]"
+
+
+def test_file_name():
+    """
+    Checks outputs get the extension of their format and compression, and uncompressed
+    JSON outputs keep the name they were given.
+    :param None
+    :return Test Pass/Fail
+    """
+    assert ingest_output_format.file_name("out.json", "json") == "out.json"
+    assert ingest_output_format.file_name("out", "json") == "out"
+    assert ingest_output_format.file_name("out.json", "json", "gzip") == "out.json.gz"
+    assert ingest_output_format.file_name("out.json", "ndjson", "zstd") == \
+        "out.ndjson.zst"
+    assert ingest_output_format.file_name("out.json", "parquet") == "out.parquet"
+    assert ingest_output_format.file_name("out", "parquet") == "out.parquet"
+    assert ".parquet.gz" in ingest_output_format.file_extensions()
+
+
+def test_parquet(output_data):
+    """
+    Checks a Parquet output, written a few row groups at a time, reads back as the
+    same rows with its string columns dictionary encoded and its questions int64.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    pyarrow = pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.parquet")
+
+    output = b"".join(ingest_output_format.iter_chunks(
+        output_data, ingest_output_format.PARQUET, chunk_rows=7))
+    parquet_file = pyarrow.parquet.ParquetFile(pyarrow.BufferReader(output))
+    schema = parquet_file.schema.to_arrow_schema()
+    produced_data = ingest_output_format.read_dataframe(output)
+
+    assert ingest_output_format.detect(output) == ingest_output_format.PARQUET
+    assert parquet_file.metadata.num_row_groups == -(-len(output_data) // 7)
+    assert pyarrow.types.is_dictionary(schema.field("survey").type)
+    assert pyarrow.types.is_dictionary(schema.field("responder_id").type)
+    assert schema.field("Q608_total").type == pyarrow.int64()
+    assert produced_data["Q608_total"].dtype == "int64"
+    assert json.loads(produced_data.to_json(orient="records")) == \
+        json.loads(output_data.to_json(orient="records"))
+    assert ingest_output_format.to_json(output).decode("utf-8") == \
+        ingest_output_format.encode(output_data, ingest_output_format.JSON)
+
+
+def test_parquet_large_response(output_data):
+    """
+    Checks a response too large for int64 fails a Parquet output with an error
+    naming its column.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.parquet")
+    output_data["Q602_building_soft_sand"] = \
+        output_data["Q602_building_soft_sand"].astype(object)
+    output_data.loc[len(output_data) - 1, "Q602_building_soft_sand"] = 2 ** 70
+
+    with pytest.raises(ValueError, match="Q602_building_soft_sand"):
+        b"".join(ingest_output_format.iter_chunks(
+            output_data, ingest_output_format.PARQUET, chunk_rows=7))
+
+
+def test_iter_frame_chunks(output_data):
+    """
+    Checks frames encoded one after another, each built on its own, join up to the
+    same output as encoding all of the rows at once.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    # Built on their own, so their categories differ.
+    frames = [output_data.iloc[:3].astype({"survey": "object"}),
+              output_data.iloc[3:3], output_data.iloc[3:]]
+
+    for output_format in [ingest_output_format.JSON, ingest_output_format.NDJSON]:
+        assert "".join(ingest_output_format.iter_frame_chunks(
+            iter(frames), output_format)) == \
+            ingest_output_format.encode(output_data, output_format)
+
+    pytest.importorskip("pyarrow")
+    output = b"".join(ingest_output_format.iter_frame_chunks(
+        iter(frames), ingest_output_format.PARQUET))
+
+    assert ingest_output_format.to_json(output).decode("utf-8") == \
+        ingest_output_format.encode(output_data, ingest_output_format.JSON)
+
+
+@pytest.mark.parametrize("output_format", ingest_output_format.FORMATS)
+def test_concatenate(output_data, output_format):
+    """
+    Checks outputs encoded separately, some of them empty, join up to the same output
+    as encoding all of the rows at once.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :param output_format: String - json, ndjson or parquet.
+    :return Test Pass/Fail
+    """
+    if output_format == ingest_output_format.PARQUET:
+        pytest.importorskip("pyarrow")
+    outputs = [ingest_output_format.encode(frame, output_format)
+               for frame in [output_data.iloc[:0], output_data.iloc[:3],
+                             output_data.iloc[3:3], output_data.iloc[3:]]]
+    outputs = [output if isinstance(output, bytes) else output.encode("utf-8")
+               for output in outputs]
+
+    produced = ingest_output_format.concatenate(outputs, output_format)
+
+    if output_format == ingest_output_format.PARQUET:
+        assert ingest_output_format.to_json(produced).decode("utf-8") == \
+            ingest_output_format.encode(output_data, ingest_output_format.JSON)
+        assert ingest_output_format.to_json(ingest_output_format.concatenate(
+            outputs[:1], output_format)) == b"[]"
+    else:
+        assert produced.decode("utf-8") == \
+            ingest_output_format.encode(output_data, output_format)
+        assert ingest_output_format.concatenate(outputs[:1], output_format) == \
+            outputs[0]
+
+
+def test_parquet_columns(output_data):
+    """
+    Checks only the columns asked for are read from a Parquet output.
+    :param output_data: DataFrame - The test snapshot's output rows.
+    :return Test Pass/Fail
+    """
+    pytest.importorskip("pyarrow")
+
+    output = ingest_output_format.encode(output_data, ingest_output_format.PARQUET)
+    produced_data = ingest_output_format.read_dataframe(
+        output, columns=["responder_id", "Q608_total"])
+
+    assert list(produced_data.columns) == ["responder_id", "Q608_total"]
+    assert produced_data["Q608_total"].tolist() == output_data["Q608_total"].tolist()
+
+
+def test_parquet_rows_and_payload():
+    """
+    Checks rows encode to Parquet and survive being passed in an invoke payload.
+    :param None
+    :return Test Pass/Fail
+    """
+    pytest.importorskip("pyarrow")
+    rows = [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+
+    output = ingest_output_format.encode_rows(rows, ingest_output_format.PARQUET)
+    payload_data = json.loads(json.dumps(
+        ingest_output_format.encode_payload_data(output)))
+
+    assert ingest_output_format.decode_payload_data(
+        payload_data, ingest_output_format.PARQUET) == output
+    assert json.loads(ingest_output_format.to_json(output)) == rows
+    assert ingest_output_format.encode_payload_data("[]") == "[]"
+    assert ingest_output_format.content_type(ingest_output_format.PARQUET) == \
+        ingest_output_format.PARQUET_CONTENT_TYPE
+    assert ingest_output_format.content_type(ingest_output_format.JSON) is None
@@ -0,0 +1,62 @@
+import os
+from unittest import mock
+
+import pytest
+
+import ingest_metrics
+import ingest_parallel
+
+
+def square_share(index, count):
+    ingest_metrics.add("rows", 1)
+    return [value * value for value in range(index, 10, count)]
+
+
+def test_map_shards():
+    """
+    Checks each worker's result comes back in index order, runs in its own process
+    and has its metrics added to the parent's.
+    :return Test Pass/Fail
+    """
+    metrics = ingest_metrics.start(True, "module", "run")
+    try:
+        results = ingest_parallel.map_shards(square_share, 3)
+        pids = ingest_parallel.map_shards(lambda index, count: os.getpid(), 2)
+    finally:
+        ingest_metrics._stack.clear()
+
+    assert results == [[0, 9, 36, 81], [1, 16, 49], [4, 25, 64]]
+    assert os.getpid() not in pids
+    assert metrics.values["rows"] == 3
+
+
+def test_map_shards_error():
+    """
+    Checks a worker's error is raised in the parent, and a worker dying without a
+    result is reported.
+    :return Test Pass/Fail
+    """
+    def fail_second(index, count):
+        if index == 1:
+            raise KeyError("survey")
+        return index
+
+    with pytest.raises(KeyError):
+        ingest_parallel.map_shards(fail_second, 2)
+    with pytest.raises(RuntimeError) as exc_info:
+        ingest_parallel.map_shards(lambda index, count: os._exit(3), 2)
+    assert "exited with code 3" in str(exc_info.value)
+
+
+@pytest.mark.parametrize("max_workers,size,expected", [
+    (4, 10, 1), (4, 45, 4), (4, 1000, 4), (2, 45, 2), (8, 45, 4)])
+def test_worker_count(max_workers, size, expected):
+    """
+    Checks small jobs run serially and workers are capped by CPUs and max_workers.
+    :param max_workers: Int - Most processes to use.
+    :param size: Int - Size of the job.
+    :param expected: Int - Processes expected.
+    :return Test Pass/Fail
+    """
+    with mock.patch("ingest_parallel.cpu_count", return_value=4):
+        assert ingest_parallel.worker_count(max_workers, size, 10) == expected
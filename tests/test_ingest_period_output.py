@@ -0,0 +1,70 @@
+import boto3
+from moto import mock_s3
+
+import ingest_period_output
+
+bucket_name = "test_bucket"
+rows = [["066", "201809", "1", "XX", "1", "a", 1, 2],
+        ["066", "201806", "1", "XX", "1", "a", 3, 2]]
+
+
+def test_iter_keeping_period():
+    """
+    Checks every row is passed through and only the period's rows are kept.
+    :param None
+    :return Test Pass/Fail
+    """
+    kept_rows = []
+
+    assert list(ingest_period_output.iter_keeping_period(
+        iter(rows), "201809", kept_rows)) == rows
+    assert kept_rows == rows[:1]
+
+
+def test_merge_rows():
+    """
+    Checks reused rows are merged in by survey, reference and period, ordering
+    surveys by their Take On code rather than their results code.
+    :param None
+    :return Test Pass/Fail
+    """
+    survey_codes = {"0066": "066", "0076": "009"}
+    current_rows = [["066", "201809", "1"], ["066", "201809", "3"],
+                    ["009", "201809", "2"]]
+    reused_rows = [["066", "201806", "1"], ["066", "201806", "2"],
+                   ["009", "201806", "1"], ["009", "201806", "2"]]
+
+    assert list(ingest_period_output.merge_rows(
+        iter(current_rows), reused_rows, survey_codes)) == [
+        ["066", "201806", "1"], ["066", "201809", "1"], ["066", "201806", "2"],
+        ["066", "201809", "3"], ["009", "201806", "1"], ["009", "201806", "2"],
+        ["009", "201809", "2"]]
+
+
+@mock_s3
+def test_period_rows():
+    """
+    Saves a period's rows, checking they are only loaded back for the same plan and
+    a recent enough snapshot.
+    :param None
+    :return Test Pass/Fail
+    """
+    s3_resource = boto3.resource("s3", region_name="eu-west-2")
+    s3_resource.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+    file_name = ingest_period_output.period_file_name("periods/", "BMI_SG", "201809")
+
+    assert file_name == "periods/BMI_SG-201809.json"
+    assert ingest_period_output.load_rows(s3_resource, bucket_name, file_name,
+                                          "plan", 0) is None
+
+    ingest_period_output.save_rows(s3_resource, bucket_name, file_name, "plan", 1000,
+                                   rows[:1])
+
+    assert ingest_period_output.load_rows(s3_resource, bucket_name, file_name,
+                                          "plan", 1000) == rows[:1]
+    assert ingest_period_output.load_rows(s3_resource, bucket_name, file_name,
+                                          "plan", 1001) is None
+    assert ingest_period_output.load_rows(s3_resource, bucket_name, file_name,
+                                          "other", 0) is None
@@ -0,0 +1,157 @@
+import json
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import ingest_plan
+import ingest_snapshot_parser
+from tests.conftest import question_labels, statuses, survey_codes
+
+
+def test_flatten(contributors):
+    """
+    Flattens the test snapshot's contributors and compares them, including column
+    order, with the prepared output.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_rows = json.loads(file_1.read())
+
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    produced_rows = [plan.flatten(contributor) for contributor in contributors]
+
+    assert produced_rows == prepared_rows
+    assert [list(row) for row in produced_rows] == \
+        [plan.columns] * len(prepared_rows)
+
+
+def test_get_plan_cached():
+    """
+    Checks plans are reused for the same ingestion parameters only.
+    :param None
+    :return Test Pass/Fail
+    """
+    plan = ingest_plan.get_plan(question_labels, survey_codes, statuses)
+    reordered_labels = dict(reversed(list(question_labels.items())))
+
+    assert ingest_plan.get_plan(dict(question_labels), survey_codes, statuses) is plan
+    assert ingest_plan.get_plan(reordered_labels, survey_codes, statuses) is not plan
+    assert ingest_plan.get_plan(question_labels, {"0066": "066"}, statuses) \
+        is not plan
+
+
+def test_columnar_builder(contributors):
+    """
+    Builds the test snapshot's contributors into columns and compares the output
+    with the prepared output.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_method_prepared_output.json", "r") as file_1:
+        prepared_rows = json.loads(file_1.read())
+
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    builder = ingest_plan.ColumnarBuilder(plan)
+    builder.extend(contributors)
+    produced_data = builder.to_dataframe()
+
+    assert len(builder) == len(prepared_rows)
+    assert list(produced_data.columns) == plan.columns
+    assert produced_data["survey"].dtype == "category"
+    assert produced_data["Q608_total"].dtype == "int64"
+    assert json.loads(builder.to_json()) == prepared_rows
+
+
+def test_columnar_builder_large_response(contributors):
+    """
+    Checks responses too large for int64 are kept, in the question columns they
+    are in, rather than failing the build.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    for question in contributors[1][ingest_snapshot_parser.RESPONSES_KEY]["nodes"]:
+        if question["questioncode"] == "0601":
+            question["response"] = str(2 ** 63)
+        elif question["questioncode"] == "0602":
+            question["response"] = str(2 ** 70)
+
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    builder = ingest_plan.ColumnarBuilder(plan)
+    builder.extend(contributors)
+    produced_data = builder.to_dataframe()
+
+    assert len(builder) == len(contributors)
+    assert produced_data["Q602_building_soft_sand"][1] == 2 ** 70
+    assert produced_data["Q603_concreting_sand"].dtype == "int64"
+    assert builder.to_json() == json.dumps(
+        [plan.flatten(contributor) for contributor in contributors],
+        separators=(",", ":"), ensure_ascii=False)
+
+
+def test_columnar_builder_empty():
+    """
+    Checks an empty builder still produces a JSON array.
+    :param None
+    :return Test Pass/Fail
+    """
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+
+    assert json.loads(ingest_plan.ColumnarBuilder(plan).to_json()) == []
+
+
+def test_iter_column_chunks(contributors):
+    """
+    Checks rows are split between builders of the chunk size, in order, and no rows
+    still give one empty builder.
+    :param contributors: List - The test snapshot's contributors.
+    :return Test Pass/Fail
+    """
+    plan = ingest_plan.IngestPlan(question_labels, survey_codes, statuses)
+    rows = [plan.values(contributor) for contributor in contributors]
+
+    builders = list(ingest_plan.iter_column_chunks(plan, iter(rows), 7))
+
+    assert [len(builder) for builder in builders] == \
+        [7] * (len(rows) // 7) + ([len(rows) % 7] if len(rows) % 7 else [])
+    assert [row for builder in builders for row in builder.iter_rows()] == \
+        [dict(zip(plan.columns, row)) for row in rows]
+    assert [len(builder) for builder in ingest_plan.iter_column_chunks(
+        plan, iter([]), 7)] == [0]
+
+
+def test_expand_brick_types():
+    """
+    Expands the test bricks data and compares it, including column order, with the
+    prepared output. Respondents without a known brick type get 0 in every brick
+    type column.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_bricks_wrangler_to_method_runtime.json", "r") as \
+            file_1:
+        runtime_variables = json.loads(file_1.read())
+    with open("tests/fixtures/test_bricks_method_input.json", "r") as file_2:
+        input_data = pd.DataFrame(json.loads(file_2.read()))
+    with open("tests/fixtures/test_bricks_method_prepared_output.json", "r") as file_3:
+        prepared_data = pd.DataFrame(json.loads(file_3.read()))
+
+    produced_data = ingest_plan.expand_brick_types(
+        input_data, runtime_variables["brick_questions"],
+        runtime_variables["brick_types"], runtime_variables["brick_type_column"])
+
+    assert_frame_equal(produced_data, prepared_data)
+
+    # Expanding data that has already been expanded leaves it as it is.
+    assert_frame_equal(ingest_plan.expand_brick_types(
+        produced_data, runtime_variables["brick_questions"],
+        runtime_variables["brick_types"], runtime_variables["brick_type_column"]),
+        prepared_data)
+
+    input_data["brick_type"] = 0
+    produced_data = ingest_plan.expand_brick_types(
+        input_data, runtime_variables["brick_questions"],
+        runtime_variables["brick_types"], runtime_variables["brick_type_column"])
+
+    assert list(produced_data.columns) == list(prepared_data.columns)
+    assert (produced_data["clay_produced_commons"] == 0).all()
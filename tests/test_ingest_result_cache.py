@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import boto3
+from moto import mock_s3
+
+import ingest_result_cache
+from tests.conftest import ingestion_parameters, question_labels, statuses, survey_codes
+
+bucket_name = "test_bucket"
+
+
+def test_cache_key():
+    """
+    Checks the key changes with anything that changes the ingest's output.
+    :param None
+    :return Test Pass/Fail
+    """
+    key = ingest_result_cache.cache_key('"etag"', "201809", "03", "BMI_SG",
+                                        ingestion_parameters)
+
+    assert key == ingest_result_cache.cache_key('"etag"', "201809", "03", "BMI_SG",
+                                                dict(ingestion_parameters))
+    assert key != ingest_result_cache.cache_key('"other"', "201809", "03", "BMI_SG",
+                                                ingestion_parameters)
+    assert key != ingest_result_cache.cache_key('"etag"', "201812", "03", "BMI_SG",
+                                                ingestion_parameters)
+    assert key != ingest_result_cache.cache_key('"etag"', "201809", "03", "BMI_SG",
+                                                ingestion_parameters, "ndjson")
+
+    reordered = dict(ingestion_parameters,
+                     question_labels=dict(reversed(list(question_labels.items()))))
+    assert key != ingest_result_cache.cache_key('"etag"', "201809", "03", "BMI_SG",
+                                                reordered)
+
+    # The order of the survey codes and statuses doesn't change the output.
+    reordered = {
+        "statuses": dict(reversed(list(statuses.items()))),
+        "survey_codes": dict(reversed(list(survey_codes.items()))),
+        "question_labels": question_labels
+    }
+    assert key == ingest_result_cache.cache_key('"etag"', "201809", "03", "BMI_SG",
+                                                reordered)
+
+
+@mock_s3
+def test_cached_output():
+    """
+    Checks outputs are returned until they are older than the TTL, then removed.
+    :param None
+    :return Test Pass/Fail
+    """
+    s3_resource = boto3.resource("s3", region_name="eu-west-2")
+    s3_resource.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+    file_name = ingest_result_cache.cache_file_name("cache/", "abc")
+
+    assert ingest_result_cache.get_cached_output(
+        s3_resource, bucket_name, file_name, 60) is None
+
+    ingest_result_cache.put_cached_output(s3_resource, bucket_name, file_name,
+                                          '[{"a": 1}]')
+
+    assert file_name == "cache/abc.json"
+    assert ingest_result_cache.get_cached_output(
+        s3_resource, bucket_name, file_name, 60) == b'[{"a": 1}]'
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=120)
+    with mock.patch("ingest_result_cache.datetime") as mock_datetime:
+        mock_datetime.now.return_value = later
+        assert ingest_result_cache.get_cached_output(
+            s3_resource, bucket_name, file_name, 60) is None
+
+    assert list(s3_resource.Bucket(bucket_name).objects.all()) == []
+    assert ingest_result_cache.cache_file_name("cache/", "abc", "parquet") == \
+        "cache/abc.parquet"
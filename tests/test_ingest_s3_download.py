@@ -0,0 +1,104 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_s3
+
+import ingest_s3_download
+import ingest_snapshot_parser
+from tests.conftest import periods, survey_codes
+
+bucket_name = "test_bucket"
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+            client.put_object(Bucket=bucket_name, Key="test_ingest_input.json",
+                              Body=file_1.read())
+        yield client
+
+
+def test_part_ranges():
+    """
+    Checks parts cover the whole object without overlapping.
+    :param None
+    :return Test Pass/Fail
+    """
+    assert ingest_s3_download.part_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert ingest_s3_download.part_ranges(8, 4) == [(0, 4), (4, 8)]
+    assert ingest_s3_download.part_ranges(0, 4) == []
+
+
+@pytest.mark.parametrize("part_size", [100000, 1000000, 100000000])
+def test_download(s3_client, part_size):
+    """
+    Downloads the test snapshot in parts of different sizes.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param part_size: Int - Largest part to download in one request.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        snapshot = file_1.read()
+
+    buffer = ingest_s3_download.download(s3_client, bucket_name,
+                                         "test_ingest_input.json",
+                                         part_size=part_size)
+
+    assert isinstance(buffer, bytearray)
+    assert buffer == snapshot
+
+
+@pytest.mark.parametrize("part_size", [1000, 100000000])
+def test_download_range(s3_client, part_size):
+    """
+    Downloads part of the test snapshot, in parts of different sizes.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param part_size: Int - Largest part to download in one request.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        snapshot = file_1.read()
+
+    buffer = ingest_s3_download.download_range(s3_client, bucket_name,
+                                               "test_ingest_input.json", 1234, 5678,
+                                               part_size=part_size)
+
+    assert buffer == snapshot[1234:5678]
+
+
+def test_download_if_match(s3_client):
+    """
+    Checks the download fails if the object isn't the version expected.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :return Test Pass/Fail
+    """
+    e_tag = s3_client.head_object(Bucket=bucket_name,
+                                  Key="test_ingest_input.json")["ETag"]
+
+    ingest_s3_download.download(s3_client, bucket_name, "test_ingest_input.json",
+                                part_size=500000, if_match=e_tag)
+    with pytest.raises(ClientError):
+        ingest_s3_download.download(s3_client, bucket_name, "test_ingest_input.json",
+                                    part_size=500000, if_match='"other"')
+
+
+def test_parse_buffer(s3_client):
+    """
+    Checks the parser reads a downloaded buffer the same as the bytes.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        snapshot = file_1.read()
+
+    buffer = ingest_s3_download.download(s3_client, bucket_name,
+                                         "test_ingest_input.json", part_size=300000)
+
+    assert list(ingest_snapshot_parser.iter_contributors(
+        buffer, survey_codes, periods, chunk_size=1000)) == \
+        list(ingest_snapshot_parser.iter_contributors(snapshot, survey_codes, periods))
@@ -0,0 +1,133 @@
+import gzip
+import os
+
+import boto3
+import pytest
+from moto import mock_s3
+
+import ingest_s3_upload
+
+bucket_name = "test_bucket"
+part_size = ingest_s3_upload.MIN_PART_SIZE
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        yield client
+
+
+def make_chunks(count, size=1000000):
+    """
+    :param count: Int - Number of chunks.
+    :param size: Int - Bytes per chunk.
+    :return: List of Bytes - Chunks of random data.
+    """
+    return [os.urandom(size) for _ in range(count)]
+
+
+def test_upload_small(s3_client):
+    """
+    Checks an object smaller than a part is written with a single put.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :return Test Pass/Fail
+    """
+    upload = ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "small.json")
+    ingest_s3_upload.upload_chunks(["[", '{"a":1}', "]"], [upload])
+
+    produced_file = s3_client.get_object(Bucket=bucket_name, Key="small.json")
+    assert produced_file["Body"].read() == b'[{"a":1}]'
+    assert upload.size == 9
+    assert "ContentEncoding" not in produced_file
+
+
+def test_upload_multipart(s3_client):
+    """
+    Checks an object of several parts, with a short last part, is put back together.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :return Test Pass/Fail
+    """
+    chunks = make_chunks(12)
+
+    upload = ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "large.json",
+                                              part_size)
+    ingest_s3_upload.upload_chunks(chunks, [upload])
+
+    produced_file = s3_client.get_object(Bucket=bucket_name, Key="large.json")
+    assert produced_file["Body"].read() == b"".join(chunks)
+    assert upload.size == sum(len(chunk) for chunk in chunks)
+
+
+def test_upload_compressed(s3_client):
+    """
+    Checks a compressed upload decompresses to the chunks and has a
+    Content-Encoding.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :return Test Pass/Fail
+    """
+    chunks = make_chunks(12)
+
+    ingest_s3_upload.upload_chunks(
+        chunks, [ingest_s3_upload.MultipartUpload(s3_client, bucket_name,
+                                                  "large.json.gz", part_size,
+                                                  "gzip")])
+
+    produced_file = s3_client.get_object(Bucket=bucket_name, Key="large.json.gz")
+    assert produced_file["ContentEncoding"] == "gzip"
+    assert gzip.decompress(produced_file["Body"].read()) == b"".join(chunks)
+
+
+@pytest.mark.parametrize("chunk_count", [1, 12])
+def test_upload_content_type(s3_client, chunk_count):
+    """
+    Checks the Content-Type is set whether or not the object is uploaded in parts.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :param chunk_count: Int - Number of 1MB chunks to upload.
+    :return Test Pass/Fail
+    """
+    ingest_s3_upload.upload_chunks(
+        make_chunks(chunk_count),
+        [ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "output.parquet",
+                                          part_size,
+                                          content_type="application/vnd.apache.parquet")])
+
+    produced_file = s3_client.head_object(Bucket=bucket_name, Key="output.parquet")
+    assert produced_file["ContentType"] == "application/vnd.apache.parquet"
+
+
+def test_upload_aborted(s3_client):
+    """
+    Checks that when the chunks fail part way through, every upload is aborted and
+    the error is raised.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :return Test Pass/Fail
+    """
+    def failing_chunks():
+        yield from make_chunks(12)
+        raise KeyError("survey")
+
+    with pytest.raises(KeyError):
+        ingest_s3_upload.upload_chunks(
+            failing_chunks(),
+            [ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "failed.json",
+                                              part_size),
+             ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "cached.json",
+                                              part_size)])
+
+    assert "Uploads" not in s3_client.list_multipart_uploads(Bucket=bucket_name)
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket_name)
+
+
+def test_part_size_too_small(s3_client):
+    """
+    Checks parts smaller than S3 allows are refused.
+    :param s3_client: Boto3 S3 client, on an empty moto bucket.
+    :return Test Pass/Fail
+    """
+    with pytest.raises(ValueError):
+        ingest_s3_upload.MultipartUpload(s3_client, bucket_name, "small.json",
+                                         part_size - 1)
@@ -0,0 +1,137 @@
+import gzip
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_s3
+
+import ingest_snapshot_cache
+import ingest_snapshot_parser
+from tests.conftest import periods, survey_codes
+
+bucket_name = "test_bucket"
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="eu-west-2")
+        client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+            raw_snapshot = file_1.read()
+        client.put_object(Bucket=bucket_name, Key="snapshot.json", Body=raw_snapshot)
+        client.put_object(Bucket=bucket_name, Key="snapshot.json.gz",
+                          Body=gzip.compress(raw_snapshot))
+        ingest_snapshot_cache._loaded_index.clear()
+        yield client
+
+
+@pytest.mark.parametrize("file_name", ["snapshot.json", "snapshot.json.gz"])
+def test_open_snapshot(s3_client, tmp_path, file_name):
+    """
+    Checks a snapshot is saved uncompressed on the first read and reused after, and
+    its indexed contributors match the streamed ones.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param tmp_path: Pytest temporary directory.
+    :param file_name: String - Snapshot to read, plain or gzipped.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file_1:
+        raw_snapshot = file_1.read()
+
+    snapshot = ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, file_name,
+                                                   10000000, directory=str(tmp_path))
+    with mock.patch.object(s3_client, "get_object") as mock_get:
+        reused = ingest_snapshot_cache.open_snapshot(
+            s3_client, bucket_name, file_name, 10000000, directory=str(tmp_path))
+
+    with open(snapshot.path, "rb") as file_2:
+        assert file_2.read() == raw_snapshot
+    assert not mock_get.called
+    assert reused.path == snapshot.path
+    assert list(reused.iter_contributors(survey_codes, periods)) == \
+        list(ingest_snapshot_parser.iter_contributors(raw_snapshot, survey_codes,
+                                                      periods))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(snapshot.path),
+         os.path.basename(snapshot.path)[:-len(".json")] + ".index"])
+
+
+def test_open_snapshot_evicts(s3_client, tmp_path):
+    """
+    Checks the least recently used snapshot is evicted to make room, and snapshots
+    too large for the cache aren't kept.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param tmp_path: Pytest temporary directory.
+    :return Test Pass/Fail
+    """
+    size = os.path.getsize("tests/fixtures/test_ingest_input.json")
+    max_size = size * 5 // 2
+    directory = str(tmp_path)
+    for key in ["first.json", "second.json", "third.json"]:
+        s3_client.copy_object(Bucket=bucket_name, Key=key,
+                              CopySource={"Bucket": bucket_name,
+                                          "Key": "snapshot.json"})
+
+    first = ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, "first.json",
+                                                max_size, directory=directory)
+    second = ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, "second.json",
+                                                 max_size, directory=directory)
+    # Using the first again leaves the second least recently used.
+    os.utime(second.path[:-len(".json")] + ".index", (0, 0))
+    ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, "first.json",
+                                        max_size, directory=directory)
+    third = ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, "third.json",
+                                                max_size, directory=directory)
+
+    assert os.path.exists(first.path)
+    assert not os.path.exists(second.path)
+    assert os.path.exists(third.path)
+    assert ingest_snapshot_cache.open_snapshot(
+        s3_client, bucket_name, "snapshot.json", size - 1, directory=directory) is None
+    assert len(os.listdir(directory)) == 4
+
+
+def test_open_snapshot_cleans_up(s3_client, tmp_path):
+    """
+    Checks nothing is left behind by a snapshot that fails to index, and parts left
+    by an earlier failure are removed.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param tmp_path: Pytest temporary directory.
+    :return Test Pass/Fail
+    """
+    s3_client.put_object(Bucket=bucket_name, Key="truncated.json",
+                         Body=b'{"data": {"allSurveys": {"nodes": [{"survey": "00')
+    (tmp_path / "left-behind.tmp").write_bytes(b"{")
+    os.utime(tmp_path / "left-behind.tmp", (0, 0))
+
+    with pytest.raises(ingest_snapshot_parser.SnapshotFormatError):
+        ingest_snapshot_cache.open_snapshot(s3_client, bucket_name, "truncated.json",
+                                            10000000, directory=str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_open_snapshot_shared(s3_client, tmp_path):
+    """
+    Checks parts still being written by another process sharing the cache are left
+    alone, and the snapshot is cached beside them.
+    :param s3_client: Boto3 S3 client, on a moto bucket holding the test snapshot.
+    :param tmp_path: Pytest temporary directory.
+    :return Test Pass/Fail
+    """
+    # Another snapshot's parts, before and after the snapshot is moved into place.
+    other_parts = ["otherabc.tmp", "other.json"]
+    for name in other_parts:
+        (tmp_path / name).write_bytes(b"{")
+
+    snapshot = ingest_snapshot_cache.open_snapshot(s3_client, bucket_name,
+                                                   "snapshot.json", 10000000,
+                                                   directory=str(tmp_path))
+
+    entry_name = os.path.basename(snapshot.path)[:-len(".json")]
+    assert sorted(os.listdir(tmp_path)) == \
+        sorted(other_parts + [entry_name + ".json", entry_name + ".index"])
@@ -0,0 +1,253 @@
+import io
+import json
+
+import pytest
+
+import ingest_metrics
+import ingest_snapshot_parser
+from tests.conftest import periods, survey_codes
+
+
+def expected_contributors(snapshot, fields=None):
+    contributors = []
+    for survey in snapshot["data"]["allSurveys"]["nodes"]:
+        if survey["survey"] in survey_codes:
+            for contributor in survey["contributorsBySurvey"]["nodes"]:
+                if contributor["period"] in periods:
+                    if fields is not None:
+                        contributor = {
+                            key: value for key, value in contributor.items()
+                            if key in fields or
+                            key == ingest_snapshot_parser.RESPONSES_KEY}
+                    contributors.append(contributor)
+    return contributors
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1024, 65536])
+def test_iter_contributors(chunk_size):
+    """
+    Streams the contributors out of the test snapshot in chunks small enough to
+    split every kind of token.
+    :param chunk_size: Number of bytes read at a time.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file:
+        raw_snapshot = file.read()
+
+    produced = list(ingest_snapshot_parser.iter_contributors(
+        io.BytesIO(raw_snapshot), survey_codes, periods, chunk_size=chunk_size))
+
+    assert produced
+    assert produced == expected_contributors(json.loads(raw_snapshot))
+
+
+def test_iter_contributors_projection():
+    """
+    Checks only the requested contributor fields are kept.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "r") as file:
+        raw_snapshot = file.read()
+    fields = ["period", "reference", "survey"]
+
+    produced = list(ingest_snapshot_parser.iter_contributors(
+        raw_snapshot, survey_codes, periods, fields=fields))
+
+    assert produced == expected_contributors(json.loads(raw_snapshot), fields)
+
+
+def test_iter_contributors_escapes():
+    """
+    Checks strings with escapes and brackets are stepped over and decoded correctly.
+    :param None
+    :return Test Pass/Fail
+    """
+    snapshot = {"data": {"allSurveys": {"nodes": [{
+        "formsBySurvey": {"nodes": [{"text": "{[\"}]\\"}]},
+        "survey": "0066",
+        "contributorsBySurvey": {"nodes": [
+            {"reference": "a\"b", "period": "201809", "survey": "0066",
+             "responsesByReferenceAndPeriodAndSurvey": {"nodes": []}},
+            {"reference": "c", "period": "201803", "survey": "0066",
+             "responsesByReferenceAndPeriodAndSurvey": {"nodes": [{"x": "]"}]}}
+        ]}
+    }]}}}
+
+    produced = list(ingest_snapshot_parser.iter_contributors(
+        io.BytesIO(json.dumps(snapshot).encode("utf-8")), survey_codes, periods,
+        chunk_size=3))
+
+    assert produced == [snapshot["data"]["allSurveys"]["nodes"][0]
+                        ["contributorsBySurvey"]["nodes"][0]]
+
+
+@pytest.mark.parametrize("encode", [False, True])
+def test_iter_contributors_encodings(encode):
+    """
+    Checks non-ASCII strings are decoded from str and bytes sources, and a
+    contributor whose period is written with escapes isn't passed over.
+    :param encode: Boolean - Whether to give the snapshot as bytes.
+    :return Test Pass/Fail
+    """
+    raw_snapshot = ('{"data": {"allSurveys": {"nodes": [{"survey": "0066", '
+                    '"contributorsBySurvey": {"nodes": ['
+                    '{"enterprisename": "Café [Ω]", "period": "201809", '
+                    '"survey": "0066"}, '
+                    '{"enterprisename": "✓", "period": "20180\\u0036", '
+                    '"survey": "0066"}, '
+                    '{"enterprisename": "x", "period": "201803", '
+                    '"survey": "0066"}]}}]}}}')
+    if encode:
+        raw_snapshot = io.BytesIO(raw_snapshot.encode("utf-8"))
+
+    produced = list(ingest_snapshot_parser.iter_contributors(
+        raw_snapshot, survey_codes, periods, chunk_size=16))
+
+    assert produced == [
+        {"enterprisename": "Café [Ω]", "period": "201809", "survey": "0066"},
+        {"enterprisename": "✓", "period": "201806", "survey": "0066"}]
+
+
+def test_iter_contributors_invalid():
+    """
+    Checks a truncated snapshot raises an error.
+    :param None
+    :return Test Pass/Fail
+    """
+    with pytest.raises(ingest_snapshot_parser.SnapshotFormatError):
+        list(ingest_snapshot_parser.iter_contributors(
+            '{"data": {"allSurveys": {"nodes": [{"survey": "00',
+            survey_codes, periods))
+
+
+def test_iter_contributors_shards():
+    """
+    Checks the shards split the contributors between them and merge back into
+    snapshot order.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "r") as file:
+        raw_snapshot = file.read()
+    shard_count = 5
+
+    shard_outputs = [
+        list(ingest_snapshot_parser.iter_contributors(
+            raw_snapshot, survey_codes, periods, shard=(shard_index, shard_count)))
+        for shard_index in range(shard_count)]
+    merged = [contributor for shard in zip(*shard_outputs)
+              for contributor in shard]
+    merged += [shard[-1] for shard in shard_outputs
+               if len(shard) > len(shard_outputs[-1])]
+
+    assert all(shard_outputs)
+    assert merged == expected_contributors(json.loads(raw_snapshot))
+
+
+@pytest.mark.parametrize("shard_count", [1, 3, 1000])
+def test_split_ranges(shard_count):
+    """
+    Splits the test snapshot's contributors between shards by byte range, checking
+    each shard's spans read on their own give its share, and the shares in order
+    give every contributor.
+    :param shard_count: Int - Number of shards, more than there are contributors in
+        the last case.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file:
+        raw_snapshot = file.read()
+
+    ranges = ingest_snapshot_parser.find_contributor_ranges(
+        io.BytesIO(raw_snapshot), survey_codes, periods, chunk_size=1024)
+    shard_spans = ingest_snapshot_parser.split_ranges(ranges, shard_count)
+    shard_outputs = [
+        list(ingest_snapshot_parser.decode_contributors(
+            (text for start, end in spans
+             for text in ingest_snapshot_parser.iter_span_texts(
+                 raw_snapshot[start:end], survey_codes, periods)),
+            survey_codes, periods))
+        for spans in shard_spans]
+
+    assert len(shard_spans) == shard_count
+    assert [contributor for shard in shard_outputs for contributor in shard] == \
+        expected_contributors(json.loads(raw_snapshot))
+    if shard_count < len(ranges):
+        assert all(shard_outputs)
+        # Each shard reads a span per array it has contributors from, not one per
+        # contributor.
+        assert sum(len(spans) for spans in shard_spans) < len(ranges)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 65536])
+def test_index_contributors(chunk_size):
+    """
+    Indexes the test snapshot, checking the contributors decoded from their byte
+    ranges are those the streaming parser finds, in the same order and shards.
+    :param chunk_size: Number of bytes read at a time.
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file:
+        raw_snapshot = file.read()
+
+    index = ingest_snapshot_parser.index_contributors(io.BytesIO(raw_snapshot),
+                                                      chunk_size)
+
+    assert list(ingest_snapshot_parser.iter_indexed_contributors(
+        raw_snapshot, index, survey_codes, periods)) == \
+        expected_contributors(json.loads(raw_snapshot))
+    assert list(ingest_snapshot_parser.iter_indexed_contributors(
+        raw_snapshot, index, survey_codes, periods, shard=(1, 3))) == \
+        list(ingest_snapshot_parser.iter_contributors(
+            raw_snapshot, survey_codes, periods, shard=(1, 3)))
+
+
+def test_indexed_contributors_scanned():
+    """
+    Checks reading an indexed snapshot counts the contributors scanned as streaming
+    it does, every contributor of the surveys read, whatever the shard.
+    :param None
+    :return Test Pass/Fail
+    """
+    with open("tests/fixtures/test_ingest_input.json", "rb") as file:
+        raw_snapshot = file.read()
+    index = ingest_snapshot_parser.index_contributors(raw_snapshot)
+
+    scanned = []
+    for contributors in [
+            ingest_snapshot_parser.iter_contributors(raw_snapshot, survey_codes,
+                                                     periods),
+            ingest_snapshot_parser.iter_indexed_contributors(
+                raw_snapshot, index, survey_codes, periods),
+            ingest_snapshot_parser.iter_indexed_contributors(
+                raw_snapshot, index, survey_codes, periods, shard=(1, 3))]:
+        metrics = ingest_metrics.start(True, "module", "run")
+        list(contributors)
+        ingest_metrics.emit()
+        scanned.append(metrics.values["contributors_scanned"])
+
+    assert scanned == [scanned[0]] * 3
+    assert scanned[0] == sum(
+        len(survey["contributorsBySurvey"]["nodes"])
+        for survey in json.loads(raw_snapshot)["data"]["allSurveys"]["nodes"]
+        if survey["survey"] in survey_codes)
+
+
+def test_index_contributors_non_ascii():
+    """
+    Checks the byte ranges are right after multi-byte characters.
+    :param None
+    :return Test Pass/Fail
+    """
+    contributors = [
+        {"enterprisename": "Café Ltd – Ω", "period": "201809", "survey": "0066"},
+        {"enterprisename": "Brick ✓", "period": "201806", "survey": "0066"}]
+    raw_snapshot = json.dumps({"data": {"allSurveys": {"nodes": [{
+        "survey": "0066", "description": "Sand & Gravel ✓",
+        "contributorsBySurvey": {"nodes": contributors}}]}}},
+        ensure_ascii=False).encode("utf-8")
+
+    index = ingest_snapshot_parser.index_contributors(bytearray(raw_snapshot), 5)
+
+    assert list(ingest_snapshot_parser.iter_indexed_contributors(
+        raw_snapshot, index, survey_codes, periods)) == contributors
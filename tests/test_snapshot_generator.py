@@ -0,0 +1,52 @@
+import io
+import json
+
+import pandas as pd
+
+import ingest_plan
+import ingest_snapshot_parser
+from benchmarks import snapshot_generator
+
+
+def test_snapshot_ingested():
+    """
+    Checks a generated snapshot is valid JSON and the ingest finds the contributors
+    for the two periods it keeps.
+    :return Test Pass/Fail
+    """
+    file = io.BytesIO()
+    snapshot_generator.write_snapshot(file, 40, surveys=2, periods=4, responses=3,
+                                      form_bloat=2)
+    parameters = snapshot_generator.ingestion_parameters(surveys=2, responses=3)
+
+    snapshot = json.loads(file.getvalue())
+    contributors = list(ingest_snapshot_parser.iter_contributors(
+        file.getvalue(), parameters["survey_codes"], ("201809", "201806")))
+    plan = ingest_plan.get_plan(parameters["question_labels"],
+                                parameters["survey_codes"], parameters["statuses"])
+
+    surveys = snapshot["data"]["allSurveys"]["nodes"]
+    assert [len(survey["contributorsBySurvey"]["nodes"]) for survey in surveys] == \
+        [20, 20]
+    assert len(surveys[0]["formsBySurvey"]["nodes"]) == 2
+    assert len(contributors) == 20
+    assert all(len(plan.values(contributor)) == len(plan.columns)
+               for contributor in contributors)
+
+
+def test_brick_rows_expanded():
+    """
+    Checks generated brick rows expand into a column per brick type.
+    :return Test Pass/Fail
+    """
+    file = io.BytesIO()
+    snapshot_generator.write_brick_rows(file, 30)
+    parameters = snapshot_generator.brick_ingestion_parameters()
+
+    data = ingest_plan.expand_brick_types(
+        pd.DataFrame(json.loads(file.getvalue())), parameters["brick_questions"],
+        parameters["brick_types"], parameters["brick_type_column"])
+
+    assert len(data) == 30
+    assert "clay_produced_commons" in data.columns
+    assert "produced_commons" not in data.columns